@@ -43,6 +43,9 @@ class GatewayManagerApi(GatewayScientistApi):
     def delete(self, name):
         return self._api.delete(name)
 
+    def pin(self, name, is_pinned):
+        return self._api.pin(name, is_pinned)
+
     def exists(self, name):
         return self._api.exists(name)
 
@@ -53,3 +56,6 @@ class GatewayManagerApi(GatewayScientistApi):
 class GatewayAdminApi(GatewayManagerApi):
     def __init__(self, gateway_uri):
         super(GatewayAdminApi, self).__init__(gateway_uri)
+
+    def get_cache_statistics(self):
+        return self._api.get_cache_statistics()
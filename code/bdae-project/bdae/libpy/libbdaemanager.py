@@ -165,6 +165,29 @@ class PyBDAEManager(PyBDAEScientist):
 
         verify_error(self._api.delete(name))
 
+    def pin_dataset(self, name):
+        """
+        Keeps the blocks of the dataset in memory on the storage nodes, such that jobs on it never read from disk.
+        The blocks are kept within the block cache size of the storage nodes.
+
+        :param name: Name of the dataset
+        :type name: str
+        :raises: DatasetNotExistsException: If the name of the dataset doesn't exists
+        """
+
+        verify_error(self._api.pin(name, True))
+
+    def unpin_dataset(self, name):
+        """
+        Releases the blocks of a dataset pinned by :func:`pin_dataset`, which are then evicted like any other blocks
+
+        :param name: Name of the dataset
+        :type name: str
+        :raises: DatasetNotExistsException: If the name of the dataset doesn't exists
+        """
+
+        verify_error(self._api.pin(name, False))
+
     def update_dataset(self, name):
         """
         Updates the dataset by name based on the file it was originally created from
@@ -7,7 +7,6 @@ from Bio import SeqIO
 from Bio.Blast.NCBIWWW import qblast
 
 from bdae.dataset import AbsMapReduceDataset
-from sofa.foundation.base import load_data_by_path
 
 
 class FastaDataset(AbsMapReduceDataset):
@@ -24,7 +23,8 @@ class FastaDataset(AbsMapReduceDataset):
             yield seqio.seq
 
     def preprocess(self, data_ref):
-        return SeqIO.parse(load_data_by_path(data_ref), "fasta")
+        # Parses the records one at a time from the file
+        return SeqIO.parse(data_ref, "fasta")
 
 
 def sink(blocks):
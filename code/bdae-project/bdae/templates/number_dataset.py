@@ -26,6 +26,9 @@ class NumpyArrayDataset(AbsMapReduceDataset):
     def is_serialized(self):
         return True
 
+    def is_native_array(self):
+        return True
+
     def get_map_functions(self):
         return module_binder(numpy, map_function_binder, ['floor', 'ceil', 'round', 'sum'])
 
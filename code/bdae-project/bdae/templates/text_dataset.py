@@ -11,6 +11,39 @@ from bdae.templates.import_utils import map_function_binder, module_binder, redu
 from bdae.dataset import AbsMapReduceDataset
 
 
+def _last_whitespace(text):
+    # The last word may continue in the next chunk
+    return max(text.rfind(whitespace) for whitespace in string.whitespace) + 1
+
+
+def _last_sentence(text):
+    # The last sentence may continue in the next chunk
+    sentences = sent_tokenize(text)
+    return max(text.rfind(sentences[-1]), 0) if len(sentences) > 1 else 0
+
+
+def _complete_parts(data, find_end):
+    """
+    Yields the data in parts, which ends where find_end tells. If the data is streamed in chunks e.g. by
+    stream_data_by_path, the rest of a chunk is carried over to the next.
+    """
+
+    if isinstance(data, basestring):
+        yield data
+        return
+
+    rest = ''
+    for chunk in data:
+        rest += chunk
+        end = find_end(rest)
+        if end:
+            yield rest[:end]
+            rest = rest[end:]
+
+    if rest:
+        yield rest
+
+
 class _TextData(AbsMapReduceDataset):
     __metaclass__ = ABCMeta
 
@@ -26,20 +59,24 @@ class TextDataByWord(_TextData):
     __metaclass__ = ABCMeta
 
     def next_entry(self, data):
-        for word in word_tokenize(data):
-            yield word
+        for part in _complete_parts(data, _last_whitespace):
+            for word in word_tokenize(part):
+                yield word
 
 
 class TextDataBySentence(_TextData):
     __metaclass__ = ABCMeta
 
     def next_entry(self, data):
-        for sentence in sent_tokenize(data):
-            yield sentence
+        for part in _complete_parts(data, _last_sentence):
+            for sentence in sent_tokenize(part):
+                yield sentence
 
 
 class TextDataByLine(_TextData):
     __metaclass__ = ABCMeta
 
     def next_entry(self, data):
-        return data.splitlines()
+        for part in _complete_parts(data, lambda text: text.rfind('\n') + 1):
+            for line in part.splitlines():
+                yield line
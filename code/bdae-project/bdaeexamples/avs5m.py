@@ -72,6 +72,9 @@ class AVS5MDataset(ImageDataset):
     def is_serialized(self):
         return True
 
+    def is_native_array(self):
+        return True
+
     def next_entry(self, data):
         for i in xrange(NUM_SLICES):
             yield data[i, ...]
@@ -32,14 +32,20 @@ class FDKDataset(AbsMapReduceDataset):
     def is_serialized(self):
         return True
 
+    def is_native_array(self):
+        return True
+
     def next_entry(self, data):
         for projection in data:
             yield projection
 
     def preprocess(self, data_ref):
-        projections = fromfile(data_ref, dtype=float32)
-        projections.shape = (NUM_PROJECTIONS, DETECTOR_ROWS, DETECTOR_COLUMNS)
-        return projections
+        # Reads a projection at a time, instead of the entire file
+        with open(data_ref, 'rb') as f:
+            for _ in xrange(NUM_PROJECTIONS):
+                projection = fromfile(f, dtype=float32, count=DETECTOR_ROWS * DETECTOR_COLUMNS)
+                projection.shape = (DETECTOR_ROWS, DETECTOR_COLUMNS)
+                yield projection
 
     def get_operations(self):
         return [
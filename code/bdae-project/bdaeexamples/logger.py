@@ -4,13 +4,13 @@
 from numpy import array, zeros
 
 from bdae.templates.text_dataset import TextDataByLine
-from sofa.foundation.base import load_data_by_path
+from sofa.foundation.base import stream_data_by_path
 from sofa.foundation.operation import OperationContext
 
 
 class LogEventParserData(TextDataByLine):
     def preprocess(self, data_ref):
-        return load_data_by_path(data_ref)
+        return stream_data_by_path(data_ref)
 
     def get_operations(self):
         return [OperationContext.by(self, 'count logs', '[log_mapper, log_reducer]')
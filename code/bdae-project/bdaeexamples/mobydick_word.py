@@ -1,7 +1,7 @@
 # Created by Steffen Karlsson on 02-19-2016
 # Copyright (c) 2016 The Niels Bohr Institute at University of Copenhagen. All rights reserved.
 
-from sofa.foundation.base import load_data_by_path, load_data_by_url
+from sofa.foundation.base import stream_data_by_path
 from bdae.templates.text_dataset import TextDataByWord
 from sofa.foundation.operation import OperationContext, Sequential, Parallel
 from sofa.foundation.strategy import Tiles
@@ -9,7 +9,7 @@ from sofa.foundation.strategy import Tiles
 
 class MobyDickDatasetWord(TextDataByWord):
     def preprocess(self, data_ref):
-        return load_data_by_path(data_ref)
+        return stream_data_by_path(data_ref)
 
     def get_map_functions(self):
         return super(MobyDickDatasetWord, self).get_map_functions() + [nothing]
@@ -16,6 +16,7 @@ from sofa.config.parser import Configuration
 
 REGISTRY_NAME = None
 DAEMON = None
+HANDLER = None
 NS = None
 
 pyro_config.SERVERTYPE = "thread"
@@ -28,6 +29,10 @@ pyro_config.COMPRESSION = True
 def _handle_kill_signal(signal, frame):
     NS.remove(REGISTRY_NAME)
     DAEMON.close()
+
+    if hasattr(HANDLER, 'shutdown'):
+        # Stops the long-lived threads and processes of the node
+        HANDLER.shutdown()
     exit(1)
 
 
@@ -71,7 +76,8 @@ if __name__ == "__main__":
 
     DAEMON = Daemon(port=config.port, host=config.hostname)
 
-    uri = DAEMON.register(instance(config, config.others))
+    HANDLER = instance(config, config.others)
+    uri = DAEMON.register(HANDLER)
     REGISTRY_NAME = config.node
     NS.register(REGISTRY_NAME, uri)
 
@@ -1,25 +1,197 @@
 # Created by Steffen Karlsson on 02-25-2016
 # Copyright (c) 2016 The Niels Bohr Institute at University of Copenhagen. All rights reserved.
 
+from collections import OrderedDict
+from threading import RLock
+from time import time
+
+from sofa.handler import get_size
+
+LRU = 'lru'
+LFU = 'lfu'
+
+POLICIES = [LRU, LFU]
+
+ENFORCE_INTERVAL = 1  # Seconds between measuring entries changed in place
+
+
 class CacheSystem:
-    def __init__(self, cache_type, args=None):
+    """
+    Key value cache, which by default is unbounded. If max_size (in bytes, measured by size_fun) is specified,
+    entries are evicted by the policy (LRU or LFU) when the cache grows beyond it, and entries older than ttl
+    (in seconds) expires. Only entries for which evictable(value) is true can be evicted or expire.
+
+    Values returned by get are measured again before evicting, if track_mutations is true, since callers
+    may change them in place.
+    """
+
+    def __init__(self, cache_type, args=None, max_size=None, policy=LRU, ttl=None, size_fun=get_size,
+                 evictable=None, track_mutations=True):
         if args:
             self.__data = cache_type(args)
         else:
             self.__data = cache_type()
 
-    def put(self, key, value):
-        self.__data[key] = value
+        if policy not in POLICIES:
+            raise ValueError("Cache policy has to be one of: %s" % ", ".join(POLICIES))
+
+        self.__max_size = max_size
+        self.__policy = policy
+        self.__ttl = ttl
+        self.__size_fun = size_fun
+        self.__evictable = evictable
+        self.__track_mutations = track_mutations
+
+        self.__lock = RLock()
+        self.__order = OrderedDict()  # Key to access count, ordered by last access
+        self.__sizes = {}
+        self.__created = {}
+        self.__dirty = set()
+        self.__size = 0
+        self.__last_enforced = time()
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__expirations = 0
+
+    def __is_bounded(self):
+        return self.__max_size is not None or self.__ttl is not None
+
+    def __can_evict(self, key):
+        return self.__evictable is None or self.__evictable(self.__data[key])
+
+    def __is_expired(self, key):
+        return self.__ttl is not None and time() - self.__created[key] > self.__ttl and self.__can_evict(key)
+
+    def __touch(self, key):
+        self.__order[key] = self.__order.pop(key, 0) + 1
+
+    def __measure(self, key, size=None):
+        if size is None:
+            size = self.__size_fun(self.__data[key])
+        self.__size += size - self.__sizes.get(key, 0)
+        self.__sizes[key] = size
+
+    def __track(self, key, size=None):
+        if not self.__is_bounded():
+            return
+
+        self.__created[key] = time()
+        self.__touch(key)
+        self.__measure(key, size)
+        # The entry just added is kept, even if it alone exceeds max_size
+        self.__enforce(exclude=key)
+
+    def __forget(self, key):
+        self.__size -= self.__sizes.pop(key, 0)
+        self.__order.pop(key, None)
+        self.__created.pop(key, None)
+        self.__dirty.discard(key)
+
+    def __remove(self, key):
+        del self.__data[key]
+        self.__forget(key)
+
+    def __find_victim(self, exclude):
+        candidates = (key for key in self.__order if key != exclude and self.__can_evict(key))
+        if self.__policy == LFU:
+            # Ties are broken by the least recently used, i.e. first in order
+            candidates = list(candidates)
+            return min(candidates, key=lambda key: self.__order[key]) if candidates else None
+
+        return next(candidates, None)
+
+    def __enforce(self, exclude=None):
+        self.__last_enforced = time()
+
+        for key in [key for key in self.__created if key != exclude and self.__is_expired(key)]:
+            self.__remove(key)
+            self.__expirations += 1
+
+        for key in self.__dirty:
+            if key in self.__data:
+                self.__measure(key)
+        self.__dirty.clear()
+
+        if self.__max_size is None:
+            return
+
+        while self.__size > self.__max_size:
+            victim = self.__find_victim(exclude)
+            if victim is None:
+                break
+
+            self.__remove(victim)
+            self.__evictions += 1
+
+    def put(self, key, value, size=None):
+        # The size can be given if already known, instead of measuring the value with size_fun
+        with self.__lock:
+            self.__data[key] = value
+            self.__track(key, size)
 
     def get(self, key):
-        return self.__data[key]
+        with self.__lock:
+            if key in self.__data and self.__is_bounded() and self.__is_expired(key):
+                self.__remove(key)
+                self.__expirations += 1
+
+            if key not in self.__data:
+                self.__misses += 1
+                # Raises KeyError unless cache_type creates missing values, e.g. defaultdict
+                value = self.__data[key]
+                self.__track(key)
+                return value
+
+            self.__hits += 1
+            if self.__is_bounded():
+                self.__touch(key)
+                if self.__dirty and time() - self.__last_enforced >= ENFORCE_INTERVAL:
+                    # The returned value may be changed by the caller, and is therefore kept
+                    self.__enforce(exclude=key)
+                if self.__track_mutations:
+                    self.__dirty.add(key)
+
+            return self.__data[key]
 
     def delete(self, key):
-        if self.contains(key):
-            del self.__data[key]
+        with self.__lock:
+            if self.contains(key):
+                self.__remove(key)
 
     def contains(self, key):
-        return key in self.__data
+        with self.__lock:
+            if key in self.__data and self.__is_bounded() and self.__is_expired(key):
+                self.__remove(key)
+                self.__expirations += 1
+
+            return key in self.__data
 
     def keys(self):
-        return self.__data.keys()
\ No newline at end of file
+        with self.__lock:
+            return self.__data.keys()
+
+    def resize(self, max_size):
+        # Evicts entries until the cache fits the new max_size
+        with self.__lock:
+            self.__max_size = max_size
+            self.__enforce()
+
+    def get_size(self):
+        with self.__lock:
+            self.__enforce()
+            return self.__size
+
+    def get_statistics(self):
+        with self.__lock:
+            return {
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'evictions': self.__evictions,
+                'expirations': self.__expirations,
+                'entries': len(self.__data),
+                'bytes': self.__size if self.__is_bounded() else None,
+                'max-bytes': self.__max_size,
+                'policy': self.__policy,
+            }
@@ -13,9 +13,20 @@ from ujson import loads, dumps
 from base64 import b64encode, b64decode
 
 DEFAULT_BLOCK_SIZE = 64
+DEFAULT_BLOCK_CACHE_SIZE = 256
+DEFAULT_RESULT_CACHE_SIZE = 512
+DEFAULT_MAP_CACHE_SIZE = 256
+DEFAULT_CACHE_POLICY = 'lru'
 DEFAULT_PORT = 9090
 DEFAULT_HEARTBEAT_DELAY = 5
 DEFAULT_HEARTBEAT_RETRIES = 5
+DEFAULT_COMPACTION_INTERVAL = 300
+DEFAULT_RECLAMATION_INTERVAL = 60
+DEFAULT_REPLICATION_ACK = 'all'
+DEFAULT_INGEST_PROCESSES = 0
+DEFAULT_RPC_THREADS = 16
+DEFAULT_COMPUTE_THREADS = 4
+DEFAULT_MAP_PROCESSES = 0
 DEFAULT_KEYSPACE_SIZE = pow(2, 64)
 
 
@@ -52,12 +63,34 @@ def parse_project_cfg(path, index, node_types):
         heartbeat-scheduler-delay =
         num-heartbeat-retries =
         enable-live-software-reboot =
+        compaction-interval =
+        reclamation-interval =
 
         # Load balancing
         load-balancing-threshold =
 
+        # Replication: all or quorum of the replicas to confirm writes
+        replication-ack =
+
+        # Processes preparing the blocks of appends at the gateway, 0 prepares them in the gateway itself
+        ingest-processes =
+
+        # Threads of the storage nodes for requests to the other nodes and for local computations
+        rpc-threads =
+        compute-threads =
+
+        # Processes computing the map functions of operations executed by processes, 0 computes them in the node
+        map-processes =
+
         # Defined in megabytes
         block-size =
+        block-cache-size =
+        result-cache-size =
+        map-cache-size =
+
+        # Result caches: lru or lfu, and time to live in seconds
+        cache-policy =
+        cache-ttl =
 
         ##
         # Configuration of the nodes
@@ -104,8 +137,9 @@ def parse_project_cfg(path, index, node_types):
         nameserver = config.get("general", "nameserver").split(":")
         global_config.name_server = (nameserver[0].strip(), int(nameserver[1].strip()))
 
-    if not exists(global_config.mount_point):
-        makedirs(global_config.mount_point)
+    for mount_point in global_config.get_mount_points():
+        if not exists(mount_point):
+            makedirs(mount_point)
 
     if config.has_option("general", "log-file"):
         basicConfig(filename=config.get("general", "log-file"), level=INFO)
@@ -114,6 +148,21 @@ def parse_project_cfg(path, index, node_types):
     if config.has_option("general", "block-size"):
         global_config.block_size = config.getfloat("general", "block-size")
 
+    if config.has_option("general", "block-cache-size"):
+        global_config.block_cache_size = config.getfloat("general", "block-cache-size")
+
+    if config.has_option("general", "result-cache-size"):
+        global_config.result_cache_size = config.getfloat("general", "result-cache-size")
+
+    if config.has_option("general", "map-cache-size"):
+        global_config.map_cache_size = config.getfloat("general", "map-cache-size")
+
+    if config.has_option("general", "cache-policy"):
+        global_config.cache_policy = config.get("general", "cache-policy").strip().lower()
+
+    if config.has_option("general", "cache-ttl"):
+        global_config.cache_ttl = config.getint("general", "cache-ttl")
+
     if config.has_option("general", "heartbeat-scheduler-delay"):
         global_config.heartbeat_scheduler_delay = config.getint("general", "heartbeat-scheduler-delay")
 
@@ -123,12 +172,33 @@ def parse_project_cfg(path, index, node_types):
     if config.has_option("general", "enable-live-software-reboot"):
         global_config.live_software_reboot = config.getboolean("general", "enable-live-software-reboot")
 
+    if config.has_option("general", "compaction-interval"):
+        global_config.compaction_interval = config.getint("general", "compaction-interval")
+
+    if config.has_option("general", "reclamation-interval"):
+        global_config.reclamation_interval = config.getint("general", "reclamation-interval")
+
     if config.has_option("general", "keyspace-size"):
         global_config.keyspace_size = eval(config.get("general", "keyspace-size"))
 
     if config.has_option("general", "load-balancing-threshold"):
         global_config.load_balancing_threshold = config.getint("general", "load-balancing-threshold")
 
+    if config.has_option("general", "replication-ack"):
+        global_config.replication_ack = config.get("general", "replication-ack").strip().lower()
+
+    if config.has_option("general", "ingest-processes"):
+        global_config.ingest_processes = config.getint("general", "ingest-processes")
+
+    if config.has_option("general", "rpc-threads"):
+        global_config.rpc_threads = config.getint("general", "rpc-threads")
+
+    if config.has_option("general", "compute-threads"):
+        global_config.compute_threads = config.getint("general", "compute-threads")
+
+    if config.has_option("general", "map-processes"):
+        global_config.map_processes = config.getint("general", "map-processes")
+
     for idx, node in enumerate(node_types):
         if config.has_section(node):
             if not config.has_option(node, "addresses"):
@@ -166,6 +236,11 @@ class Configuration:
         self.instance_name = None
         self.use_logging = False
         self.block_size = DEFAULT_BLOCK_SIZE
+        self.block_cache_size = DEFAULT_BLOCK_CACHE_SIZE
+        self.result_cache_size = DEFAULT_RESULT_CACHE_SIZE
+        self.map_cache_size = DEFAULT_MAP_CACHE_SIZE
+        self.cache_policy = DEFAULT_CACHE_POLICY
+        self.cache_ttl = None
         self.node = None
         self.node_idx = None
         self.name_server = ('localhost', 9090)
@@ -175,11 +250,24 @@ class Configuration:
         self.heartbeat_scheduler_delay = DEFAULT_HEARTBEAT_DELAY
         self.num_heartbeat_retries = DEFAULT_HEARTBEAT_RETRIES
         self.live_software_reboot = False
+        self.compaction_interval = DEFAULT_COMPACTION_INTERVAL
+        self.reclamation_interval = DEFAULT_RECLAMATION_INTERVAL
         self.load_balancing_threshold = 1
+        self.replication_ack = DEFAULT_REPLICATION_ACK
+        self.ingest_processes = DEFAULT_INGEST_PROCESSES
+        self.rpc_threads = DEFAULT_RPC_THREADS
+        self.compute_threads = DEFAULT_COMPUTE_THREADS
+        self.map_processes = DEFAULT_MAP_PROCESSES
         self.mount_point = "/mnt/sofa/"
 
+    def get_mount_points(self):
+        # Mount points of several disks are separated by commas
+        mount_points = [mount_point.strip() for mount_point in self.mount_point.split(',') if mount_point.strip()]
+        return [mount_point if mount_point.endswith('/') else "%s/" % mount_point for mount_point in mount_points]
+
     def get_mount_point(self):
-        return self.mount_point if self.mount_point.endswith('/') else "%s/" % self.mount_point
+        # The first mount point, which holds everything else than blocks
+        return self.get_mount_points()[0]
 
     def encode(self):
         return b64encode(dumps(self.__dict__))
@@ -192,11 +280,23 @@ class Configuration:
         config.instance_name = json['instance_name']
         config.use_logging = json['use_logging']
         config.block_size = json['block_size']
+        config.block_cache_size = json['block_cache_size']
+        config.result_cache_size = json['result_cache_size']
+        config.map_cache_size = json['map_cache_size']
+        config.cache_policy = json['cache_policy']
+        config.cache_ttl = json['cache_ttl']
         config.keyspace_size = json['keyspace_size']
         config.heartbeat_scheduler_delay = json['heartbeat_scheduler_delay']
         config.num_heartbeat_retries = json['num_heartbeat_retries']
         config.live_software_reboot = json['live_software_reboot']
+        config.compaction_interval = json['compaction_interval']
+        config.reclamation_interval = json['reclamation_interval']
         config.load_balancing_threshold = json['load_balancing_threshold']
+        config.replication_ack = json['replication_ack']
+        config.ingest_processes = json['ingest_processes']
+        config.rpc_threads = json['rpc_threads']
+        config.compute_threads = json['compute_threads']
+        config.map_processes = json['map_processes']
         config.mount_point = json['mount_point']
 
         # Custom instantiation required for this instance
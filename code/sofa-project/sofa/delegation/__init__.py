@@ -2,6 +2,11 @@
 # Copyright (c) 2016 The Niels Bohr Institute at University of Copenhagen. All rights reserved.
 
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from threading import Condition, Lock, Thread
+from time import time
+
+SEQUENCE_TIMEOUT = 60  # Seconds a write of a sequence waits for the earlier writes of it
 
 
 class FunctionDelegation(dict):
@@ -28,6 +33,81 @@ class FunctionDelegation(dict):
         return self
 
 
+class ForwardQueue(object):
+    """
+    Runs the forwards to a replica one at a time, in the order they are put, by a thread which only runs while
+    forwards are pending. Writes hold the ordering lock while putting their forward and writing locally, so the
+    replica receives them in the order they are written here.
+
+    Writes of a sequence, e.g. the batches of an append sent concurrently, take turns by their position in it.
+    """
+
+    def __init__(self):
+        self.ordering = Lock()
+        self.__pending = deque()
+        self.__lock = Condition(Lock())
+        self.__is_running = False
+        self.__turns = {}  # The next position of every sequence, or None if a write of it failed, and when it was set
+        self.__turns_lock = Condition(Lock())
+
+    def put(self, forward):
+        with self.__lock:
+            self.__pending.append(forward)
+            if not self.__is_running:
+                self.__is_running = True
+                thread = Thread(target=self.__run)
+                thread.daemon = True
+                thread.start()
+
+    def __run(self):
+        while True:
+            with self.__lock:
+                if not self.__pending:
+                    self.__is_running = False
+                    self.__lock.notify_all()
+                    return
+                forward = self.__pending.popleft()
+
+            forward()
+
+    def join(self):
+        with self.__lock:
+            while self.__is_running:
+                self.__lock.wait()
+
+    def wait_for_turn(self, sequence):
+        """
+        Waits until the earlier writes of the sequence are done, and returns false if one of them failed or didn't
+        arrive in time
+        """
+
+        stream, position = sequence
+        deadline = time() + SEQUENCE_TIMEOUT
+        with self.__turns_lock:
+            while True:
+                turn, _ = self.__turns.get(stream, (0, None))
+                if turn == position or turn is None:
+                    return turn == position
+
+                remaining = deadline - time()
+                if remaining <= 0:
+                    self.__turns[stream] = None, time()
+                    self.__turns_lock.notify_all()
+                    return False
+                self.__turns_lock.wait(remaining)
+
+    def end_turn(self, sequence, is_written):
+        stream, position = sequence
+        now = time()
+        with self.__turns_lock:
+            # Sequences without writes for a while are finished
+            for expired in [key for key, (_, updated) in self.__turns.items() if now - updated > SEQUENCE_TIMEOUT]:
+                del self.__turns[expired]
+
+            self.__turns[stream] = (position + 1 if is_written else None), now
+            self.__turns_lock.notify_all()
+
+
 class DelegationHandler:
     __metaclass__ = ABCMeta
 
@@ -35,6 +115,8 @@ class DelegationHandler:
         self.__my_idx = my_idx
         self.__key_space_size = key_space_size
         self.__cjc = 0
+        self.__forward_queues = {}
+        self.__forward_lock = Lock()
 
     def setup(self, my_idx, key_space_size):
         self.__key_space_size = key_space_size
@@ -52,6 +134,10 @@ class DelegationHandler:
     def get_replication_factor(self, identifier):
         pass
 
+    @abstractmethod
+    def get_replication_ack(self):
+        pass
+
     def me(self):
         return self.__my_idx
 
@@ -70,6 +156,23 @@ class DelegationHandler:
     def decrease_job_count(self, count):
         self.__cjc -= count
 
+    def get_forward_queue(self, identifier, replica_index):
+        # One queue per replica of the dataset, so the next replica receives its writes in the same order
+        key = (str(identifier), replica_index)
+        with self.__forward_lock:
+            if key not in self.__forward_queues:
+                self.__forward_queues[key] = ForwardQueue()
+            return self.__forward_queues[key]
+
+    def wait_for_forwards(self, identifier=None):
+        # Waits for the pending forwards of the dataset, or of every dataset if identifier is None
+        with self.__forward_lock:
+            queues = [queue for (qidentifier, _), queue in self.__forward_queues.items()
+                      if identifier is None or qidentifier == str(identifier)]
+
+        for queue in queues:
+            queue.join()
+
 
 def is_function_delegation(arg):
     if not isinstance(arg, dict):
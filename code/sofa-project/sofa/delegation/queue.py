@@ -2,8 +2,13 @@
 # Copyright (c) 2016 The Niels Bohr Institute at University of Copenhagen. All rights reserved.
 
 from functools import wraps
+from logging import error
+from threading import Event
+
+from Pyro4.errors import CommunicationError
 
 from sofa.delegation import is_delegation_handler, is_function_delegation
+from sofa.error import is_error, STATUS_NOT_FOUND, STATUS_NOT_ALLOWED
 
 
 def __generate_queue(root_idx, replication_factor, max_nodes, include_self=False):
@@ -17,6 +22,33 @@ def __generate_queue(root_idx, replication_factor, max_nodes, include_self=False
     return q
 
 
+def __get_required_acks(replication_ack, replication_factor):
+    if replication_ack == 'quorum':
+        return replication_factor / 2 + 1
+
+    return replication_factor
+
+
+def __forward_async(forward_queue, responsible, fun_name, args):
+    forwarded = {}
+    done = Event()
+
+    def __forward():
+        try:
+            forwarded['res'] = getattr(responsible, fun_name)(*args)
+        except CommunicationError as e:
+            forwarded['res'] = STATUS_NOT_FOUND, "Replica isn't reachable: %s" % e
+        except Exception as e:
+            forwarded['error'] = e
+
+        if 'error' in forwarded or is_error(forwarded['res']):
+            error("Replication of %s failed: %s" % (fun_name, forwarded.get('error', forwarded.get('res'))))
+        done.set()
+
+    forward_queue.put(__forward)
+    return done, forwarded
+
+
 def with_forward_count(func):
     @wraps(func)
     def forward_count_wrapper(*args):
@@ -69,7 +101,8 @@ def with_forward_queue(func):
                 return __local_run()
             else:
                 if queue:
-                    # Pass the job to the next in the queue
+                    # Pass the job to the next in the queue, when it has received the writes of this node
+                    context.wait_for_forwards(fd['identifier'])
                     responsible_idx = queue.pop(0)
                     return __forward_job(responsible_idx, [queue] + args[2:])
                 else:
@@ -86,27 +119,56 @@ def with_required_queue(func):
         fd = args[1]
 
         if is_delegation_handler(context) and is_function_delegation(fd):
-            res = func(*args)
-
-            # TODO: eventually pipeline the data transfer, instead of root sending all
-
-            if fd['is-root']:
-                # Distribute to the other replicas
-                num_storage_nodes = context.get_num_storage_nodes(including_self=True)
-
-                # Implementing simple store and forward method
-                for replication_index in xrange(1, fd['replication-factor']):
-                    # Update state
-                    fd['replica-index'] = replication_index
-                    fd['is-root'] = False
-
-                    responsible_idx = (context.me() + replication_index) % num_storage_nodes
-
-                    # Offset by replication index too
-                    responsible = context.get_responsible(responsible_idx)
-                    res = getattr(responsible, func.__name__)(*args[1:])
+            if fd['is-root'] is None:
+                # First in the chain, the caller waits for the required number of replicas to confirm
+                fd['is-root'] = True
+                fd['required-acks'] = __get_required_acks(context.get_replication_ack(), fd['replication-factor'])
+
+            num_storage_nodes = context.get_num_storage_nodes(including_self=True)
+            replication_index = fd['replica-index'] + 1
+
+            forward_queue = context.get_forward_queue(fd['identifier'], fd['replica-index'])
+            sequence = fd.get('sequence')
+            if sequence is not None and not forward_queue.wait_for_turn(sequence):
+                # Written after the earlier writes of the sequence only, which failed
+                return STATUS_NOT_ALLOWED, "An earlier write of the sequence wasn't written"
+
+            is_written = False
+            try:
+                with forward_queue.ordering:
+                    forward = None
+                    if replication_index < min(fd['replication-factor'], num_storage_nodes):
+                        # Implementing chain replication, the next replica receives the data while this writes it,
+                        # in the order of the writes to this replica
+                        next_fd = dict(fd)
+                        next_fd['replica-index'] = replication_index
+                        next_fd['is-root'] = False
+                        next_fd['required-acks'] = max(fd['required-acks'] - 1, 0)
+                        # Already in order by the queue
+                        next_fd.pop('sequence', None)
+
+                        responsible = context.get_responsible((context.me() + 1) % num_storage_nodes)
+                        forward = __forward_async(forward_queue, responsible, func.__name__,
+                                                  [next_fd] + list(args[2:]))
+
+                    res = func(*args)
+                    is_written = not is_error(res)
+            finally:
+                if sequence is not None:
+                    # The next write of the sequence doesn't wait for the rest of the chain
+                    forward_queue.end_turn(sequence, is_written)
+
+            if forward and fd['required-acks'] > 1:
+                # Confirmed by this replica, wait for the rest of the chain to confirm
+                done, forwarded = forward
+                done.wait()
+
+                if 'error' in forwarded:
+                    raise forwarded['error']
+
+                if not is_error(res) and is_error(forwarded['res']):
+                    res = forwarded['res']
 
-            # TODO: eventually sum up the results and check them one by one
             return res
 
     return required_wrapper
@@ -6,9 +6,13 @@
 """
 
 from abc import abstractmethod, ABCMeta
+from sofa.handler import estimate_size
 from sofa.handler.storage import KEYWORDS
+from sofa.storage.zone_map import summarize
 from strategy import RoundRobin
 
+DEFAULT_CHUNK_SIZE = 1000000  # In bytes
+
 
 class SofaBaseObject:
     """
@@ -31,6 +35,8 @@ class SofaBaseObject:
         """
         Define how to load the object (if needed) from the specified local path or url in the Gateway append method,
         it's recommended to implement load as a generator i.e. yield, since its supported and memory saving.
+        The blocks are sent while the data is read, such that a generator keeps the memory usage of the Gateway
+        flat e.g. by :func:`stream_data_by_path` or :func:`stream_data_by_url`, which yields chunks of the file.
 
         :param data_ref: The actual data, local path or url to the data
         :type data_ref: str or data
@@ -83,6 +89,58 @@ class SofaBaseObject:
     def is_serialized(self):
         return False
 
+    def is_native_array(self):
+        """
+        Method to override if every block is a numpy array or a list of numpy arrays. The blocks are then sent
+        to the storage nodes without serialize and stored in a native format, from which the functions receive
+        read-only memory-mapped views, i.e. without copying or deserializing the data.
+
+        :return: bool
+        """
+        return False
+
+    def is_row_sliced(self):
+        """
+        Method to override if the data returned by preprocess is a numpy array, or yields numpy arrays, whose rows
+        are the entries. The rows are then sliced into blocks of block-size without calling next_entry, such that
+        every block is one contiguous numpy array, instead of a list of entries.
+
+        :return: bool
+        """
+        return False
+
+    def get_block_codec(self):
+        """
+        Method to override in order to compress the blocks of the dataset with one of the codecs: zlib, lzma, bz2
+        or shuffle-zlib, which shuffles the bytes of numeric arrays before compressing with zlib. The blocks are
+        compressed once before sending, and stay compressed on the storage nodes until read.
+
+        :return: str or None if the blocks shouldn't be compressed
+        """
+        return None
+
+    def get_entry_size(self, entry):
+        """
+        Method to override in order to define the size of an entry in bytes, which the entries are grouped into
+        blocks of block-size by. By default it's estimated in constant time for strings and arrays, and from
+        a sample of the elements for lists, tuples and dicts.
+
+        :param entry: entry as yielded by next_entry
+        :return: int
+        """
+        return estimate_size(entry)
+
+    def get_block_summary(self, block):
+        """
+        Method to override in order to define the zone map of a block, which is passed to block filters
+        of the operations (see :meth:`.OperationContext.with_block_filter`). By default it's the count of
+        entries together with min and max for numeric entries or min-length and max-length for strings.
+
+        :param block: list of entries as yielded by next_entry
+        :return: dict or None if the block has no zone map
+        """
+        return summarize(block)
+
     def get_distribution_strategy(self):
         """
         Method to override in order to define a new distribution strategy from default e.g. Round Robin.
@@ -125,3 +183,20 @@ def load_data_by_path(path):
 
     with closing(open(path)) as f:
         return f.read()
+
+
+def stream_data_by_url(url, chunk_size=DEFAULT_CHUNK_SIZE):
+    from urllib2 import urlopen
+    from contextlib import closing
+
+    with closing(urlopen(url)) as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            yield chunk
+
+
+def stream_data_by_path(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    from contextlib import closing
+
+    with closing(open(path)) as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            yield chunk
@@ -0,0 +1,57 @@
+from multiprocessing.pool import ThreadPool
+from threading import BoundedSemaphore, local
+
+QUEUE_SIZE_PER_THREAD = 4  # Tasks queued per thread, before submitting more waits
+
+
+class BoundedExecutor(object):
+    """
+    Long-lived pool of threads with a bounded queue, such that submitting waits when too many tasks are queued.
+    Tasks submitted by a thread of the pool itself are executed in that thread, since waiting for them in the
+    pool could exhaust it.
+    """
+
+    def __init__(self, num_threads, queue_size=None):
+        self.__pool = ThreadPool(num_threads)
+        self.__queued = BoundedSemaphore(queue_size or num_threads * QUEUE_SIZE_PER_THREAD)
+        self.__state = local()
+
+    def __is_worker(self):
+        return getattr(self.__state, 'is_worker', False)
+
+    def __execute(self, fun, arg):
+        self.__state.is_worker = True
+        try:
+            return fun(arg)
+        finally:
+            self.__queued.release()
+
+    def __submit(self, fun, iterable):
+        results = []
+        for arg in iterable:
+            self.__queued.acquire()
+            results.append(self.__pool.apply_async(self.__execute, (fun, arg)))
+
+        return results
+
+    def map(self, fun, iterable):
+        if self.__is_worker():
+            return [fun(arg) for arg in iterable]
+
+        return [result.get() for result in self.__submit(fun, iterable)]
+
+    def map_async(self, fun, iterable):
+        if self.__is_worker():
+            for arg in iterable:
+                fun(arg)
+            return
+
+        self.__submit(fun, iterable)
+
+    def shutdown(self):
+        """
+        Executes the queued tasks and stops the threads
+        """
+
+        self.__pool.close()
+        self.__pool.join()
@@ -37,6 +37,13 @@ class ExpectedReturnType(object):
         return ExpectedReturnType.representation[return_type](data)
 
 
+class ExecutionMode(object):
+    # Sequential computes the map function in the thread of the job, Threads on chunks of the blocks by the
+    # threads of the node, suited for numeric functions releasing the GIL, and Processes on chunks of the blocks
+    # by the map processes of the node, suited for Python functions
+    Sequential, Threads, Processes = range(3)
+
+
 def _strip_operators(s):
     return s.strip()[1:-1]
 
@@ -144,6 +151,10 @@ class OperationContext:
         self.return_type = ExpectedReturnType.Text
         self.num_arguments = 1
         self.supply_meta_data_arg = False
+        self.block_filter = None
+        self.incremental = False
+        self.memoized = False
+        self.execution_mode = ExecutionMode.Sequential
 
     def with_initial_ghosts(self, ghost_count=(1, 1), use_cyclic=False):
         is_tuple = isinstance(ghost_count, tuple)
@@ -174,6 +185,31 @@ class OperationContext:
         self.supply_meta_data_arg = True
         return self
 
+    def with_block_filter(self, fun_block_filter):
+        # Called with the zone map of a block and the query, returns False if the block can be skipped.
+        # Not used with ghosts or keywords, since these are based on all blocks. Blocks with unknown bounds,
+        # e.g. only NaN, are never skipped, and nodes skipping every block are left out of the reduction
+        self.block_filter = fun_block_filter
+        return self
+
+    def with_incremental_reduction(self):
+        # The last function has to be associative, such that the result of new blocks can be merged
+        # with the result of the old blocks by calling it with both, instead of computing all blocks again
+        self.incremental = True
+        return self
+
+    def with_memoized_map(self):
+        # The first function has to be deterministic and return a list with an output per block, which is
+        # cached per block and shared with other operations starting with the same function and query
+        self.memoized = True
+        return self
+
+    def with_execution_mode(self, execution_mode):
+        # The map function, i.e. the first function called on the blocks, has to return a list with an output
+        # per block, such that it can be computed on parts of the blocks and the outputs concatenated
+        self.execution_mode = execution_mode
+        return self
+
     def get_num_arguments(self):
         return self.num_arguments
 
@@ -201,6 +237,18 @@ class OperationContext:
     def get_functions(self):
         return list(self.functions)
 
+    def get_block_filter(self):
+        return self.block_filter
+
+    def is_incremental(self):
+        return self.incremental
+
+    def is_memoized(self):
+        return self.memoized
+
+    def get_execution_mode(self):
+        return self.execution_mode
+
     def requires_meta_data(self):
         return self.supply_meta_data_arg
 
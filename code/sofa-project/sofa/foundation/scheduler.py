@@ -20,4 +20,6 @@ class BackgroundDaemonScheduler(BackgroundScheduler):
             # Apscheduler mistakenly joins if its current thread which causes RuntimeError
             pass
 
-        del self._thread
+        # Later versions of apscheduler delete it themselves
+        if '_thread' in vars(self):
+            del self._thread
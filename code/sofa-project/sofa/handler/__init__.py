@@ -2,8 +2,12 @@
 # Copyright (c) 2016 The Niels Bohr Institute at University of Copenhagen. All rights reserved.
 
 from re import compile
+from sys import getsizeof
+
+from numpy import concatenate
 
 CLASS_PATTERN = compile("\'(.*?)\'")
+SIZE_SAMPLES = 16  # Elements sampled to estimate the size of a list, tuple or dict
 
 
 def import_class(cls):
@@ -48,3 +52,93 @@ def get_class_from_source(source, cls_name):
 
 def unique_and_preserve(data):
     return list(sorted(set(data), key=lambda x: data.index(x)))
+
+
+def get_size(obj):
+    size = getsizeof(obj)
+
+    if isinstance(obj, dict):
+        size += sum((get_size(v) for v in obj.values()))
+        size += sum((get_size(k) for k in obj.keys()))
+    elif hasattr(obj, 'nbytes'):
+        size += obj.nbytes
+    elif hasattr(obj, '__dict__'):
+        size += get_size(obj.__dict__)
+    elif hasattr(obj, '__iter__') and not isinstance(obj, (str, bytes, bytearray)):
+        size += sum((get_size(i) for i in obj))
+    return size
+
+
+def estimate_size(obj):
+    """
+    Estimates the size like get_size, but in constant time for strings and arrays, and from a sample
+    of the elements for lists, tuples and dicts with elements of the same type.
+    """
+
+    if isinstance(obj, (str, unicode, bytearray)):
+        return getsizeof(obj)
+    elif hasattr(obj, 'nbytes'):
+        return getsizeof(obj) + obj.nbytes
+    elif isinstance(obj, (list, tuple)):
+        return getsizeof(obj) + _estimate_elements(obj)
+    elif isinstance(obj, dict):
+        return getsizeof(obj) + _estimate_elements(obj.values()) + _estimate_elements(obj.keys())
+    return get_size(obj)
+
+
+def _estimate_elements(elements):
+    num_elements = len(elements)
+    if num_elements <= SIZE_SAMPLES:
+        return sum(estimate_size(element) for element in elements)
+
+    # Spread the samples over all elements
+    samples = elements[::num_elements / SIZE_SAMPLES][:SIZE_SAMPLES]
+    if any(type(sample) is not type(samples[0]) for sample in samples):
+        return sum(estimate_size(element) for element in elements)
+
+    return sum(estimate_size(sample) for sample in samples) * num_elements / len(samples)
+
+
+def split_into_blocks(entries, block_size, size_fun=estimate_size):
+    # Groups the entries in order into blocks of at most block_size bytes, or a single entry if larger
+    block = []
+    current_size = 0
+    for entry in entries:
+        entry_size = size_fun(entry)
+        if entry_size == 0:
+            continue
+
+        if block and current_size + entry_size > block_size:
+            yield block
+            block = []
+            current_size = 0
+
+        block.append(entry)
+        current_size += entry_size
+
+    if block:
+        # Check if block is not empty and yield rest
+        yield block
+
+
+def slice_into_blocks(arrays, block_size):
+    # Slices the rows of the arrays in order into contiguous arrays of at most block_size bytes, or a single row if larger
+    pending = []
+    num_pending = 0
+    for array in arrays:
+        if not len(array):
+            continue
+
+        pending.append(array)
+        num_pending += len(array)
+
+        num_rows = max(int(block_size / max(array[0].nbytes, 1)), 1)
+        while num_pending >= num_rows:
+            rows = pending[0] if len(pending) == 1 else concatenate(pending)
+            yield rows[:num_rows]
+
+            pending = [rows[num_rows:]] if len(rows) > num_rows else []
+            num_pending -= num_rows
+
+    if pending:
+        yield pending[0] if len(pending) == 1 else concatenate(pending)
@@ -18,9 +18,13 @@ class _StorageApi(object):
         self._validate_api()
         return self._api.create(function_delegation, identifier, dumps(meta_data), is_update)
 
-    def append(self, function_delegation, identifier, block, create_new_stride):
+    def append(self, function_delegation, identifier, block, create_new_stride, summary=None):
         self._validate_api()
-        return self._api.append(function_delegation, identifier, block, create_new_stride)
+        return self._api.append(function_delegation, identifier, block, create_new_stride, summary)
+
+    def append_many(self, function_delegation, identifier, blocks):
+        self._validate_api()
+        return self._api.append_many(function_delegation, identifier, blocks)
 
     def update_meta_key(self, function_delegation, identifier, update_type, key, value):
         self._validate_api()
@@ -35,6 +39,14 @@ class _StorageApi(object):
         self._validate_api()
         return self._api.get_submitted_jobs(is_internal_call)
 
+    def get_cache_statistics(self, is_internal_call=False):
+        self._validate_api()
+        return self._api.get_cache_statistics(is_internal_call)
+
+    def pin(self, identifier, is_pinned):
+        self._validate_api()
+        return self._api.pin(identifier, is_pinned)
+
     def get_meta_from_identifier(self, function_delegation, identifier):
         self._validate_api()
         # TODO: secure return
@@ -59,6 +71,10 @@ class _StorageApi(object):
     def get_uri(self):
         return self._storage_uri
 
+    def __copy__(self):
+        # With a connection of its own, since a proxy sends one call at a time
+        return type(self)(self._storage_uri)
+
 
 class _StorageToMonitorApi(object):
     def __init__(self, storage_uri):
@@ -77,6 +93,10 @@ class _InternalStorageApi(_StorageApi):
         self._validate_api()
         async(self._api).execute_function(didentifier, fidentifier, meta_data, process_state)
 
+    def receive_partial(self, didentifier, fidentifier, meta_data, iteration, partial):
+        self._validate_api()
+        async(self._api).receive_partial(didentifier, fidentifier, meta_data, iteration, partial)
+
     def send_ghost(self, left_ghost, right_ghost, needs_both, didentifier, fidentifier, fun_args):
         self._validate_api()
         async(self._api).send_ghost(left_ghost, right_ghost, needs_both, didentifier, fidentifier, fun_args)
@@ -85,6 +105,10 @@ class _InternalStorageApi(_StorageApi):
         self._validate_api()
         async(self._api).ready(didentifier, fidentifier, meta_data, process_state)
 
+    def purge(self, identifier):
+        self._validate_api()
+        return self._api.purge(identifier)
+
 
 class GatewayApi(object):
     def __init__(self, gateway_uri):
@@ -105,6 +129,9 @@ class GatewayApi(object):
     def get_submitted_jobs(self):
         return self._api.get_submitted_jobs()
 
+    def get_cache_statistics(self):
+        return self._api.get_cache_statistics()
+
     @staticmethod
     def _set_dataset_by_function(name, package, extra_meta_data, funcion):
         with open(getsourcefile(import_class(package)), "r") as f:
@@ -122,6 +149,9 @@ class GatewayApi(object):
     def delete(self, name):
         return self._api.delete(name)
 
+    def pin(self, name, is_pinned):
+        return self._api.pin(name, is_pinned)
+
     def exists(self, name):
         return self._api.exists(name)
 
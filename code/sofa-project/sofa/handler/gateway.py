@@ -3,13 +3,20 @@
 # Created by Steffen Karlsson on 02-11-2016
 # Copyright (c) 2016 The Niels Bohr Institute at University of Copenhagen. All rights reserved.
 
-from collections import defaultdict
+from collections import defaultdict, deque
+from copy import copy
 from inspect import isclass, getmembers
 from math import floor, ceil
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from os import path
 from random import choice
-from sys import getsizeof
+from sys import exc_info
+from threading import BoundedSemaphore, Lock, local
+from uuid import uuid4
 from Pyro4 import expose
+from Pyro4.errors import CommunicationError
+from numpy import ndarray
 
 from ujson import loads
 
@@ -19,9 +26,19 @@ from sofa.error import is_error, is_processing, STATUS_INVALID_DATA, STATUS_NOT_
     STATUS_SUCCESS, STATUS_NOT_ALLOWED
 from sofa.foundation import strategy as sofa_strategies
 from sofa.foundation.operation import OperationContext
-from sofa.handler import get_class_from_source, unique_and_preserve
+from sofa.handler import get_class_from_source, unique_and_preserve, split_into_blocks, slice_into_blocks
 from sofa.handler.api import _StorageApi
 from sofa.secure import secure_load, secure
+from sofa.storage.codec import is_valid_codec, encode as encode_block
+
+MAX_BATCH_SIZE = 16  # Blocks sent to a storage node in one call
+MAX_BLOCKS_IN_FLIGHT = 64  # Blocks sent, which a storage node hasn't acknowledged yet
+MAX_BATCHES_IN_FLIGHT = 4  # Calls to a storage node at the same time
+
+
+def _is_finished(results):
+    # Results of jobs still processing can't be evicted
+    return not any(is_processing(result) for result in results.values())
 
 
 def find_identifier(name, mod):
@@ -29,19 +46,142 @@ def find_identifier(name, mod):
     return identifier if mod is None else identifier % mod
 
 
-def get_size(obj):
-    size = getsizeof(obj)
+def _prepare_block(class_context, block_codec, block):
+    # Zone map of the entries, used by storage nodes to skip blocks
+    summary = class_context.get_block_summary(block)
+
+    # Serialize data if needed, native arrays are stored as they are by the storage nodes
+    if class_context.is_serialized() and not class_context.is_native_array():
+        block = class_context.serialize(block)
+
+    # Compress once, such that the block is sent, replicated and stored compressed
+    if block_codec:
+        block = encode_block(block, block_codec)
+
+    return block, summary
+
+
+_process_contexts = {}
+
+
+def _prepare_block_in_process(args):
+    digest, source, class_name, block_codec, block = args
+
+    # The dataset class is loaded once by every process, several classes can share the source
+    if (digest, class_name) not in _process_contexts:
+        _process_contexts[(digest, class_name)] = get_class_from_source(secure_load(digest, source), class_name)
+
+    return _prepare_block(_process_contexts[(digest, class_name)], block_codec, block)
+
+
+class _BlockSender(object):
+    """
+    Sends batches of blocks to the storage nodes from background threads per storage node, such that all
+    storage nodes are written to in parallel, while the next blocks are prepared. Several batches are in flight
+    to each storage node, which writes them in the order they are sent by their position in the sequence of the
+    append. Waits when too many blocks are in flight to a storage node. When a batch fails, the later batches of
+    that storage node aren't written, such that its blocks stay in order.
+    """
+
+    def __init__(self, function_delegation, identifier, max_in_flight=MAX_BLOCKS_IN_FLIGHT,
+                 max_batches=MAX_BATCHES_IN_FLIGHT):
+        self.__fd = function_delegation
+        self.__identifier = identifier
+        self.__max_in_flight = max_in_flight
+        self.__max_batches = max_batches
+        self.__stream = uuid4().hex
+        self.__senders = {}
+        self.__connections = local()
+        self.__pending = []
+        self.__lock = Lock()
+        self.__status = STATUS_SUCCESS
+        self.__status_position = None
+        self.__error = None
+        self.__written = defaultdict(int)
+        self.__failed = set()
+
+    def __get_sender(self, storage_node):
+        uri = storage_node.get_uri()
+        if uri not in self.__senders:
+            self.__senders[uri] = [ThreadPool(self.__max_batches), BoundedSemaphore(self.__max_in_flight), 0]
+
+        return self.__senders[uri]
+
+    def send(self, storage_node, batch):
+        sender = self.__get_sender(storage_node)
+        pool, in_flight, position = sender
+        for _ in batch:
+            in_flight.acquire()
+
+        sender[2] += 1
+        self.__pending.append(pool.apply_async(self.__send, (storage_node, batch, in_flight, position)))
+
+    def __get_connection(self, storage_node):
+        # A proxy sends one call at a time, every thread has a connection of its own
+        connections = self.__connections.__dict__.setdefault('connections', {})
+        uri = storage_node.get_uri()
+        if uri not in connections:
+            connections[uri] = copy(storage_node)
+
+        return connections[uri]
+
+    def __send(self, storage_node, batch, in_flight, position):
+        uri = storage_node.get_uri()
+        status = None
+        try:
+            if uri not in self.__failed:
+                storage_node = self.__get_connection(storage_node)
+                fd = copy(self.__fd)
+                fd['sequence'] = self.__stream, position
+                status = storage_node.append_many(fd, self.__identifier, batch)
+        except CommunicationError:
+            status = STATUS_NOT_FOUND, "Storage node %s isn't reachable" % uri
+        except Exception:
+            # Raised by join, after the written blocks are recorded
+            with self.__lock:
+                self.__error = self.__error or exc_info()
+                self.__failed.add(uri)
+        finally:
+            for _ in batch:
+                in_flight.release()
+
+        if status is None:
+            return
+
+        with self.__lock:
+            if is_error(status):
+                self.__failed.add(uri)
+                # Keep the error of the first failed batch, the later batches of the storage node are refused
+                if self.__status_position is None or position < self.__status_position:
+                    self.__status, self.__status_position = status, position
+            else:
+                self.__written[uri] += len(batch)
+
+    def join(self):
+        """
+        Waits for all batches to be sent and returns the first error or success. Remote errors of the storage
+        nodes are raised by raise_error.
+        """
+
+        for pool, _, _ in self.__senders.values():
+            pool.close()
+
+        for pending in self.__pending:
+            pending.wait()
+
+        return self.__status
+
+    def get_written(self):
+        """
+        Returns the number of blocks acknowledged by every storage node, and the storage nodes, where a batch
+        failed, which may have written some of it
+        """
+
+        return dict(self.__written), set(self.__failed)
 
-    if isinstance(obj, dict):
-        size += sum((get_size(v) for v in obj.values()))
-        size += sum((get_size(k) for k in obj.keys()))
-    elif hasattr(obj, 'nbytes'):
-        size += eval("obj.nbytes")
-    elif hasattr(obj, '__dict__'):
-        size += get_size(obj.__dict__)
-    elif hasattr(obj, '__iter__') and not isinstance(obj, (str, bytes, bytearray)):
-        size += sum((get_size(i) for i in obj))
-    return size
+    def raise_error(self):
+        if self.__error:
+            raise self.__error[0], self.__error[1], self.__error[2]
 
 
 @expose
@@ -49,9 +189,19 @@ class GatewayHandler(object):
     def __init__(self, config, others):
         self.__config = config
         self.__block_size = config.block_size * 1000000  # To bytes from MB
-        self.__gcs = CacheSystem(defaultdict, args=dict)
+        self.__gcs = CacheSystem(defaultdict, args=dict,
+                                 max_size=config.result_cache_size * 1000000,  # To bytes from MB
+                                 policy=config.cache_policy,
+                                 ttl=config.cache_ttl,
+                                 evictable=_is_finished)
         self.__num_storage_nodes = len(others['storage'])
         self.__storage_nodes = [_StorageApi(storage_uri) for storage_uri, _ in others['storage']]
+        self.__ingest_pool = Pool(config.ingest_processes) if config.ingest_processes > 0 else None
+
+    def shutdown(self):
+        if self.__ingest_pool is not None:
+            self.__ingest_pool.close()
+            self.__ingest_pool.join()
 
     def __find_identifier(self, name):
         return find_identifier(name, self.__config.keyspace_size)
@@ -107,6 +257,10 @@ class GatewayHandler(object):
                                not all(isinstance(k, OperationContext) for k in operations)):
             raise NotImplementedError("Operations has to be of type OperationContext")
 
+        block_codec = context.get_block_codec()
+        if not is_valid_codec(block_codec):
+            return STATUS_INVALID_DATA, "%s is an invalid block codec" % block_codec
+
         if not extra_meta_data:
             extra_meta_data = {}
 
@@ -118,6 +272,7 @@ class GatewayHandler(object):
                                 'package': package,
                                 'source': pdata,
                                 'replication-factor': context.get_replication_factor(),
+                                'block-codec': block_codec,
                                 'num-blocks': 0})
         extra_meta_data['operations'] = [(operation.fun_name, operation.get_num_arguments())
                                          for operation in operations] if operations else []
@@ -142,10 +297,39 @@ class GatewayHandler(object):
 
     def delete(self, name):
         identifier = self.__find_identifier(self.__virtualize_name(name))
+        res = self.__get_meta_from_identifier(identifier)
+        if is_error(res):
+            return res
 
         # Remove global cached results by this dataset
         self.__gcs.delete(identifier)
-        return self.__get_storage_node().delete(identifier)
+
+        fd = FunctionDelegation(identifier) \
+            .as_dispatch_delegation() \
+            .as_required_queue_delegation(None, res['replication-factor'])
+
+        return self.__get_storage_node().delete(fd, identifier)
+
+    def pin(self, name, is_pinned):
+        identifier = self.__find_identifier(self.__virtualize_name(name))
+        res = self.__get_meta_from_identifier(identifier)
+        if is_error(res):
+            return res
+
+        fd = FunctionDelegation(identifier) \
+            .as_dispatch_delegation() \
+            .as_required_queue_delegation(None, res['replication-factor'])
+
+        # Stored in the meta data, such that storage nodes started again pins the dataset too
+        self.__get_storage_node().update_meta_key(fd, identifier, 'override', 'pinned', is_pinned)
+
+        for storage_node in self.__storage_nodes:
+            if storage_node.get_uri() in res.get('storage-nodes', []):
+                status = storage_node.pin(identifier, is_pinned)
+                if is_error(status):
+                    return status
+
+        return STATUS_SUCCESS
 
     def append(self, name, data, is_serialized):
         identifier = self.__find_identifier(self.__virtualize_name(name))
@@ -197,25 +381,46 @@ class GatewayHandler(object):
 
         nodes_with_blocks = []
 
-        for block in self.__next_block(class_context, data):
-            # Serialize data if needed
-            if class_context.is_serialized():
-                block = class_context.serialize(block)
+        # Blocks are batched per storage node, and sent to all storage nodes in parallel
+        sender = _BlockSender(fd, identifier)
+        batches = defaultdict(list)
+
+        failure = None
+        try:
+            for block, summary in self.__prepare_blocks(class_context, meta_data, data):
+                # Store at primary replica first
+                storage_node = self.__storage_nodes[start]
+                batch = batches[start]
+                batch.append((block, create_new_stride, summary))
+                nodes_with_blocks.append(storage_node.get_uri())
+
+                block_count += 1
+                current_stride += 1
+
+                # Create new stride if first iteration or max local block count reached
+                create_new_stride = current_stride == max_stride
+
+                if len(batch) == MAX_BATCH_SIZE:
+                    sender.send(storage_node, batches.pop(start))
 
-            # Store at primary replica first
-            storage_node = self.__storage_nodes[start]
-            storage_node.append(fd, identifier, block, create_new_stride)
-            nodes_with_blocks.append(storage_node.get_uri())
+                if create_new_stride:
+                    current_stride = 0
+                    start = (start + 1) % num_storage_nodes
 
-            block_count += 1
-            current_stride += 1
+            for idx, batch in batches.items():
+                sender.send(self.__storage_nodes[idx], batch)
+        except Exception:
+            # Raised after the blocks already sent are recorded
+            failure = exc_info()
 
-            # Create new stride if first iteration or max local block count reached
-            create_new_stride = current_stride == max_stride
+        status = sender.join()
 
-            if create_new_stride:
-                current_stride = 0
-                start = (start + 1) % num_storage_nodes
+        # Only the written blocks are recorded, if preparing a block or a storage node failed. Storage nodes which may
+        # have written some of a failed batch are recorded too, such that none of their blocks are left out.
+        written, failed = sender.get_written()
+        if failed or failure:
+            block_count = sum(written.values())
+            nodes_with_blocks = [uri for uri in nodes_with_blocks if uri in written or uri in failed]
 
         fd = FunctionDelegation(identifier) \
             .as_dispatch_delegation() \
@@ -225,28 +430,40 @@ class GatewayHandler(object):
         unique_nodes_with_blocks = unique_and_preserve(nodes_with_blocks)
         self.__get_storage_node().update_meta_key(fd, identifier, 'append', 'storage-nodes', unique_nodes_with_blocks)
 
+        if failure:
+            raise failure[0], failure[1], failure[2]
+        sender.raise_error()
+        return status
+
+    def __prepare_blocks(self, class_context, meta_data, data):
+        block_codec = meta_data.get('block-codec')
+        blocks = self.__next_block(class_context, data)
+
+        is_serialized = class_context.is_serialized() and not class_context.is_native_array()
+        if self.__ingest_pool is None or not (is_serialized or block_codec):
+            for block in blocks:
+                yield _prepare_block(class_context, block_codec, block)
+            return
+
+        # Prepared by the processes in parallel, but yielded in order, since the order decides the placement
+        pending = deque()
+        for block in blocks:
+            args = meta_data['digest'], meta_data['source'], meta_data['class-name'], block_codec, block
+            pending.append(self.__ingest_pool.apply_async(_prepare_block_in_process, (args,)))
+
+            # Bounded, such that blocks aren't read faster than they're sent
+            if len(pending) > 2 * self.__config.ingest_processes:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
     def __next_block(self, context, data):
-        block = []
-        block_size = 0
-        for entry in context.next_entry(data):
-            entry_size = get_size(entry)
-            if entry_size == 0:
-                continue
-
-            if block_size + entry_size > self.__block_size:
-                if len(block) == 0:
-                    block.append(entry)
-
-                yield block
-                block = [entry]
-                block_size = 0
-            else:
-                block_size += entry_size
-                block.append(entry)
+        if context.is_row_sliced():
+            # Blocks of whole rows, sliced without iterating over every row
+            return slice_into_blocks([data] if isinstance(data, ndarray) else data, self.__block_size)
 
-        if block:
-            # Check if block is not empty and yield rest
-            yield block
+        return split_into_blocks(context.next_entry(data), self.__block_size, context.get_entry_size)
 
     def get_operations(self, name):
         return self.__get_property(name, 'operations')
@@ -257,6 +474,12 @@ class GatewayHandler(object):
     def get_submitted_jobs(self):
         return self.__get_storage_node().get_submitted_jobs()
 
+    def get_cache_statistics(self):
+        return {
+            'gateway': self.__gcs.get_statistics(),
+            'storage': self.__get_storage_node().get_cache_statistics()
+        }
+
     def get_description(self, name):
         return self.__get_property(name, 'description')
 
@@ -296,6 +519,11 @@ class GatewayHandler(object):
         if is_processing(job_res):
             return STATUS_PROCESSING, None
 
+        if is_error(job_res):
+            # Reported once, such that the job is submitted again
+            del result_cache[fidentifier]
+            return job_res[0], (job_res[1], False)
+
         job_res = job_res[1]
         return STATUS_SUCCESS, (job_res, isinstance(job_res, str) and path.exists(job_res))
 
@@ -4,30 +4,46 @@
 # Copyright (c) 2016 The Niels Bohr Institute at University of Copenhagen. All rights reserved.
 
 from collections import Iterable
+from copy import copy
 from collections import defaultdict
 from inspect import isfunction, isbuiltin
-from itertools import izip_longest
-from logging import info
-from multiprocessing.pool import ThreadPool
+from itertools import izip_longest, chain
+from logging import info, exception
+from multiprocessing import Pool
 from os.path import basename, isfile
 from re import compile
 from shelve import open
 from sys import getsizeof
+from threading import Lock, RLock
+from types import GeneratorType
 from Pyro4 import expose
+from Pyro4.errors import CommunicationError
 from ujson import loads, dumps
+from cPickle import dumps as pickle_dumps, HIGHEST_PROTOCOL, PicklingError
 
-from numpy import ndarray
+from numpy import ndarray, concatenate
 
 from sofa.cache import CacheSystem
-from sofa.delegation import DelegationHandler
+from sofa.delegation import DelegationHandler, FunctionDelegation
 from sofa.delegation.responsible_dispatch import with_responsible_dispatch, find_responsible
 from sofa.delegation.queue import with_forward_count, with_forward_queue, with_required_queue
 from sofa.error import STATUS_ALREADY_EXISTS, STATUS_NOT_FOUND, STATUS_SUCCESS, \
-    STATUS_PROCESSING, STATUS_NO_DATA, is_error
-from sofa.foundation.operation import Sequential as SequentialOperation, Parallel as ParallelOperation
-from sofa.handler import get_class_from_source, get_function_from_source, unique_and_preserve
+    STATUS_PROCESSING, STATUS_NO_DATA, STATUS_NOT_ALLOWED, STATUS_INVALID_DATA, is_error
+from sofa.foundation.executor import BoundedExecutor
+from sofa.foundation.operation import Sequential as SequentialOperation, Parallel as ParallelOperation, \
+    ExecutionMode
+from sofa.foundation.scheduler import BackgroundDaemonScheduler
+from sofa.foundation.strategy import Tiles
+from sofa.handler import get_class_from_source, get_function_from_source, unique_and_preserve, get_size, \
+    split_into_blocks, slice_into_blocks
 from sofa.handler.api import _InternalStorageApi, _InternalGatewayApi
 from sofa.secure import secure_load
+from sofa.storage.block_cache import BlockCache
+from sofa.storage.block_log import BlockLog
+from sofa.storage.codec import encode as encode_block
+from sofa.storage.meta_store import MetaStore
+from sofa.storage.ndarray_format import share_block, open_shared_block
+from sofa.storage.zone_map import has_bounds
 from sofa.tree_barrier import TreeBarrier
 
 RESULT = 0
@@ -36,12 +52,19 @@ ROOT_IS_WORKING = 2
 GATEWAY = 3
 STATE = 4
 
+COVERED = 0
+PARTIAL = 1
+
 BLOCKS = 0
 QUERY = 1
 META_DATA = 4
 
+CHUNKS_PER_WORKER = 4  # Chunks of blocks computed by each thread or process, such that they finish evenly
+
 PRIMARY_REPLICA = 0
 
+MAX_PLANS = 64  # Compiled dataset classes kept by the node
+
 
 def _forward_and_extract(fun, max_num_args):
     # Forwards to the right function (fun) with possible extracted arguments based on the pattern
@@ -108,43 +131,201 @@ def _modify_blocks(handler, args, operation_context_args, format_func_name):
     handler.save_partial_value_state(didentifier, fidentifier, blocks)
 
 
+class _Plan(object):
+    """
+    Compiled dataset class, shared by every job on the node: the verified source, the instantiated class,
+    its parsed operations by name, the functions resolved by name and whether map functions return an output
+    per block by name.
+    """
+
+    def __init__(self, source, class_context):
+        self.source = source
+        self.class_context = class_context
+        self.operations = {}
+        self.functions = {}
+        self.per_block_maps = {}
+
+        for operation_context in class_context.get_operations() or []:
+            # The first operation with the name, as when searching them in order
+            self.operations.setdefault(operation_context.fun_name, operation_context)
+
+
+# By source digest and class name, since several classes can share the source, the least recently used is evicted
+_plans = CacheSystem(dict, max_size=MAX_PLANS, size_fun=lambda plan: 1, track_mutations=False)
+_plans_lock = Lock()
+
+
+def _get_plan(meta_data):
+    key = (meta_data['digest'], meta_data['class-name'])
+    with _plans_lock:
+        if _plans.contains(key):
+            return _plans.get(key)
+
+    # Compiled without holding the lock, such that other datasets aren't waiting for it
+    source = secure_load(meta_data['digest'], meta_data['source'])
+    plan = _Plan(source, get_class_from_source(source, meta_data['class-name']))
+
+    with _plans_lock:
+        if _plans.contains(key):
+            # Compiled by another job meanwhile, every job shares the same plan
+            return _plans.get(key)
+
+        _plans.put(key, plan)
+        return plan
+
+
+def _forget_plans(digest):
+    with _plans_lock:
+        for key in [key for key in _plans.keys() if key[0] == digest]:
+            _plans.delete(key)
+
+
 def _get_contexts(function_name, meta_data):
     if meta_data['num-blocks'] == 0:
         # No data found for data identifier
         return STATUS_NOT_FOUND
 
-    class_context = _get_class_context(meta_data)
-    for operation_context in class_context.get_operations():
-        if operation_context.fun_name == function_name:
-            return operation_context, class_context
+    plan = _get_plan(meta_data)
+    if function_name not in plan.operations:
+        return STATUS_NOT_FOUND
 
-    return STATUS_NOT_FOUND
+    return plan.operations[function_name], plan.class_context
 
 
 def _get_function(meta_data, func_name):
-    source = secure_load(meta_data['digest'], meta_data['source'])
-    return get_function_from_source(source, func_name)
+    plan = _get_plan(meta_data)
+    if func_name not in plan.functions:
+        plan.functions[func_name] = get_function_from_source(plan.source, func_name)
+
+    return plan.functions[func_name]
 
 
 def _get_class_context(meta_data):
-    source = secure_load(meta_data['digest'], meta_data['source'])
-    return get_class_from_source(source, meta_data['class-name'])
+    return _get_plan(meta_data).class_context
 
 
 def _get_storage_nodes_for_dataset(meta_data):
     return unique_and_preserve(meta_data['storage-nodes'])
 
 
+class _SkippedPartial(object):
+    # The partial result of a node, where the block filter skips every block. It's left out when merging.
+    pass
+
+
+def _without_skipped(partials):
+    return [partial for partial in partials if not isinstance(partial, _SkippedPartial)]
+
+
+class _FailedPartial(object):
+    # The partial result of a node, where the job failed. It's passed on to the root, which reports the failure.
+    def __init__(self, message):
+        self.message = message
+
+
+def _is_marker(partial):
+    # Neither serialized nor deserialized, since it isn't a partial result of the functions
+    return isinstance(partial, (_SkippedPartial, _FailedPartial))
+
+
+def _reduce_nothing(operation_context):
+    # The result of no blocks, if the last function has one, e.g. 0 by sum but none by max
+    try:
+        return operation_context.get_functions()[-1]([])
+    except (ValueError, TypeError, IndexError):
+        return None
+
+
+def _is_block_independent(operation_context):
+    # Whether the result of a block doesn't depend on other blocks, i.e. no ghosts or keywords exchanging ghosts
+    return not operation_context.needs_ghost() and not _has_keywords(operation_context.functions)
+
+
+def _has_keywords(functions):
+    for function in functions:
+        if isinstance(function, (SequentialOperation, ParallelOperation)):
+            if _has_keywords(function.functions):
+                return True
+        elif isinstance(function, str) and any(keyword.findall(function) for keyword in KEYWORDS):
+            return True
+    return False
+
+
 def _str_loads(s):
     while not isinstance(s, dict):
         s = loads(s)
     return s
 
 
+def _get_map_function(operation_context):
+    # The first function called on the blocks, unless they are reached by keywords or suboperations first
+    for function in operation_context.functions:
+        if isinstance(function, (SequentialOperation, ParallelOperation)):
+            return None
+        if not isinstance(function, str):
+            return function
+    return None
+
+
+def _map_in_process(args):
+    meta_data, function, blocks, query = args
+
+    # The dataset class is compiled once by every process
+    if isinstance(function, str):
+        function = _get_plan(meta_data).class_context.verify_function(function)
+
+    # Consumed by the process, since generators can't be sent back
+    return _materialize(_call_function(function, [open_shared_block(block) for block in blocks], query))
+
+
+def _get_function_ref(function, class_context):
+    # The map function is sent to the processes by name, or pickled if built in, or None if it can't be sent
+    if not isbuiltin(function):
+        function_name = _get_function_name(function)
+        return function_name if class_context.verify_function(function_name) is not None else None
+
+    try:
+        pickle_dumps(function, HIGHEST_PROTOCOL)
+        return function
+    except (PicklingError, TypeError):
+        return None
+
+
+def _is_per_block(output, blocks):
+    return (isinstance(output, list) or isinstance(output, ndarray) and output.ndim > 0) and len(output) == len(blocks)
+
+
+def _concatenate(outputs):
+    if all(isinstance(output, ndarray) for output in outputs):
+        return concatenate(outputs)
+    return list(chain.from_iterable(outputs))
+
+
 class WillContinueExecuting(Exception):
     pass
 
 
+class _Job(object):
+    """
+    Execution context of a job on a storage node, such that many jobs can execute on the node at once.
+    Holds the schedule of the reduction, the process state of the node, the contexts of its operation, the
+    partial results of its functions and the partial results received from the other nodes by iteration.
+    """
+
+    def __init__(self, barrier, process_state):
+        self.barrier = barrier
+        self.process_state = process_state
+        self.contexts = None
+        self.partial = None
+        self.result = None
+        self.received = {}
+        self.iteration = 0
+        self.has_result = False
+        self.executed_from = None  # Function count the execution started from, continued after keywords
+        self.is_reduced = False
+        self.lock = RLock()
+
+
 class Keywords(dict):
     SHOULD_BREAK = True
     SHOULD_NOT_BREAK = False
@@ -176,15 +357,33 @@ KEYWORDS = Keywords()
 class StorageHandler(DelegationHandler):
     def __init__(self, config, others):
         self.__config = config
-        self.__tb = None
-        self.__srcs = CacheSystem(defaultdict, args=dict)  # Storage Result Cache System
-        self.__dgcs = CacheSystem(defaultdict, args=dict)  # Dataset Ghosts Cache System
+        # Forked before the threads of the node are started
+        self.__map_pool = Pool(self.__config.map_processes) if self.__config.map_processes > 0 else None
+        self.__srcs = CacheSystem(defaultdict, args=dict,
+                                  max_size=self.__config.result_cache_size * 1000000,  # To bytes from MB
+                                  policy=self.__config.cache_policy,
+                                  ttl=self.__config.cache_ttl,
+                                  evictable=_is_finished)  # Storage Result Cache System
+        self.__dgcs = CacheSystem(defaultdict, args=dict)  # Dataset Ghosts Cache System, emptied when consumed
+        self.__ipcs = CacheSystem(dict,
+                                  max_size=self.__config.result_cache_size * 1000000,  # To bytes from MB
+                                  policy=self.__config.cache_policy,
+                                  ttl=self.__config.cache_ttl,
+                                  track_mutations=False)  # Incremental Partial result Cache System
+        self.__mmcs = CacheSystem(dict,
+                                  max_size=self.__config.map_cache_size * 1000000,  # To bytes from MB
+                                  policy=self.__config.cache_policy,
+                                  track_mutations=False)  # Memoized Map output Cache System
+        self.__mcs = CacheSystem(dict)  # Meta data Cache System
+        self.__dbcs = BlockCache(self.__config.block_cache_size * 1000000, get_size)  # Decoded Block Cache System
 
         if 'storage' in others:
             self.__storage_nodes = [_InternalStorageApi(storage_uri) for storage_uri, _ in others['storage']
                                     if storage_uri != self.__config.node]
+            self.__storage_uris = [storage_uri for storage_uri, _ in others['storage']]
         else:
             self.__storage_nodes = []
+            self.__storage_uris = [self.__config.node]
 
         self.__num_storage_nodes = len(self.__storage_nodes)
         self.__neighbors = self.__get_neighbors()
@@ -194,12 +393,45 @@ class StorageHandler(DelegationHandler):
         super(StorageHandler, self).__init__(self.__config.node_idx, space_size)
 
         self.__DISK = {}
+        self.__META = {}
         self.__FLAG = open(self.__get_mounted_filename('sofa_flag.db'), writeback=True)
+        # Deleted datasets, which still have to be purged on the storage nodes holding blocks of them
+        self.__TOMBSTONE = open(self.__get_mounted_filename('sofa_tombstone.db'), writeback=True)
         # Create primary replica
         self.__create_replica(PRIMARY_REPLICA)
 
+        # Jobs by (didentifier, fidentifier) executing on this node, whose blocks therefore can't be compacted
+        self.__jobs = {}
+        # Datasets by the number of pins reading their blocks, which can't be compacted either
+        self.__pinning = defaultdict(int)
+        self.__compaction_lock = Lock()
+        # Held while compaction stages blocks, which collecting garbage would relocate, outside compaction lock
+        self.__rewrite_lock = Lock()
+        self.__compacted = {}  # Block versions of datasets at their last compaction
+        self.__compaction_statistics = {'compacted-datasets': 0, 'reclaimed-bytes': 0}
+        self.__reclamation_statistics = {'purged-datasets': 0, 'collected-segments': 0, 'reclaimed-bytes': 0}
+        self.__scheduler = None
+        self.setup_schedulers()
+
+        # Long-lived, such that requests don't start threads, for fan-out to the other nodes and local computations
+        self.__rpc_executor = BoundedExecutor(self.__config.rpc_threads)
+        self.__compute_executor = BoundedExecutor(self.__config.compute_threads)
+
+    def setup_schedulers(self):
+        self.__scheduler = BackgroundDaemonScheduler()
+        if self.__config.compaction_interval > 0:
+            self.__scheduler.add_job(self.__scheduler_compaction, 'interval',
+                                     seconds=self.__config.compaction_interval)
+        if self.__config.reclamation_interval > 0:
+            self.__scheduler.add_job(self.__scheduler_reclamation, 'interval',
+                                     seconds=self.__config.reclamation_interval)
+        self.__scheduler.start()
+
     def __create_replica(self, index):
-        self.__DISK[index] = open(self.__get_mounted_filename("sofa_replica_%d.db" % index), writeback=True)
+        # Blocks are striped over all mount points
+        self.__DISK[index] = BlockLog(["%s%s" % (mount_point, "sofa_replica_%d" % index)
+                                       for mount_point in self.__config.get_mount_points()])
+        self.__META[index] = MetaStore(self.__get_mounted_filename("sofa_meta_%d.db" % index))
 
     def __find_replica(self, index):
         # See if replica with index exists
@@ -209,22 +441,94 @@ class StorageHandler(DelegationHandler):
 
         return self.__DISK[index]
 
+    def __find_meta_store(self, index):
+        # Meta data is created together with the replica
+        self.__find_replica(index)
+        return self.__META[index]
+
     def __get_mounted_filename(self, filename):
         return "%s%s" % (self.__config.get_mount_point(), filename)
 
+    def shutdown(self):
+        # The pending writes to the other replicas are finished first
+        releases = [self.wait_for_forwards, self.__scheduler.shutdown, self.__rpc_executor.shutdown, self.__compute_executor.shutdown]
+        if self.__map_pool is not None:
+            releases += [self.__map_pool.close, self.__map_pool.join]
+        # The stores are closed last, when nothing computes on them anymore
+        releases += [replica.close for replica in self.__DISK.values()] + \
+                    [meta_store.close for meta_store in self.__META.values()] + \
+                    [self.__FLAG.close, self.__TOMBSTONE.close]
+
+        for release in releases:
+            try:
+                release()
+            except Exception:
+                # The other resources are released anyway
+                exception("Releasing by %r failed on %s" % (release, str(self)))
+
     def get_responsible(self, index):
         # Offset by this nodes position, since it's not part of storage nodes
         return self.__storage_nodes[index + (-1 if index >= self.__config.node_idx else 0)]
 
     def save_partial_value_state(self, didentifier, fidentifier, res):
-        is_root = str(didentifier) in self.__FLAG
-        if is_root:
-            self.__srcs.get(didentifier)[fidentifier][RESULT] = res
-        else:
-            self.__srcs.get(didentifier)[fidentifier] = [res]
+        self.__jobs[(str(didentifier), fidentifier)].partial = res
 
     def get_partial_value(self, didentifier, fidentifier):
-        return self.__srcs.get(didentifier)[fidentifier][RESULT]
+        return self.__jobs[(str(didentifier), fidentifier)].partial
+
+    def execute_parallel(self, fun, args):
+        return self.__compute_executor.map(fun, args)
+
+    def execute_map(self, operation_context, function, blocks, query, meta_data):
+        # Computes the map function on several chunks of the blocks at once, by threads of the node or by the map
+        # processes, and concatenates the outputs in block order
+        execution_mode = operation_context.get_execution_mode()
+        if execution_mode == ExecutionMode.Threads:
+            num_workers = self.__config.compute_threads
+        elif execution_mode == ExecutionMode.Processes and self.__map_pool is not None:
+            num_workers = self.__config.map_processes
+        else:
+            num_workers = 0
+
+        if num_workers < 1 or not isinstance(blocks, list) or len(blocks) < 2:
+            return _call_function(function, blocks, query)
+
+        plan_meta_data = {key: meta_data[key] for key in ('digest', 'source', 'class-name')}
+        plan = _get_plan(plan_meta_data)
+        function_name = _get_function_name(function)
+
+        is_per_block = plan.per_block_maps.get(function_name)
+        if not is_per_block:
+            # Computed once on every block, until it's known to return an output per block
+            output = _materialize(_call_function(function, blocks, query))
+            if is_per_block is None:
+                plan.per_block_maps[function_name] = _is_per_block(output, blocks)
+            return output
+
+        if execution_mode == ExecutionMode.Processes:
+            function_ref = _get_function_ref(function, plan.class_context)
+            if function_ref is None:
+                info("%s can't be sent to the map processes, computed in %s instead" % (function_name, str(self)))
+                return _call_function(function, blocks, query)
+
+        size = -(-len(blocks) // (num_workers * CHUNKS_PER_WORKER))
+        chunks = [blocks[start:start + size] for start in xrange(0, len(blocks), size)]
+
+        if execution_mode == ExecutionMode.Threads:
+            # Consumed by the threads, rather than lazily by the caller after the map
+            outputs = self.__compute_executor.map(
+                lambda chunk: _materialize(_call_function(function, chunk, query)), chunks)
+        else:
+            # Memory-mapped arrays are mapped by the processes themselves, rather than copied
+            outputs = self.__map_pool.map(_map_in_process, [
+                (plan_meta_data, function_ref, [share_block(block) for block in chunk], query) for chunk in chunks])
+
+        if not all(_is_per_block(output, chunk) for output, chunk in zip(outputs, chunks)):
+            # Not computed again, the outputs of the chunks can't be combined
+            plan.per_block_maps[function_name] = False
+            raise ValueError("%s doesn't return an output per block" % function_name)
+
+        return _concatenate(outputs)
 
     def __str__(self):
         return self.__config.node
@@ -234,14 +538,16 @@ class StorageHandler(DelegationHandler):
 
     def get_replication_factor(self, identifier):
         # Only callable on the node responsible for identifier i.e. identifier in self.__FLAGS
-        res = self.__get_meta_from_identifier_and_replica(identifier, PRIMARY_REPLICA)
-        if is_error(res):
+        meta_data = self.__get_parsed_meta(identifier, PRIMARY_REPLICA)
+        if is_error(meta_data):
             raise AttributeError(
                 "get_replication_factor not callable at servers which isn't root for " + str(identifier))
 
-        meta_data = loads(res)
         return meta_data['replication-factor']
 
+    def get_replication_ack(self):
+        return self.__config.replication_ack
+
     def __get_neighbors(self):
         if self.get_num_storage_nodes() == 0:
             return None
@@ -306,11 +612,30 @@ class StorageHandler(DelegationHandler):
         done_callback_handler(is_ready=False, left=(l_neighbor, right_ghost), right=(r_neighbor, left_ghost))
 
     def __get_meta_from_identifier_and_replica(self, identifier, replica_index):
-        if not self.__context_exists(identifier):
+        # Replicas only have the meta data, the flag is kept by the primary replica
+        if replica_index == PRIMARY_REPLICA and not self.__context_exists(identifier):
             return STATUS_NOT_FOUND
 
-        replica_blocks = self.__find_replica(replica_index)
-        return replica_blocks[str(identifier)][0]
+        meta_data = self.__find_meta_store(replica_index).get(str(identifier))
+        return STATUS_NOT_FOUND if meta_data is None else meta_data
+
+    def __get_parsed_meta(self, identifier, replica_index):
+        key = (replica_index, str(identifier))
+        if self.__mcs.contains(key):
+            return self.__mcs.get(key)
+
+        res = self.__get_meta_from_identifier_and_replica(identifier, replica_index)
+        if is_error(res):
+            return res
+
+        meta_data = loads(res)
+        self.__mcs.put(key, meta_data)
+        return meta_data
+
+    def __put_meta(self, identifier, replica_index, meta_data):
+        identifier = str(identifier)
+        self.__find_meta_store(replica_index).put(identifier, dumps(meta_data))
+        self.__mcs.delete((replica_index, identifier))
 
     @with_responsible_dispatch
     @with_required_queue
@@ -327,23 +652,58 @@ class StorageHandler(DelegationHandler):
         if self.__context_exists(identifier) and not is_update:
             return STATUS_ALREADY_EXISTS, "Dataset already exists"
 
+        if str(identifier) in self.__TOMBSTONE and not self.__reclaim(str(identifier)):
+            # Blocks of the deleted dataset would otherwise be part of the new one
+            return STATUS_NOT_ALLOWED, "Dataset is still being deleted"
+
         info("Creating context with identifier %s at replica %d on %s."
              % (identifier, function_delegation['replica-index'], self.__config.node))
 
-        replica_blocks = self.__find_replica(function_delegation['replica-index'])
-
-        identifier = str(identifier)
-        self.__FLAG[identifier] = True
-        replica_blocks[identifier] = [dumps(meta_data)]
+        replica_index = function_delegation['replica-index']
+        if not is_update:
+            # Start over without any blocks
+            self.__find_replica(replica_index).drop(str(identifier))
+            self.__dbcs.invalidate(str(identifier))
+            self.__invalidate_partials(identifier)
+            self.__invalidate_map_outputs(identifier)
+
+        if replica_index == PRIMARY_REPLICA:
+            # Only the primary replica is responsible for the dataset
+            self.__FLAG[str(identifier)] = True
+        self.__put_meta(identifier, replica_index, meta_data)
 
         return STATUS_SUCCESS
 
     @with_required_queue
     @with_forward_count
-    def append(self, function_delegation, identifier, block, create_new_stride):
+    def append(self, function_delegation, identifier, block, create_new_stride, summary=None):
         # TODO: Block from calling any other operation on this context, while append is finishing
         replica_index = function_delegation['replica-index']
 
+        # Delete results, since context is appended
+        self.__invalidate_results(identifier)
+
+        self.__append_block(identifier, replica_index, block, create_new_stride, summary)
+        return STATUS_SUCCESS
+
+    @with_required_queue
+    @with_forward_count
+    def append_many(self, function_delegation, identifier, blocks):
+        """
+        Appends a batch of blocks in order, each given as a (block, create_new_stride, summary) tuple
+        """
+
+        replica_index = function_delegation['replica-index']
+
+        # Delete results once for the entire batch
+        self.__invalidate_results(identifier)
+
+        for block, create_new_stride, summary in blocks:
+            self.__append_block(identifier, replica_index, block, create_new_stride, summary)
+
+        return STATUS_SUCCESS
+
+    def __append_block(self, identifier, replica_index, block, create_new_stride, summary):
         if isinstance(block, unicode):
             block = block.encode("ascii")
 
@@ -354,39 +714,124 @@ class StorageHandler(DelegationHandler):
         replica_blocks = self.__find_replica(replica_index)
 
         identifier = str(identifier)
-        if identifier not in replica_blocks:
-            replica_blocks[identifier] = []
-
-        if create_new_stride:
-            replica_blocks[identifier].append(block)
-        else:
-            replica_blocks[identifier][-1].extend(block)
-
-        # Delete local cache, since context is appended
-        self.__srcs.delete(identifier)
+        with self.__compaction_lock:
+            if create_new_stride:
+                replica_blocks.append(identifier, block, summary)
+            else:
+                versions = replica_blocks.get_block_versions(identifier)
+                replica_blocks.extend(identifier, block, summary)
 
-        return STATUS_SUCCESS
+                # Only the extended block has changed
+                extended_index = replica_blocks.num_blocks(identifier) - 1
+                self.__dbcs.invalidate(identifier, extended_index)
+                self.__invalidate_partials(identifier, extended_index)
+                if versions:
+                    self.__invalidate_map_outputs(identifier, versions[-1])
 
     @with_responsible_dispatch
     @with_required_queue
     @with_forward_count
     def delete(self, function_delegation, identifier):
-        # TODO: Block from calling any other operation on this context
-
-        # # Delete all blocks
-        # local_blocks = len(self.__RAW[identifier]) - 1  # Remove meta data from number of blocks
-        # total_blocks = int(loads(self.__RAW[identifier][0])['num-blocks'])
-        #
-        # if local_blocks != total_blocks:
-        #     # TODO delete the rest of the blocks on other storage nodes
-        #     pass
-        #
-        # # Delete local blocks + meta data
-        # del self.__RAW[identifier]
-        #
-        # # Delete local cache and ghosts, since context is removed
-        # self.__srcs.delete(identifier)
-        # self.__dgcs.delete(identifier)
+        replica_index = function_delegation['replica-index']
+
+        res = self.__get_meta_from_identifier_and_replica(identifier, replica_index)
+        if is_error(res):
+            return res, "Dataset doesn't exists"
+
+        meta_data = loads(res)
+        if replica_index == PRIMARY_REPLICA:
+            # The blocks, replicas and results on every node holding them are purged in the background
+            self.__TOMBSTONE[str(identifier)] = self.__get_holders(meta_data.get('storage-nodes', []),
+                                                                   meta_data['replication-factor'])
+            self.__TOMBSTONE.sync()
+
+        info("Deleting dataset with identifier %s at replica %d on %s." % (identifier, replica_index, str(self)))
+
+        # Hides the dataset instantly from datasets and jobs
+        if replica_index == PRIMARY_REPLICA:
+            del self.__FLAG[str(identifier)]
+            self.__FLAG.sync()
+        self.__find_meta_store(replica_index).delete(str(identifier))
+        self.__mcs.delete((replica_index, str(identifier)))
+        self.__invalidate_results(identifier)
+        return STATUS_SUCCESS
+
+    def __get_holders(self, storage_nodes, replication_factor):
+        # The storage nodes with blocks of the dataset, their replicas and this node, which has the meta data
+        num_storage_nodes = len(self.__storage_uris)
+        holders = [self.__config.node]
+        for uri in unique_and_preserve(storage_nodes):
+            if uri in self.__storage_uris:
+                index = self.__storage_uris.index(uri)
+                holders += [self.__storage_uris[(index + i) % num_storage_nodes] for i in xrange(replication_factor)]
+        return unique_and_preserve(holders)
+
+    @with_forward_count
+    def pin(self, identifier, is_pinned):
+        # Keeps the local blocks of the dataset in memory, or demotes them if is_pinned is False
+        if not is_pinned:
+            self.__pin_blocks(identifier, False)
+            return STATUS_SUCCESS
+
+        meta_data = self.__get_remote_meta(identifier)
+        if is_error(meta_data):
+            return meta_data
+
+        self.__pin_blocks(identifier, True)
+        # Promoted up front, instead of by the first job, as jobs read them i.e. only deserialized if serialized
+        class_context = _get_class_context(meta_data)
+        with self.__compaction_lock:
+            self.__pinning[str(identifier)] += 1
+        try:
+            self.__get_blocks(identifier, class_context if class_context.is_serialized() else None)
+        finally:
+            with self.__compaction_lock:
+                self.__pinning[str(identifier)] -= 1
+                if not self.__pinning[str(identifier)]:
+                    del self.__pinning[str(identifier)]
+        return STATUS_SUCCESS
+
+    def __pin_blocks(self, identifier, is_pinned):
+        info("%s blocks of %s on %s" % ("Pinning" if is_pinned else "Unpinning", identifier, str(self)))
+        if is_pinned:
+            self.__dbcs.pin(str(identifier))
+        else:
+            self.__dbcs.unpin(str(identifier))
+
+    # Internal Storage Api
+    def purge(self, identifier):
+        # Removes the blocks, meta data and cached results of a deleted dataset from this node
+        str_identifier = str(identifier)
+        # The writes of the dataset this node still forwards to the next replica are finished first
+        self.wait_for_forwards(str_identifier)
+        digests = set()
+        with self.__compaction_lock:
+            if self.__is_in_use(str_identifier):
+                return STATUS_PROCESSING
+
+            for replica_index, replica_blocks in self.__DISK.items():
+                replica_blocks.drop(str_identifier)
+                if str_identifier not in self.__FLAG:
+                    meta_data = self.__find_meta_store(replica_index).get(str_identifier)
+                    if meta_data is not None:
+                        digests.add(loads(meta_data).get('digest'))
+                    self.__META[replica_index].delete(str_identifier)
+                    self.__mcs.delete((replica_index, str_identifier))
+                self.__compacted.pop((replica_index, str_identifier), None)
+
+        if self.__srcs.contains(identifier):
+            for fidentifier in self.__srcs.get(identifier).keys():
+                self.__dgcs.delete(fidentifier)
+            self.__srcs.delete(identifier)
+
+        self.__dbcs.invalidate(str_identifier)
+        self.__dbcs.unpin(str_identifier)
+        self.__invalidate_partials(str_identifier)
+        self.__invalidate_map_outputs(str_identifier)
+
+        for digest in digests:
+            # Compiled again if the source is used by another dataset
+            _forget_plans(digest)
         return STATUS_SUCCESS
 
     @with_responsible_dispatch
@@ -405,6 +850,7 @@ class StorageHandler(DelegationHandler):
         if is_error(res):
             return res, "Dataset doesn't exists"
 
+        # Parsed again instead of using the cache, since the meta data is modified
         meta_data = loads(res)
         if update_type == 'append':
             if key in meta_data:
@@ -418,8 +864,11 @@ class StorageHandler(DelegationHandler):
 
         info("%s is %s with %s" % (key, update_type, str(value)))
 
-        replica_blocks = self.__find_replica(replica_index)
-        replica_blocks[str(identifier)][0] = dumps(meta_data)
+        if key == 'num-blocks':
+            # The root may not have received any of the appended blocks
+            self.__invalidate_results(identifier)
+
+        self.__put_meta(identifier, replica_index, meta_data)
         return STATUS_SUCCESS
 
     # Doesn't make sense to forward, since its contacting all other servers for data anyway
@@ -431,7 +880,7 @@ class StorageHandler(DelegationHandler):
             datasets = []
             for key in self.__FLAG.iterkeys():
                 # Only getting the datasets that this node is responsible for "self.__FLAGS"
-                meta_data = loads(self.__get_meta_from_identifier_and_replica(int(key), PRIMARY_REPLICA))
+                meta_data = self.__get_parsed_meta(key, PRIMARY_REPLICA)
                 operations = [{'name': operation, 'num_arguments': num_arguments}
                               for operation, num_arguments in meta_data['operations']]
                 datasets.append({'name': meta_data['name'],
@@ -442,8 +891,8 @@ class StorageHandler(DelegationHandler):
         if not is_internal_call and all_others > 1:
             # Broadcast storm to all nodes
             info("Pool get_datasets")
-            others_datasets = ThreadPool(all_others).map(_wrapper_get_datasets, self.__storage_nodes)
-            return sum(__self_datasets() + others_datasets, [])
+            others_datasets = self.__rpc_executor.map(_wrapper_get_datasets, self.__storage_nodes)
+            return sum([__self_datasets()] + others_datasets, [])
         else:
             # Calculate self
             return __self_datasets()
@@ -479,28 +928,168 @@ class StorageHandler(DelegationHandler):
         if not is_internal_call and all_others > 1:
             # Broadcast storm to all nodes
             info("Pool get_submitted_jobs")
-            other_jobs = ThreadPool(all_others).map(_wrapper_get_submitted_jobs, self.__storage_nodes)
-            return sum(__self_jobs() + other_jobs, [])
+            other_jobs = self.__rpc_executor.map(_wrapper_get_submitted_jobs, self.__storage_nodes)
+            return sum([__self_jobs()] + other_jobs, [])
         else:
             # Calculate self
             return __self_jobs()
 
-    def __get_deserialized_raw_blocks(self, class_context, didentifier, replica_index):
-        blocks = self.__get_raw_blocks(didentifier, replica_index)
-        return [class_context.deserialize(block) for block in blocks]
+    def __get_deserialized_raw_blocks(self, class_context, didentifier, indices=None):
+        return self.__get_blocks(didentifier, class_context, indices)
 
-    def __get_raw_blocks(self, didentifier, replica_index):
-        # We only store meta data on primary replica = 0
-        is_root = str(didentifier) in self.__FLAG and replica_index == 0
+    def __get_raw_blocks(self, didentifier, indices=None):
+        return self.__get_blocks(didentifier, indices=indices)
 
+    def __get_blocks(self, didentifier, class_context=None, indices=None):
+        # Blocks on self, decoded blocks are kept in the block cache between jobs
+        identifier = str(didentifier)
         replica_blocks = self.__find_replica(PRIMARY_REPLICA)
-        return replica_blocks[str(didentifier)][1 if is_root else 0:]  # Blocks on self
 
-    def __get_num_raw_blocks(self, didentifier, replica_index):
-        return len(self.__get_raw_blocks(didentifier, replica_index))
+        if indices is None:
+            indices = range(replica_blocks.num_blocks(identifier))
+
+        blocks = [self.__dbcs.get((identifier, PRIMARY_REPLICA, index)) for index in indices]
+
+        misses = [position for position, block in enumerate(blocks) if block is None]
+        missing_indices = [indices[position] for position in misses]
+        for position, index, block in zip(misses, missing_indices,
+                                          replica_blocks.get_blocks(identifier, missing_indices)):
+            if replica_blocks.is_native(identifier, index):
+                if not self.__dbcs.is_pinned(identifier):
+                    # Memory-mapped arrays costs nothing to open again
+                    blocks[position] = block
+                    continue
+
+                # Copied to memory, such that pinned datasets never touch the disk
+                block = [array.copy() for array in block] if isinstance(block, list) else block.copy()
+
+            if class_context and isinstance(block, str):
+                block = class_context.deserialize(block)
+
+            self.__dbcs.put((identifier, PRIMARY_REPLICA, index), block)
+            blocks[position] = block
+
+        return blocks
+
+    def __find_matching_blocks(self, didentifier, operation_context, query, block_range=None):
+        # Indices of the blocks in block_range (all if None), which may match the block filter by their zone map,
+        # or None for all blocks
+        indices = range(*block_range) if block_range else None
+
+        block_filter = operation_context.get_block_filter()
+        if block_filter is None or not _is_block_independent(operation_context):
+            # Ghosts and keywords exchanging ghosts are based on all blocks
+            return indices
+
+        summaries = self.__find_replica(PRIMARY_REPLICA).get_summaries(str(didentifier))
+        if indices is None:
+            indices = range(len(summaries))
+
+        # Blocks without zone map or with unknown bounds, e.g. only NaN, may match
+        matching = [index for index in indices if summaries[index] is None or not has_bounds(summaries[index]) or
+                    (block_filter(summaries[index], *query) if query else block_filter(summaries[index]))]
+
+        info("Block filter skips %d of %d blocks on %s" % (len(indices) - len(matching), len(indices), str(self)))
+        return matching
+
+    def __skips_all_blocks(self, didentifier, operation_context, process_state, block_range):
+        # Whether the block filter skips every block in block_range, i.e. this node has no partial result
+        if operation_context.get_block_filter() is None or not _is_block_independent(operation_context):
+            return False
+
+        return not self.__find_matching_blocks(didentifier, operation_context, _get_query(process_state),
+                                               block_range)
+
+    def __is_block_wise(self, fidentifier, operation_context, process_state):
+        # Whether the blocks are computed independently from the start, by functions not depending on the
+        # number of blocks
+        return _is_block_independent(operation_context) and not operation_context.requires_meta_data() \
+            and process_state['function-count'] == 0 and process_state['block-state'] != 'partial' \
+            and not self.__dgcs.contains(fidentifier)
+
+    def __is_incremental(self, fidentifier, operation_context, process_state):
+        # The partial result of the blocks on this node can be merged with the results of new blocks
+        return operation_context.is_incremental() and \
+            self.__is_block_wise(fidentifier, operation_context, process_state)
+
+    def __is_memoized(self, fidentifier, operation_context, process_state, functions):
+        first_function = functions[0]
+        return operation_context.is_memoized() and (isfunction(first_function) or isbuiltin(first_function)) \
+            and self.__is_block_wise(fidentifier, operation_context, process_state)
+
+    def __execute_memoized_map(self, didentifier, function, operation_context, class_context, process_state,
+                               meta_data, block_range):
+        # Computes the function on the blocks, where the output of every block is cached by the version of the
+        # block, the function and the query. Returns the arguments for the next function.
+        identifier = str(didentifier)
+        query = _get_query(process_state)
+        if process_state['block-state'] != 'serialized':
+            class_context = None
+
+        indices = self.__find_matching_blocks(didentifier, operation_context, query, block_range)
+        if indices is None:
+            indices = range(self.__get_num_raw_blocks(didentifier))
+
+        versions = self.__find_replica(PRIMARY_REPLICA).get_block_versions(identifier)
+        keys = [(identifier, versions[index], _get_function_name(function), repr(query)) for index in indices]
+
+        outputs = []
+        for key in keys:
+            try:
+                outputs.append(self.__mmcs.get(key))
+            except KeyError:
+                outputs.append(None)
+
+        misses = [position for position, output in enumerate(outputs) if output is None]
+        info("Map cache hits %d of %d blocks on %s" % (len(keys) - len(misses), len(keys), str(self)))
+
+        if misses:
+            res = _materialize(self.execute_map(operation_context, function,
+                                                self.__get_blocks(didentifier, class_context,
+                                                                  [indices[position] for position in misses]),
+                                                query, meta_data))
+
+            if not isinstance(res, list) or len(res) != len(misses):
+                # Not an output per block, hence can't be cached
+                if len(misses) == len(keys):
+                    return [res, None]
+                res = _call_function(function, self.__get_blocks(didentifier, class_context, indices), query)
+                return [res, None]
+
+            for position, output in zip(misses, res):
+                # Wrapped, since None outputs would otherwise be misses
+                outputs[position] = (output,)
+                self.__mmcs.put(keys[position], (output,))
+
+        return [[output[0] for output in outputs], None]
+
+    def __invalidate_map_outputs(self, identifier, version=None):
+        # Removes cached map outputs of every block in the dataset or only the block with version
+        identifier = str(identifier)
+        for key in self.__mmcs.keys():
+            if key[0] == identifier and (version is None or key[1] == version):
+                self.__mmcs.delete(key)
+
+    def __invalidate_partials(self, identifier, from_index=0):
+        # Removes partial results covering the block from_index or any later block
+        identifier = str(identifier)
+        for key in self.__ipcs.keys():
+            if key[0] == identifier and self.__ipcs.contains(key) and self.__ipcs.get(key)[COVERED] > from_index:
+                self.__ipcs.delete(key)
+
+    def __invalidate_results(self, didentifier):
+        # Results of finished jobs are outdated, running jobs are left to finish
+        if self.__srcs.contains(didentifier):
+            results = self.__srcs.get(didentifier)
+            for fidentifier in [fidentifier for fidentifier, data in results.items() if _is_finished_job(data)]:
+                del results[fidentifier]
+
+    def __get_num_raw_blocks(self, didentifier):
+        return self.__find_replica(PRIMARY_REPLICA).num_blocks(str(didentifier))
 
-    def __get_operations_and_arguments(self, didentifier, fidentifier, class_context, process_state):
-        replica_index = process_state['replica-index']
+    def __get_operations_and_arguments(self, didentifier, fidentifier, operation_context, class_context,
+                                       process_state, block_range=None):
+        query = _get_query(process_state)
 
         # Merge ghosts into blocks
         def _get_blocks_with_ghost():
@@ -509,9 +1098,9 @@ class StorageHandler(DelegationHandler):
 
             # Get blocks to work on
             if process_state['block-state'] == 'raw':
-                _blocks = self.__get_raw_blocks(didentifier, replica_index)
+                _blocks = self.__get_raw_blocks(didentifier)
             elif process_state['block-state'] == 'serialized':
-                _blocks = self.__get_deserialized_raw_blocks(class_context, didentifier, replica_index)
+                _blocks = self.__get_deserialized_raw_blocks(class_context, didentifier)
             elif process_state['block-state'] == 'partial':
                 # The result block is used for partial results in the case of built in functions with synchronization
                 _blocks = self.get_partial_value(didentifier, fidentifier)
@@ -534,14 +1123,14 @@ class StorageHandler(DelegationHandler):
         if self.__dgcs.contains(fidentifier):
             blocks = _get_blocks_with_ghost()
         else:
+            indices = self.__find_matching_blocks(didentifier, operation_context, query, block_range)
             if process_state['block-state'] == 'serialized':
-                blocks = self.__get_deserialized_raw_blocks(class_context, didentifier, replica_index)
+                blocks = self.__get_deserialized_raw_blocks(class_context, didentifier, indices)
             else:
-                blocks = self.__get_raw_blocks(didentifier, process_state['replica-index'])
+                blocks = self.__get_raw_blocks(didentifier, indices)
 
         args[BLOCKS] = blocks
-        query = process_state['query']
-        args[QUERY] = [query] if query and not isinstance(query, list) else query
+        args[QUERY] = query
         return args
 
     @with_responsible_dispatch
@@ -550,6 +1139,11 @@ class StorageHandler(DelegationHandler):
     def submit_job(self, function_delegation, didentifier, process_state, gateway):
         fidentifier = process_state['fidentifier']
 
+        if (str(didentifier), fidentifier) in self.__jobs:
+            # Similar job is in progress, which sets the result at the gateway when finished
+            info("Job %s is already executing at %s" % (fidentifier, str(self)))
+            return
+
         has_result = self.__srcs.contains(didentifier) \
                      and fidentifier in self.__srcs.get(didentifier) \
                      and self.__srcs.get(didentifier)[fidentifier][RESULT]
@@ -575,12 +1169,11 @@ class StorageHandler(DelegationHandler):
                 return
 
         # Getting meta data for common arguments
-        res = self.__get_meta_from_identifier_and_replica(didentifier, function_delegation['replica-index'])
-        if is_error(res):
+        meta_data = self.__get_parsed_meta(didentifier, function_delegation['replica-index'])
+        if is_error(meta_data):
             # Dataset doesn't exists
             self.__terminate_job(didentifier, fidentifier, STATUS_NOT_FOUND)
             return
-        meta_data = loads(res)
 
         # Update is working state before anything else
         involving_storage_nodes = _get_storage_nodes_for_dataset(meta_data)
@@ -590,6 +1183,9 @@ class StorageHandler(DelegationHandler):
         self.__srcs.get(didentifier)[fidentifier] = [None, num_nodes, True, gateway, process_state]
 
         root = self.__config.node
+        # Registered before the job is initialized, such that a similar job isn't started meanwhile
+        self.__add_job(didentifier, fidentifier, process_state, root)
+
         common = (didentifier, process_state, root, meta_data)
         if num_nodes > 1:
             # Broadcast storm to all nodes
@@ -597,19 +1193,51 @@ class StorageHandler(DelegationHandler):
             uris = [api_access for api_access in self.__storage_nodes
                     if api_access.get_uri() in involving_storage_nodes]
             args = [(node, common) for node in uris] + [(self, common)]
-            ThreadPool(num_nodes).map_async(_wrapper_initialize_job, args)
+            self.__rpc_executor.map_async(_wrapper_initialize_job, args)
         else:
             # Calculate self
             self.initialize_job(*common)
 
-    def __terminate_job(self, didentifier, fidentifier, status):
+    def __add_job(self, didentifier, fidentifier, process_state, root):
+        key = (str(didentifier), fidentifier)
+        with self.__compaction_lock:
+            if key not in self.__jobs:
+                # Copied, since the process state is sent to the other nodes at the same time
+                barrier = TreeBarrier(self.__config.node, process_state['involving-storage-nodes'], root)
+                self.__jobs[key] = _Job(barrier, dict(process_state))
+
+            return self.__jobs[key]
+
+    def __get_job_contexts(self, job, meta_data):
+        # The operation of the plan is shared by every job, hence copied, since keywords such as neighborhood set
+        # the ghosts of the job on it
+        with job.lock:
+            if job.contexts is None:
+                res = _get_contexts(job.process_state['function-name'], meta_data)
+                if is_error(res):
+                    return res
+
+                operation_context, class_context = res
+                job.contexts = copy(operation_context), class_context
+
+            return job.contexts
+
+    def __terminate_job(self, didentifier, fidentifier, status, message=None):
+        with self.__compaction_lock:
+            self.__jobs.pop((str(didentifier), fidentifier), None)
+
+        if not self.__srcs.contains(didentifier) or fidentifier not in self.__srcs.get(didentifier):
+            # Only the root of the job reports to the gateway
+            return
+
         data = self.__srcs.get(didentifier)[fidentifier]
 
         if is_error(status):
             # Remove existing result if an error occurs
             del self.__srcs.get(didentifier)[fidentifier]
 
-        _InternalGatewayApi(data[GATEWAY]).set_status_result(didentifier, fidentifier, status, data[RESULT])
+        result = message if is_error(status) and message is not None else data[RESULT]
+        _InternalGatewayApi(data[GATEWAY]).set_status_result(didentifier, fidentifier, status, result)
 
     # Internal Api
     def initialize_job(self, didentifier, process_state, root, meta_data):
@@ -618,13 +1246,18 @@ class StorageHandler(DelegationHandler):
 
         info("Initialize execution at " + str(self.__config.node) + " for function " + function_name)
 
+        job = self.__add_job(didentifier, fidentifier, process_state, root)
+        process_state = job.process_state
         storage_nodes_involving = process_state['involving-storage-nodes']
-        self.__tb = TreeBarrier(self.__config.node, storage_nodes_involving, root)
+
+        if meta_data.get('pinned', False) != self.__dbcs.is_pinned(str(didentifier)):
+            # Pinned while this node was down, the blocks are promoted when read
+            self.__pin_blocks(didentifier, meta_data.get('pinned', False))
 
         # If im the only node in the system
         is_local_transfer = len(storage_nodes_involving) == 1
 
-        res = _get_contexts(function_name, meta_data)
+        res = self.__get_job_contexts(job, meta_data)
         if is_error(res):
             self.__terminate_job(didentifier, fidentifier, STATUS_NO_DATA)
             return
@@ -670,110 +1303,205 @@ class StorageHandler(DelegationHandler):
             return
 
         # Find ghosts from local neighbors if needed else execute
-        replica_blocks = self.__get_deserialized_raw_blocks(class_context, didentifier, process_state['replica-index'])
+        replica_blocks = self.__get_deserialized_raw_blocks(class_context, didentifier)
 
         self.handle_ghosts(didentifier, operation_context, done_callback_handler,
                            self_data=replica_blocks,
                            is_local_transfer=is_local_transfer)
 
     def execute_function(self, didentifier, fidentifier, meta_data, process_state):
-        function_name = process_state['function-name']
-        info("Execute function " + function_name + " at " + str(self))
-
-        res = _get_contexts(function_name, meta_data)
-        if is_error(res):
-            self.__terminate_job(didentifier, fidentifier, STATUS_NOT_FOUND)
+        job = self.__jobs.get((str(didentifier), fidentifier))
+        if job is None:
+            info("Job " + str(fidentifier) + " isn't executing at " + str(self))
             return
-        operation_context, class_context = res
 
-        # Calculate results of functions, which isn't already processed, i.e. function-count
-        functions = operation_context.get_functions()[process_state['function-count']:]
-        last_function = functions[-1]
+        with job.lock:
+            function_count = job.process_state['function-count']
+            if job.has_result or job.executed_from is not None and job.executed_from >= function_count:
+                # Executed once, even if several nodes report ready, but continued after keywords
+                return
+            job.executed_from = function_count
 
-        if process_state['processing']:
-            blocks = self.__get_operations_and_arguments(didentifier, fidentifier, class_context, process_state)
-            if is_error(blocks):
+        # The process state of this node, rather than of the node which reported ready last
+        process_state = job.process_state
+        function_name = process_state['function-name']
+        info("Execute function " + function_name + " at " + str(self))
+
+        try:
+            res = self.__get_job_contexts(job, meta_data)
+            if is_error(res):
                 self.__terminate_job(didentifier, fidentifier, STATUS_NOT_FOUND)
                 return
+            operation_context, class_context = res
 
-            operation_context_args = (operation_context, didentifier, fidentifier, process_state, meta_data)
-            try:
-                res = _local_execute(self, functions, blocks, operation_context_args)
-                process_state['processing'] = False
-                info("Result for " + str(self) + " is: " + str(res))
+            # Calculate results of functions, which isn't already processed, i.e. function-count
+            functions = operation_context.get_functions()[process_state['function-count']:]
 
-                is_root = str(didentifier) in self.__FLAG
-                if is_root:
-                    self.__srcs.get(didentifier)[fidentifier][RESULT] = res
-                else:
-                    self.__srcs.get(didentifier)[fidentifier] = [res]
-            except WillContinueExecuting:
-                # Only happens if its a built in function from KEYWORDS executing,
-                # will return to this function later in the execution phase.
-                return
+            is_incremental = self.__is_incremental(fidentifier, operation_context, process_state)
+            partial = self.__ipcs.get((str(didentifier), fidentifier)) \
+                if is_incremental and self.__ipcs.contains((str(didentifier), fidentifier)) else None
 
-        itr = int(process_state['iteration-count'])
-        is_first_iteration = itr == 0
+            # Only blocks not covered by the partial result of this node are computed
+            block_range = (partial[COVERED] if partial else 0, self.__get_num_raw_blocks(didentifier))
 
-        def execute_last():
-            _partial_res = process_state['partial-value']
-            if class_context.is_serialized():
-                _partial_res = class_context.deserialize(_partial_res)
+            operation_context_args = (operation_context, didentifier, fidentifier, process_state, meta_data)
+            if partial and block_range[0] == block_range[1]:
+                info("No new blocks for incremental result on " + str(self))
+                res = partial[PARTIAL]
+            elif self.__skips_all_blocks(didentifier, operation_context, process_state, block_range):
+                # The functions aren't called without blocks, since e.g. max of nothing fails
+                res = partial[PARTIAL] if partial else _SkippedPartial()
+            else:
+                if self.__is_memoized(fidentifier, operation_context, process_state, functions):
+                    # The first function is computed by the map cache, which only reads the missing blocks
+                    blocks = self.__execute_memoized_map(didentifier, functions.pop(0), operation_context,
+                                                         class_context, process_state, meta_data, block_range)
+                else:
+                    blocks = self.__get_operations_and_arguments(didentifier, fidentifier, operation_context,
+                                                                 class_context, process_state, block_range)
+                if is_error(blocks):
+                    self.__terminate_job(didentifier, fidentifier, STATUS_NOT_FOUND)
+                    return
 
-            _data = self.__srcs.get(didentifier)[fidentifier]
-            _blocks = [_data[RESULT], _partial_res]
+                res = _local_execute(self, functions, blocks, operation_context_args)
+                if partial:
+                    info("Merging blocks %d to %d into incremental result on %s" % (
+                        block_range[0], block_range[1], str(self)))
+                    res = self.__merge(operation_context, job, meta_data, [partial[PARTIAL], res])
+
+            if is_incremental:
+                self.__ipcs.put((str(didentifier), fidentifier), (block_range[1], res))
+
+            process_state['processing'] = False
+            # The ghosts have been merged into the blocks and aren't needed anymore
+            self.__dgcs.delete(fidentifier)
+            info("Result for " + str(self) + " is: " + str(res))
+        except WillContinueExecuting:
+            # Only happens if its a built in function from KEYWORDS executing,
+            # will return to this function later in the execution phase.
+            return
+        except Exception as e:
+            # Reduced anyway, such that every node of the job terminates and the root reports the failure
+            exception("Executing %s failed on %s" % (function_name, str(self)))
+            res = _FailedPartial("%s failed on %s: %s" % (function_name, str(self), e))
 
-            args = None
-            if operation_context.requires_meta_data():
-                args = [{
-                    'num-blocks': meta_data['num-blocks'],
-                    'num-storage-nodes': len(process_state['involving-storage-nodes']),
-                    'idx': process_state['involving-storage-nodes'].index(str(self))
-                }]
+        with job.lock:
+            job.result = res
+            job.has_result = True
 
-            if args:
-                return last_function(_blocks, args)
-            else:
-                return last_function(_blocks)
+        self.__reduce(didentifier, fidentifier, job, meta_data)
 
-        try:
-            # Calling it here to invoke the StopIteration exceptions, such that execute_last isn't called twice
-            should_send = self.__tb.should_send(itr)
+    def receive_partial(self, didentifier, fidentifier, meta_data, iteration, partial):
+        job = self.__jobs.get((str(didentifier), fidentifier))
+        if job is None:
+            info("Job " + str(fidentifier) + " isn't executing at " + str(self))
+            return
 
-            if not is_first_iteration:
-                self.__srcs.get(didentifier)[fidentifier][RESULT] = execute_last()
+        with job.lock:
+            job.received[iteration] = partial
 
-            if should_send:
-                res = self.__srcs.get(didentifier)[fidentifier][RESULT]
-                receiver = self.__storage_nodes[self.__tb.get_receiver_idx()]
-                info("Sending from " + str(self) + " to the next")
+        self.__reduce(didentifier, fidentifier, job, meta_data)
 
-                process_state['iteration-count'] += 1
-                if class_context.is_serialized():
-                    res = class_context.serialize(res)
-                process_state['partial-value'] = res
-                receiver.execute_function(didentifier, fidentifier, meta_data, process_state)
+    def __reduce(self, didentifier, fidentifier, job, meta_data):
+        is_failed = True
+        try:
+            self.__reduce_partials(didentifier, fidentifier, job, meta_data)
+            is_failed = False
+        finally:
+            if is_failed:
+                # Never left in the jobs of the node, which would block similar jobs, compaction and purging
+                exception("Reducing %s failed on %s" % (job.process_state['function-name'], str(self)))
+                with job.lock:
+                    job.is_reduced = True
+                self.__terminate_job(didentifier, fidentifier, STATUS_INVALID_DATA,
+                                     "%s failed on %s" % (job.process_state['function-name'], str(self)))
+
+    def __reduce_partials(self, didentifier, fidentifier, job, meta_data):
+        # Merges the partial results of other nodes into the result of this node by the tree barrier, until
+        # it's sent on, or this node is the root and has the results of all nodes
+        operation_context, class_context = self.__get_job_contexts(job, meta_data)
+        is_root = False
+
+        with job.lock:
+            if not job.has_result or job.is_reduced:
                 return
 
-        except StopIteration:
-            data = self.__srcs.get(didentifier)[fidentifier]
+            try:
+                while not job.barrier.should_send(job.iteration):
+                    if job.barrier.should_receive(job.iteration):
+                        if job.iteration not in job.received:
+                            # Continued when the partial result is received
+                            return
+
+                        partial = job.received.pop(job.iteration)
+                        try:
+                            if class_context.is_serialized() and not _is_marker(partial):
+                                partial = class_context.deserialize(partial)
+                            job.result = self.__merge(operation_context, job, meta_data, [job.result, partial])
+                        except Exception as e:
+                            # Passed on, such that the root reports the failure
+                            exception("Merging partial results failed on %s" % str(self))
+                            job.result = _FailedPartial("Merging failed on %s: %s" % (str(self), e))
+
+                    job.iteration += 1
+            except StopIteration:
+                is_root = True
+            job.is_reduced = True
+
+        res = job.result
+        if not is_root:
+            info("Sending from " + str(self) + " to the next")
+            if class_context.is_serialized() and not _is_marker(res):
+                try:
+                    res = class_context.serialize(res)
+                except Exception as e:
+                    exception("Serializing partial result failed on %s" % str(self))
+                    res = _FailedPartial("Serializing failed on %s: %s" % (str(self), e))
 
-            if is_first_iteration:
-                # No data received
-                res = data[RESULT]
-            else:
-                res = execute_last()
+            receiver = self.get_responsible(self.__storage_uris.index(job.barrier.get_receiver()))
+            self.__terminate_job(didentifier, fidentifier, STATUS_SUCCESS)
+            receiver.receive_partial(didentifier, fidentifier, meta_data, job.iteration, res)
+            return
 
-            if operation_context.has_post_processing_step():
-                res = operation_context.execute_post_process(res)
-            else:
-                # Formatting it to expected return representation
-                res = operation_context.get_data_return_representation(res)
+        if isinstance(res, _FailedPartial):
+            self.__terminate_job(didentifier, fidentifier, STATUS_INVALID_DATA, res.message)
+            return
 
-            info("Finishing with result: " + str(res))
-            self.__srcs.get(didentifier)[fidentifier] = [res, None, False, data[GATEWAY], process_state]
-            self.__terminate_job(didentifier, fidentifier, STATUS_SUCCESS)
+        if isinstance(res, _SkippedPartial):
+            info("Block filter skips every block")
+            res = _reduce_nothing(operation_context)
+
+        if res is None:
             pass
+        elif operation_context.has_post_processing_step():
+            res = operation_context.execute_post_process(res)
+        else:
+            # Formatting it to expected return representation
+            res = operation_context.get_data_return_representation(res)
+
+        info("Finishing with result: " + str(res))
+        data = self.__srcs.get(didentifier)[fidentifier]
+        self.__srcs.get(didentifier)[fidentifier] = [res, None, False, data[GATEWAY], job.process_state]
+        self.__terminate_job(didentifier, fidentifier, STATUS_SUCCESS)
+
+    def __merge(self, operation_context, job, meta_data, blocks):
+        failed = [block for block in blocks if isinstance(block, _FailedPartial)]
+        if failed:
+            return failed[0]
+
+        blocks = _without_skipped(blocks)
+        if len(blocks) < 2:
+            return blocks[0] if blocks else _SkippedPartial()
+
+        last_function = operation_context.get_functions()[-1]
+        if operation_context.requires_meta_data():
+            return last_function(blocks, [{
+                'num-blocks': meta_data['num-blocks'],
+                'num-storage-nodes': len(job.process_state['involving-storage-nodes']),
+                'idx': job.process_state['involving-storage-nodes'].index(str(self))
+            }])
+
+        return last_function(blocks)
 
     def __report_ready(self, didentifier, fidentifier, meta_data, process_state):
         responsible_idx = find_responsible(didentifier, self.get_key_space())
@@ -791,20 +1519,28 @@ class StorageHandler(DelegationHandler):
         self.__local_ready(didentifier, fidentifier, meta_data, process_state)
 
     def __local_ready(self, didentifier, fidentifier, meta_data, process_state):
-        self.__srcs.get(didentifier)[fidentifier][REQUEST_COUNT] -= 1
-        info(str(self) + " request count: " + str(self.__srcs.get(didentifier)[fidentifier][REQUEST_COUNT]))
+        involving_storage_nodes = process_state['involving-storage-nodes']
+        num_nodes = len(process_state['involving-storage-nodes'])
+
+        data = self.__srcs.get(didentifier)[fidentifier]
+        with self.__compaction_lock:
+            data[REQUEST_COUNT] -= 1
+            is_ready = data[REQUEST_COUNT] < 1
+            if is_ready:
+                # Every node reports ready again, when continuing after synchronizing e.g. by neighborhood
+                data[REQUEST_COUNT] = num_nodes
+
+        info(str(self) + " request count: " + str(data[REQUEST_COUNT]))
 
-        if self.__srcs.get(didentifier)[fidentifier][REQUEST_COUNT] < 1:
+        if is_ready:
             common = (didentifier, fidentifier, meta_data, process_state)
-            involving_storage_nodes = process_state['involving-storage-nodes']
-            num_nodes = len(process_state['involving-storage-nodes'])
 
             if num_nodes > 1:
                 info("Pool _wrapper_execute_function")
                 uris = [api_access for api_access in self.__storage_nodes
                         if api_access.get_uri() in involving_storage_nodes]
                 args = [(node, common) for node in uris] + [(self, common)]
-                ThreadPool(num_nodes).map_async(_wrapper_execute_function, args)
+                self.__rpc_executor.map_async(_wrapper_execute_function, args)
             else:
                 self.execute_function(*common)
 
@@ -817,7 +1553,7 @@ class StorageHandler(DelegationHandler):
         if left_ghost is not None:
             is_ghost_right = False
             is_root = str(didentifier) in self.__FLAG
-            num_blocks = self.__get_num_raw_blocks(didentifier, process_state['replica-index'])
+            num_blocks = self.__get_num_raw_blocks(didentifier)
 
             if is_root or len(left_ghost) < num_blocks:
                 # Received too much and shifted data
@@ -842,11 +1578,191 @@ class StorageHandler(DelegationHandler):
         self.handle_received_ghosts(left_ghost, right_ghost, needs_both, didentifier,
                                     fidentifier, meta_data, process_state)
 
+    @with_forward_count
+    def get_cache_statistics(self, is_internal_call=False):
+        all_others = self.get_num_storage_nodes(True)
+
+        def __self_statistics():
+            return [{
+                'node': str(self),
+                'results': self.__srcs.get_statistics(),
+                'ghosts': self.__dgcs.get_statistics(),
+                'meta-data': self.__mcs.get_statistics(),
+                'blocks': self.__dbcs.get_statistics(),
+                'incremental': self.__ipcs.get_statistics(),
+                'map-outputs': self.__mmcs.get_statistics(),
+                'compaction': dict(self.__compaction_statistics),
+                'reclamation': dict(self.__reclamation_statistics),
+            }]
+
+        if not is_internal_call and all_others > 1:
+            # Broadcast storm to all nodes
+            info("Pool get_cache_statistics")
+            other_statistics = self.__rpc_executor.map(_wrapper_get_cache_statistics, self.__storage_nodes)
+            return sum([__self_statistics()] + other_statistics, [])
+        else:
+            # Calculate self
+            return __self_statistics()
+
+    def __scheduler_compaction(self):
+        for replica_index, replica_blocks in self.__DISK.items():
+            for identifier in replica_blocks.identifiers():
+                if self.get_current_job_count() > 0 or self.__jobs:
+                    # Only compacting while idle, to not slow down running jobs
+                    return
+
+                self.__compact(replica_index, replica_blocks, identifier)
+
+    def __scheduler_reclamation(self):
+        if self.get_current_job_count() > 0 or self.__jobs:
+            # Only reclaiming while idle, to not slow down running jobs
+            return
+
+        # Throttled to a single dataset and a segment of each replica every interval
+        if self.__TOMBSTONE:
+            self.__reclaim(self.__TOMBSTONE.keys()[0])
+
+        for replica_index, replica_blocks in self.__DISK.items():
+            with self.__rewrite_lock, self.__compaction_lock:
+                reclaimed = replica_blocks.collect_garbage()
+
+            if reclaimed:
+                self.__reclamation_statistics['collected-segments'] += 1
+                self.__reclamation_statistics['reclaimed-bytes'] += reclaimed
+
+    def __reclaim(self, identifier):
+        # Purges a deleted dataset on the nodes holding it and returns whether it is purged everywhere
+        pending = []
+        for uri in self.__TOMBSTONE[identifier]:
+            try:
+                if uri == self.__config.node:
+                    res = self.purge(long(identifier))
+                else:
+                    res = [node for node in self.__storage_nodes if node.get_uri() == uri][0].purge(long(identifier))
+            except CommunicationError:
+                res = STATUS_PROCESSING
+
+            if res != STATUS_SUCCESS:
+                # Still in use or unreachable, tried again next time
+                pending.append(uri)
+
+        if pending:
+            self.__TOMBSTONE[identifier] = pending
+        else:
+            del self.__TOMBSTONE[identifier]
+            self.__reclamation_statistics['purged-datasets'] += 1
+            info("Purged deleted dataset with identifier %s from all nodes" % identifier)
+
+        self.__TOMBSTONE.sync()
+        return not pending
+
+    def __is_in_use(self, identifier):
+        return identifier in self.__pinning or any(didentifier == identifier for didentifier, _ in self.__jobs.keys())
+
+    def __get_remote_meta(self, identifier):
+        # Meta data of a dataset with blocks on this node, which may be responsible for another node
+        # Single replica, since the replication factor can't be found for deleted datasets
+        fd = FunctionDelegation(long(identifier)) \
+            .as_forward_queue_delegation(None, self.__config.load_balancing_threshold, 1)
+        meta_data = self.get_meta_from_identifier(fd, long(identifier))
+        return meta_data if is_error(meta_data) else _str_loads(meta_data)
+
+    def __compact(self, replica_index, replica_blocks, identifier):
+        # Rewrites the blocks of identifier to blocks as split when appending, with the entries in the same order
+        block_size = self.__config.block_size * 1000000  # To bytes from MB
+        sizes = replica_blocks.get_block_sizes(identifier)
+        versions = replica_blocks.get_block_versions(identifier)
+        if self.__compacted.get((replica_index, identifier)) == versions:
+            return
+
+        meta_data = self.__get_remote_meta(identifier)
+        if is_error(meta_data):
+            return
+
+        class_context = _get_class_context(meta_data)
+        if not _is_compactable(class_context, _get_plan(meta_data).operations.values()):
+            self.__compacted[(replica_index, identifier)] = versions
+            return
+
+        def _stored_blocks(num_entries=None):
+            for index in xrange(len(versions)):
+                block = replica_blocks.get(identifier, index)
+                if class_context.is_serialized() and isinstance(block, str):
+                    block = class_context.deserialize(block)
+                if num_entries is not None:
+                    num_entries.append(len(block))
+                yield block
+
+        def _split(blocks):
+            # Same size of entries as by the gateway, such that blocks it has split are kept
+            if class_context.is_row_sliced():
+                return slice_into_blocks(blocks, block_size)
+            return split_into_blocks((entry for block in blocks for entry in block), block_size,
+                                     class_context.get_entry_size)
+
+        num_entries = []
+        planned = [len(block) for block in _split(_stored_blocks(num_entries))]
+        if planned == num_entries and all(chunks == 1 for chunks, _ in sizes):
+            # Already the blocks it would be rewritten to
+            self.__compacted[(replica_index, identifier)] = versions
+            return
+
+        def _blocks():
+            codec = meta_data.get('block-codec')
+            for block in _split(_stored_blocks()):
+                summary = class_context.get_block_summary(block)
+                if class_context.is_serialized() and not class_context.is_native_array():
+                    block = class_context.serialize(block)
+                if codec:
+                    block = encode_block(block, codec)
+                yield block, summary
+
+        with self.__rewrite_lock:
+            # Staged without the compaction lock, such that jobs and appends aren't waiting meanwhile
+            replica_blocks.stage(identifier, _blocks())
+
+            with self.__compaction_lock:
+                if self.__is_in_use(identifier) or replica_blocks.get_block_versions(identifier) != versions:
+                    replica_blocks.discard(identifier)
+                    return
+
+                replica_blocks.swap(identifier)
+
+                if replica_index == PRIMARY_REPLICA:
+                    self.__dbcs.invalidate(identifier)
+                    self.__invalidate_partials(identifier)
+                    self.__invalidate_map_outputs(identifier)
+
+        new_sizes = replica_blocks.get_block_sizes(identifier)
+        reclaimed = sum(size for _, size in sizes) - sum(size for _, size in new_sizes)
+        self.__compacted[(replica_index, identifier)] = replica_blocks.get_block_versions(identifier)
+        self.__compaction_statistics['compacted-datasets'] += 1
+        self.__compaction_statistics['reclaimed-bytes'] += reclaimed
+
+        info("Compacted %s at replica %d from %d to %d blocks on %s, reclaimed %d bytes" % (
+            identifier, replica_index, len(sizes), len(new_sizes), str(self), reclaimed))
+
     # Internal Monitor Api
     def heartbeat(self):
         pass
 
 
+def _is_compactable(class_context, operations):
+    # The number of blocks on this node changes by compaction, which tiles, ghosts exchanged with the blocks at the
+    # same index on the neighbors and the meta data of functions depend on
+    return not isinstance(class_context.get_distribution_strategy(), Tiles) and \
+        all(_is_block_independent(operation) and not operation.requires_meta_data() for operation in operations)
+
+
+def _is_finished_job(data):
+    return len(data) > ROOT_IS_WORKING and not data[ROOT_IS_WORKING]
+
+
+def _is_finished(results):
+    # Only results of jobs finished at the root are evicted, others are still needed by running jobs
+    return all(_is_finished_job(data) for data in results.values())
+
+
 def _wrapper_initialize_job(args):
     return args[0].initialize_job(*args[1])
 
@@ -859,6 +1775,10 @@ def _wrapper_get_datasets(arg):
     return arg.get_datasets(is_internal_call=True)
 
 
+def _wrapper_get_cache_statistics(arg):
+    return arg.get_cache_statistics(is_internal_call=True)
+
+
 def _wrapper_get_submitted_jobs(arg):
     return arg.get_submitted_jobs(is_internal_call=True)
 
@@ -867,6 +1787,33 @@ def _wrapper_local_execute(args):
     return _local_execute(*args)
 
 
+def _call_function(function, blocks, query):
+    # If function is buit-in call it by the wrapper import utils function
+    if isbuiltin(function) or function.__doc__ == 'wrapped':
+        return function(blocks, query)
+
+    # If its regular defined functions, unbox arguments properly
+    if query is None:
+        return function(blocks)
+
+    return function(blocks, *query)
+
+
+def _materialize(output):
+    # Map functions wrapped by the import utils are generators, which are consumed, such that the outputs can
+    # be kept or sent
+    return list(output) if isinstance(output, GeneratorType) else output
+
+
+def _get_function_name(function):
+    return getattr(function, '__name__', str(function))
+
+
+def _get_query(process_state):
+    query = process_state['query']
+    return [query] if query and not isinstance(query, list) else query
+
+
 def _local_execute(self, functions, args, operation_context_args):
     try:
         operation_context, didentifier, fidentifier, process_state, meta_data = operation_context_args
@@ -878,14 +1825,12 @@ def _local_execute(self, functions, args, operation_context_args):
 
         if isinstance(possible_function, ParallelOperation):
             suboperations = possible_function.functions
-            pool = ThreadPool(4)
-
             subargs = []
             for suboperation in suboperations:
                 subargs.append((self, list(suboperation if (isfunction(suboperation) or isbuiltin(suboperation))
                                            else suboperation.functions), args, operation_context_args))
 
-            res = pool.map(_wrapper_local_execute, subargs)
+            res = self.execute_parallel(_wrapper_local_execute, subargs)
             return _local_execute(self, functions, res, operation_context_args)
 
         # Find keyword function and call it
@@ -920,15 +1865,10 @@ def _local_execute(self, functions, args, operation_context_args):
                 'idx': process_state['involving-storage-nodes'].index(str(self))
             }] + query
 
-        # If function is buit-in call it by the wrapper import utils function
-        if isbuiltin(possible_function) or possible_function.__doc__ == 'wrapped':
-            res = possible_function(blocks, query)
+        if possible_function is _get_map_function(operation_context):
+            res = self.execute_map(operation_context, possible_function, blocks, query, meta_data)
         else:
-            # If its regular defined functions, unbox arguments properly
-            if query is None:
-                res = possible_function(blocks)
-            else:
-                res = possible_function(blocks, *query)
+            res = _call_function(possible_function, blocks, query)
 
         # Append None as next arguments, if none is returned from previous function
         if not isinstance(res, tuple):
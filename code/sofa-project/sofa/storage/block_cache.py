@@ -0,0 +1,116 @@
+from threading import RLock
+
+from sofa.cache import CacheSystem
+
+IDENTIFIER = 0
+
+BLOCK = 0
+SIZE = 1
+
+
+class BlockCache(object):
+    """
+    In-memory hot tier of decoded blocks keyed by (dataset identifier, replica index, block index), bounded by
+    max_size bytes measured with size_fun. Blocks of pinned datasets stay in memory until the dataset is unpinned,
+    the rest of the budget holds the least recently used blocks of any dataset, which are demoted to disk first.
+    """
+
+    def __init__(self, max_size, size_fun):
+        self.__max_size = max_size
+        self.__size_fun = size_fun
+        self.__lock = RLock()
+        # Blocks are never changed in place, hence no need to measure them again
+        self.__cache = CacheSystem(dict, max_size=max_size, size_fun=size_fun, track_mutations=False)
+        self.__pinned_identifiers = set()
+        self.__pinned = {}  # Key to (block, size) of the blocks of pinned datasets
+        self.__pinned_size = 0
+
+    def __resize(self):
+        # Pinned blocks are taken from the budget of the recently used blocks
+        self.__cache.resize(self.__max_size - self.__pinned_size)
+
+    def get(self, key):
+        with self.__lock:
+            if key in self.__pinned:
+                return self.__pinned[key][BLOCK]
+
+            try:
+                block = self.__cache.get(key)
+            except KeyError:
+                return None
+
+            if key[IDENTIFIER] in self.__pinned_identifiers:
+                # Promoted to the pinned blocks
+                self.put(key, block)
+            return block
+
+    def put(self, key, block):
+        size = self.__size_fun(block)
+        with self.__lock:
+            if key[IDENTIFIER] in self.__pinned_identifiers and self.__pinned_size + size <= self.__max_size:
+                self.__cache.delete(key)
+                self.__remove_pinned(key)
+                self.__pinned[key] = (block, size)
+                self.__pinned_size += size
+                self.__resize()
+                return
+
+            if size > self.__max_size - self.__pinned_size:
+                # Would evict everything else and still not fit
+                return
+
+            self.__cache.put(key, block, size)
+
+    def __remove_pinned(self, key):
+        if key in self.__pinned:
+            self.__pinned_size -= self.__pinned.pop(key)[SIZE]
+
+    def pin(self, identifier):
+        # Blocks of identifier put from now on are kept until unpinned, as long as they fit
+        with self.__lock:
+            self.__pinned_identifiers.add(identifier)
+
+    def unpin(self, identifier):
+        # Demotes the pinned blocks of identifier to the recently used blocks
+        with self.__lock:
+            self.__pinned_identifiers.discard(identifier)
+            blocks = [(key, self.__pinned[key][BLOCK]) for key in self.__pinned if key[IDENTIFIER] == identifier]
+            for key, _ in blocks:
+                self.__remove_pinned(key)
+
+            self.__resize()
+            for key, block in blocks:
+                self.put(key, block)
+
+    def is_pinned(self, identifier):
+        return identifier in self.__pinned_identifiers
+
+    def contains(self, key):
+        with self.__lock:
+            return key in self.__pinned or self.__cache.contains(key)
+
+    def invalidate(self, identifier, index=None):
+        # Removes a single block or all blocks of the dataset if index is None
+        with self.__lock:
+            for key in [key for key in self.__pinned if key[IDENTIFIER] == identifier]:
+                if index is None or key[-1] == index:
+                    self.__remove_pinned(key)
+            self.__resize()
+
+        for key in self.__cache.keys():
+            if key[IDENTIFIER] == identifier and (index is None or key[-1] == index):
+                self.__cache.delete(key)
+
+    def get_size(self):
+        return self.__cache.get_size() + self.__pinned_size
+
+    def get_statistics(self):
+        statistics = self.__cache.get_statistics()
+        with self.__lock:
+            statistics.update({
+                'max-bytes': self.__max_size,
+                'pinned-datasets': len(self.__pinned_identifiers),
+                'pinned-entries': len(self.__pinned),
+                'pinned-bytes': self.__pinned_size,
+            })
+        return statistics
@@ -0,0 +1,553 @@
+from collections import OrderedDict
+from cPickle import dumps, loads, HIGHEST_PROTOCOL
+from logging import info
+from multiprocessing.pool import ThreadPool
+from os import listdir, makedirs, fstat, remove
+from os.path import exists, join, getsize
+from re import compile
+from struct import Struct
+from threading import Lock, RLock
+
+from numpy import ndarray, concatenate
+
+from sofa.storage.codec import EncodedBlock, decode as decode_compressed
+from sofa.storage.ndarray_format import is_native_block, encode as encode_native, read_header, open_views
+from sofa.storage.zone_map import merge as merge_summaries
+
+DEFAULT_SEGMENT_SIZE = 256 * 1000000  # To bytes from MB
+DEFAULT_STRIPE_SIZE = 16 * 1000000  # To bytes from MB
+DEFAULT_MAX_READERS = 256
+DEFAULT_DEAD_RATIO = 0.5
+
+# Record types
+APPEND = 0
+EXTEND = 1  # Extends the last block, replaced by CHUNK which has the index of the block
+REPLACE = 2
+DROP = 3
+SUMMARY = 4
+SWAP = 5
+CHUNK = 6
+
+# Payload encodings
+RAW = 0
+PICKLED = 1
+NDARRAY = 2
+COMPRESSED = 3
+
+# Record type, payload encoding, block index, key length and payload length
+HEADER = Struct("<BBiHQ")
+
+SEGMENT_PATTERN = compile("segment_(\d+)\.log$")
+
+# Blocks of a rewrite are written under the identifier with this suffix, until swapped in
+STAGING_SUFFIX = ":staged"
+
+SEGMENT = 0
+OFFSET = 1
+ENCODING = 2
+LENGTH = 3
+
+
+def _encode(block):
+    if isinstance(block, EncodedBlock):
+        # Already compressed by the gateway and stored as it is
+        return COMPRESSED, block.payload
+    if isinstance(block, str):
+        return RAW, block
+    return PICKLED, dumps(block, HIGHEST_PROTOCOL)
+
+
+def _decode(encoding, payload):
+    if encoding == RAW:
+        return payload
+    if encoding == COMPRESSED:
+        return decode_compressed(payload)
+    return loads(payload)
+
+
+def _join_chunks(chunks):
+    # A block appended to with create_new_stride = False consists of several chunks
+    block = chunks[0]
+    for chunk in chunks[1:]:
+        if isinstance(block, list):
+            block.extend(chunk)
+        elif isinstance(block, ndarray):
+            block = concatenate((block, chunk))
+        else:
+            block += chunk
+    return block
+
+
+class BlockLog(object):
+    """
+    Append-only storage of blocks for one replica, split over segment files of at most segment_size bytes.
+    Every write is a record appended to the active segment and only the in-memory block index, which maps
+    an identifier to the locations of its blocks, is updated. The index is rebuilt from the segments on open.
+    The zone map of every block, if given, is kept in memory next to the index.
+
+    The segments are striped over the directories in path, if a list of directories on different disks, by
+    rolling over to a segment in the next directory after every stripe_size bytes, and blocks on different disks
+    are read in parallel. At most max_readers segments are kept open for reading.
+    """
+
+    def __init__(self, path, segment_size=DEFAULT_SEGMENT_SIZE, stripe_size=DEFAULT_STRIPE_SIZE,
+                 max_readers=DEFAULT_MAX_READERS):
+        self.__paths = path if isinstance(path, list) else [path]
+        self.__segment_size = min(segment_size, stripe_size) if len(self.__paths) > 1 else segment_size
+        self.__max_readers = max_readers
+        self.__lock = RLock()
+        self.__index = {}
+        self.__summaries = {}
+        self.__summary_segments = {}  # The segment of the SUMMARY record of every block
+        self.__record_segments = {}  # The segments with records of every key
+        self.__reset_segments = {}  # The segment of the last SWAP or DROP record of every key
+        self.__segment_paths = {}  # The directory of every segment
+        self.__readers = OrderedDict()  # Least recently used first
+        self.__writer = None
+        self.__segment = 0
+        # A reader for every disk
+        self.__pool = ThreadPool(len(self.__paths)) if len(self.__paths) > 1 else None
+
+        for directory in self.__paths:
+            if not exists(directory):
+                makedirs(directory)
+
+        self.__recover()
+
+    def __get_segment_filename(self, segment):
+        # New segments are placed round-robin, existing segments are kept where they are if directories are added
+        if segment not in self.__segment_paths:
+            self.__segment_paths[segment] = self.__paths[segment % len(self.__paths)]
+        return join(self.__segment_paths[segment], "segment_%d.log" % segment)
+
+    def __get_segments(self):
+        for directory in self.__paths:
+            for match in [SEGMENT_PATTERN.match(filename) for filename in listdir(directory)]:
+                if match:
+                    self.__segment_paths[int(match.group(1))] = directory
+        return sorted(self.__segment_paths)
+
+    def __recover(self):
+        segments = self.__get_segments()
+        for segment in segments:
+            self.__replay(segment)
+
+        for identifier in [identifier for identifier in self.__index if identifier.endswith(STAGING_SUFFIX)]:
+            # Interrupted rewrite, the original blocks are still in use
+            self.__apply(DROP, identifier, 0, None)
+
+        self.__open_writer(segments[-1] if segments else 0)
+        info("Recovered %d datasets from %d segments in %s" % (len(self.__index), len(segments),
+                                                              ", ".join(self.__paths)))
+
+    def __replay(self, segment):
+        with open(self.__get_segment_filename(segment), "r+b") as f:
+            size = fstat(f.fileno()).st_size
+            offset = 0
+            while True:
+                header = f.read(HEADER.size)
+                if not header:
+                    break
+
+                if len(header) == HEADER.size:
+                    record_type, encoding, index, key_length, length = HEADER.unpack(header)
+                    key = f.read(key_length)
+                    payload_offset = offset + HEADER.size + key_length
+                    f.seek(length, 1)
+
+                    if len(key) == key_length and payload_offset + length <= size:
+                        self.__track_segment(record_type, key, segment)
+                        value = None
+                        if record_type in (SUMMARY, SWAP):
+                            f.seek(payload_offset)
+                            value = _decode(encoding, f.read(length))
+
+                        self.__apply(record_type, key, index, (segment, payload_offset, encoding, length), value)
+                        offset = payload_offset + length
+                        continue
+
+                # Partially written record, most likely from a crash while appending
+                info("Truncating partial record at offset %d in segment %d" % (offset, segment))
+                f.truncate(offset)
+                break
+
+    def __apply(self, record_type, key, index, location, value=None):
+        # The value of a SUMMARY record is the summary and of a SWAP record the identifier of the staged blocks
+        if record_type in (DROP, SWAP):
+            for structure in (self.__index, self.__summaries, self.__summary_segments):
+                if record_type == DROP:
+                    structure.pop(key, None)
+                else:
+                    structure[key] = structure.pop(value, [])
+            return
+
+        blocks = self.__index.setdefault(key, [])
+        summaries = self.__summaries.setdefault(key, [])
+        summary_segments = self.__summary_segments.setdefault(key, [])
+        if record_type == EXTEND and blocks:
+            index = len(blocks) - 1
+        elif record_type == EXTEND or (record_type == APPEND and index == 0):
+            index = len(blocks)
+
+        while len(blocks) <= index:
+            # Records of blocks in collected segments are written again later in the log
+            blocks.append(None)
+            summaries.append(None)
+            summary_segments.append(None)
+
+        if record_type in (APPEND, REPLACE):
+            blocks[index] = [location]
+        elif record_type in (EXTEND, CHUNK):
+            blocks[index] = (blocks[index] or []) + [location]
+
+        if record_type == SUMMARY:
+            summaries[index] = value
+            summary_segments[index] = location[SEGMENT]
+        else:
+            # Until the summary of the changed block is written
+            summaries[index] = None
+            summary_segments[index] = None
+
+    def __track_segment(self, record_type, key, segment):
+        self.__record_segments.setdefault(key, set()).add(segment)
+        if record_type in (SWAP, DROP):
+            # Any earlier record of the key is no longer needed by the index
+            self.__reset_segments[key] = segment
+
+    def __open_writer(self, segment):
+        if self.__writer:
+            self.__writer.close()
+
+        self.__segment = segment
+        self.__writer = open(self.__get_segment_filename(segment), "ab")
+        self.__writer.seek(0, 2)
+
+    def __write(self, record_type, key, block=None, index=0, encoded=None):
+        # The block of a SUMMARY or SWAP record is the value applied to the index, encoded is a stored payload
+        is_native = block is not None and is_native_block(block)
+        if not is_native:
+            if encoded is None:
+                encoded = _encode(block) if block is not None else (RAW, "")
+            encoding, payload = encoded
+            pieces = [payload]
+
+        with self.__lock:
+            if self.__writer.tell() >= self.__segment_size:
+                # Seal the active segment and roll over to a new one
+                self.__open_writer(self.__segment + 1)
+
+            offset = self.__writer.tell()
+            payload_offset = offset + HEADER.size + len(key)
+            if is_native:
+                # The alignment of the arrays depends on where the payload is written
+                encoding, pieces = NDARRAY, encode_native(block, payload_offset)
+
+            length = sum(len(piece) for piece in pieces)
+            self.__writer.write(HEADER.pack(record_type, encoding, index, len(key), length))
+            self.__writer.write(key)
+            for piece in pieces:
+                self.__writer.write(piece)
+            self.__writer.flush()
+
+            self.__track_segment(record_type, key, self.__segment)
+            self.__apply(record_type, key, index, (self.__segment, payload_offset, encoding, length),
+                         block if record_type in (SUMMARY, SWAP) else None)
+
+    def __get_reader(self, segment):
+        with self.__lock:
+            reader = self.__readers.pop(segment, None)
+            if reader is None:
+                if len(self.__readers) >= self.__max_readers:
+                    # Closes the least recently used reader, once its read in progress is done
+                    _, (f, reader_lock) = self.__readers.popitem(last=False)
+                    with reader_lock:
+                        f.close()
+                reader = (open(self.__get_segment_filename(segment), "rb"), Lock())
+            self.__readers[segment] = reader
+            return reader
+
+    def __read_at(self, location, read):
+        while True:
+            f, lock = self.__get_reader(location[SEGMENT])
+            with lock:
+                # Closed if the reader was evicted after it was looked up, it's then opened again
+                if not f.closed:
+                    f.seek(location[OFFSET])
+                    return read(f)
+
+    def __read_payload(self, location):
+        return self.__read_at(location, lambda f: f.read(location[LENGTH]))
+
+    def __read(self, location):
+        if location[ENCODING] == NDARRAY:
+            is_list, arrays = self.__read_at(location, read_header)
+
+            # Read-only views directly on the segment, nothing is copied or decoded
+            return open_views(self.__get_segment_filename(location[SEGMENT]), location[OFFSET], is_list, arrays)
+
+        return _decode(location[ENCODING], self.__read_payload(location))
+
+    def __get_locations(self, identifier):
+        with self.__lock:
+            return list(self.__index.get(identifier, []))
+
+    def contains(self, identifier):
+        return identifier in self.__index
+
+    def __contains__(self, identifier):
+        return self.contains(identifier)
+
+    def identifiers(self):
+        with self.__lock:
+            return [identifier for identifier in self.__index if not identifier.endswith(STAGING_SUFFIX)]
+
+    def num_blocks(self, identifier):
+        return len(self.__index.get(identifier, []))
+
+    def append(self, identifier, block, summary=None):
+        with self.__lock:
+            index = self.num_blocks(identifier)
+            self.__write(APPEND, identifier, block, index)
+            if summary is not None:
+                self.__write(SUMMARY, identifier, summary, index)
+
+    def extend(self, identifier, block, summary=None):
+        # Extends the last block, or appends the block if there is none
+        with self.__lock:
+            index = self.num_blocks(identifier) - 1
+            if index < 0:
+                self.append(identifier, block, summary)
+                return
+
+            summary = merge_summaries(self.__summaries[identifier][index], summary)
+            self.__write(CHUNK, identifier, block, index)
+            if summary is not None:
+                self.__write(SUMMARY, identifier, summary, index)
+
+    def replace(self, identifier, index, block, summary=None):
+        if index >= self.num_blocks(identifier):
+            raise IndexError("Block %d doesn't exist for %s" % (index, identifier))
+
+        with self.__lock:
+            self.__write(REPLACE, identifier, block, index)
+            if summary is not None:
+                self.__write(SUMMARY, identifier, summary, index)
+
+    def rewrite(self, identifier, blocks):
+        """
+        Replaces all blocks of identifier by blocks, an iterable of (block, summary) tuples. The new blocks are
+        staged and swapped in by a single record, hence readers and recovery see either all old or all new blocks.
+        The caller has to make sure nothing is appended to identifier meanwhile.
+        """
+
+        self.stage(identifier, blocks)
+        self.swap(identifier)
+
+    def stage(self, identifier, blocks):
+        """
+        Writes blocks, an iterable of (block, summary) tuples, which replace all blocks of identifier when swapped
+        in by swap, or are removed by discard. Staging doesn't change the blocks of identifier, hence it may be
+        read and appended to meanwhile.
+        """
+
+        staged = identifier + STAGING_SUFFIX
+        # Always written, such that staged blocks of an earlier rewrite can't be replayed as part of these
+        self.__write(DROP, staged)
+        for block, summary in blocks:
+            self.append(staged, block, summary)
+
+    def swap(self, identifier):
+        self.__write(SWAP, identifier, identifier + STAGING_SUFFIX)
+
+    def discard(self, identifier):
+        self.drop(identifier + STAGING_SUFFIX)
+
+    def __copy_block(self, key, index, chunks, summary):
+        # Writes the stored chunks of a block again as they are, as block index of key
+        for i, location in enumerate(chunks):
+            record_type = CHUNK if i > 0 else REPLACE
+            if location[ENCODING] == NDARRAY:
+                # The alignment of the arrays depends on where the payload is written
+                self.__write(record_type, key, self.__read(location), index)
+            else:
+                self.__write(record_type, key, index=index,
+                             encoded=(location[ENCODING], self.__read_payload(location)))
+
+        if summary is not None:
+            self.__write(SUMMARY, key, summary, index)
+
+    def __relocate(self, identifier):
+        # Copies all blocks of identifier to the active segment, like rewrite
+        staged = identifier + STAGING_SUFFIX
+        self.__write(DROP, staged)
+        for index, (chunks, summary) in enumerate(zip(self.__get_locations(identifier),
+                                                      self.get_summaries(identifier))):
+            self.__copy_block(staged, index, chunks, summary)
+
+        self.__write(SWAP, identifier, staged)
+
+    def __reset(self, identifier):
+        # Writes the identifier and its staged blocks again after a DROP or SWAP, such that none of their older
+        # records are replayed
+        staged = identifier + STAGING_SUFFIX
+        with self.__lock:
+            staged_blocks = zip(self.__get_locations(staged), self.get_summaries(staged))
+            has_records = identifier in self.__record_segments
+
+        if self.contains(identifier):
+            self.__relocate(identifier)
+        else:
+            self.__write(DROP, staged)
+            if has_records:
+                self.__write(DROP, identifier)
+
+        if staged_blocks:
+            # Staged by a rewrite in progress
+            self.__write(DROP, staged)
+            for index, (chunks, summary) in enumerate(staged_blocks):
+                self.__copy_block(staged, index, chunks, summary)
+
+    def __relocate_blocks(self, identifier, segment):
+        # Copies the blocks of identifier, which has a chunk or the summary in segment, to the active segment
+        with self.__lock:
+            locations = self.__get_locations(identifier)
+            summaries = self.get_summaries(identifier)
+            summary_segments = list(self.__summary_segments.get(identifier, []))
+
+        for index, (chunks, summary, summary_segment) in enumerate(zip(locations, summaries, summary_segments)):
+            if any(chunk[SEGMENT] == segment for chunk in chunks):
+                self.__copy_block(identifier, index, chunks, summary)
+            elif summary_segment == segment:
+                self.__write(SUMMARY, identifier, summary, index)
+
+    def __get_live_bytes(self):
+        live = {}
+        for identifier, blocks in self.__index.items():
+            for chunks in blocks:
+                for chunk in chunks:
+                    live[chunk[SEGMENT]] = live.get(chunk[SEGMENT], 0) + HEADER.size + len(identifier) + chunk[LENGTH]
+        return live
+
+    def get_dead_bytes(self):
+        # Bytes of the sealed segments, which are no longer used by any block
+        with self.__lock:
+            live = self.__get_live_bytes()
+            return dict((segment, getsize(self.__get_segment_filename(segment)) - live.get(segment, 0))
+                        for segment in self.__get_segments() if segment != self.__segment)
+
+    def collect_garbage(self, min_dead_ratio=DEFAULT_DEAD_RATIO):
+        """
+        Deletes the sealed segment with most dead bytes, if at least min_dead_ratio of it is dead, after copying
+        the blocks still in use to the active segment. Returns the number of bytes reclaimed.
+        The caller has to make sure nothing is appended meanwhile.
+        """
+
+        dead_bytes = self.get_dead_bytes()
+        if not dead_bytes:
+            return 0
+
+        segment = max(dead_bytes, key=dead_bytes.get)
+        size = getsize(self.__get_segment_filename(segment))
+        if dead_bytes[segment] < min_dead_ratio * size:
+            return 0
+
+        with self.__lock:
+            keys = [key for key, segments in self.__record_segments.items() if segment in segments]
+
+        for identifier in set(key[:-len(STAGING_SUFFIX)] if key.endswith(STAGING_SUFFIX) else key for key in keys):
+            staged = identifier + STAGING_SUFFIX
+            with self.__lock:
+                # Records of the identifier or its staged blocks before the segment
+                has_older_records = any(min(self.__record_segments.get(key, [segment])) < segment
+                                        for key in (identifier, staged))
+                # The SWAP or DROP of either, which hides the older records when replayed
+                has_reset = segment in (self.__reset_segments.get(identifier), self.__reset_segments.get(staged))
+
+            if has_reset and has_older_records:
+                self.__reset(identifier)
+            else:
+                for key in (identifier, staged):
+                    if self.contains(key):
+                        self.__relocate_blocks(key, segment)
+
+        with self.__lock:
+            for key in keys:
+                self.__record_segments[key].discard(segment)
+                if not self.__record_segments[key]:
+                    del self.__record_segments[key]
+                    self.__reset_segments.pop(key, None)
+
+            reader = self.__readers.pop(segment, None)
+            if reader is not None:
+                f, reader_lock = reader
+                # Waits for a read in progress, memory-mapped views stay valid after the file is closed
+                with reader_lock:
+                    f.close()
+            remove(self.__get_segment_filename(segment))
+            directory = self.__segment_paths.pop(segment)
+
+        info("Collected segment %d of %d bytes in %s" % (segment, size, directory))
+        return dead_bytes[segment]
+
+    def drop(self, identifier):
+        if self.contains(identifier):
+            self.__write(DROP, identifier)
+
+    def get(self, identifier, index):
+        chunks = self.__get_locations(identifier)[index]
+        return _join_chunks([self.__read(location) for location in chunks])
+
+    def get_blocks(self, identifier, indices=None):
+        locations = self.__get_locations(identifier)
+        if indices is not None:
+            locations = [locations[index] for index in indices]
+
+        if self.__pool is None or len(locations) < 2:
+            return [_join_chunks([self.__read(location) for location in chunks]) for chunks in locations]
+
+        # Every disk reads its blocks in order, while the disks are read in parallel
+        positions_by_disk = {}
+        for position, chunks in enumerate(locations):
+            with self.__lock:
+                disk = self.__segment_paths.get(chunks[0][SEGMENT])
+            positions_by_disk.setdefault(disk, []).append(position)
+
+        def _read_blocks(positions):
+            return [(position, _join_chunks([self.__read(location) for location in locations[position]]))
+                    for position in positions]
+
+        blocks = [None] * len(locations)
+        for read_blocks in self.__pool.map(_read_blocks, positions_by_disk.values()):
+            for position, block in read_blocks:
+                blocks[position] = block
+        return blocks
+
+    def get_block_sizes(self, identifier):
+        # The number of chunks and bytes stored of every block
+        with self.__lock:
+            return [(len(chunks), sum(chunk[LENGTH] for chunk in chunks))
+                    for chunks in self.__index.get(identifier, [])]
+
+    def get_block_versions(self, identifier):
+        # Identifies the content of every block, since any change of a block is written to a new location
+        with self.__lock:
+            return [tuple((chunk[SEGMENT], chunk[OFFSET]) for chunk in chunks)
+                    for chunks in self.__index.get(identifier, [])]
+
+    def get_summaries(self, identifier):
+        # The zone map of every block, or None if the block has none
+        with self.__lock:
+            return list(self.__summaries.get(identifier, []))
+
+    def is_native(self, identifier, index):
+        return self.__get_locations(identifier)[index][0][ENCODING] == NDARRAY
+
+    def close(self):
+        if self.__pool:
+            self.__pool.close()
+
+        with self.__lock:
+            self.__writer.close()
+            for f, _ in self.__readers.values():
+                f.close()
+            self.__readers = OrderedDict()
@@ -0,0 +1,146 @@
+"""
+Compression of blocks chosen per dataset. A block is compressed once at the gateway, is sent, replicated and
+stored compressed, and is decompressed by the storage node when read. A compressed payload is self-describing:
+
+    [codec][kind](payload | [header length][header][buffers])
+
+where the header of numpy arrays holds whether the block is a list and the dtype and shape of each array.
+"""
+
+from bz2 import compress as bz2_compress, decompress as bz2_decompress
+from cPickle import dumps, loads, HIGHEST_PROTOCOL
+from struct import Struct
+from zlib import compress as zlib_compress, decompress as zlib_decompress
+
+from numpy import frombuffer, uint8, dtype as np_dtype
+
+from sofa.storage.ndarray_format import is_native_block
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+ZLIB = 'zlib'
+LZMA = 'lzma'
+BZ2 = 'bz2'
+SHUFFLE_ZLIB = 'shuffle-zlib'
+
+# Stored in the payload, hence the order must never change
+CODECS = [ZLIB, LZMA, BZ2, SHUFFLE_ZLIB]
+
+# Kinds of blocks
+RAW = 0
+PICKLED = 1
+ARRAYS = 2
+
+PREFIX = Struct("<BB")
+HEADER_LENGTH = Struct("<I")
+
+
+class EncodedBlock(object):
+    """
+    A compressed block as sent from the gateway to the storage nodes.
+    """
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __len__(self):
+        return len(self.payload)
+
+
+def is_valid_codec(codec):
+    return codec is None or codec in CODECS
+
+
+def _compress(codec, data):
+    if codec == BZ2:
+        return bz2_compress(data)
+    if codec == LZMA:
+        if lzma is None:
+            raise ImportError("The lzma codec requires the lzma module, e.g. backports.lzma")
+        return lzma.compress(data)
+    return zlib_compress(data)
+
+
+def _decompress(codec, data):
+    if codec == BZ2:
+        return bz2_decompress(data)
+    if codec == LZMA:
+        if lzma is None:
+            raise ImportError("The lzma codec requires the lzma module, e.g. backports.lzma")
+        return lzma.decompress(data)
+    return zlib_decompress(data)
+
+
+def _shuffle(array):
+    # Groups the n'th byte of every element together, which compresses better for numeric data
+    data = frombuffer(array.tobytes(), dtype=uint8)
+    return data.reshape(-1, array.itemsize).T.tobytes() if array.size else ""
+
+
+def _unshuffle(data, dtype):
+    data = frombuffer(data, dtype=uint8)
+    return data.reshape(dtype.itemsize, -1).T.tobytes() if len(data) else ""
+
+
+def encode(block, codec):
+    """
+    Compresses the block with codec and returns it as an :class:`.EncodedBlock`.
+    """
+
+    codec_id = CODECS.index(codec)
+    if is_native_block(block):
+        is_list = isinstance(block, list)
+        arrays = block if is_list else [block]
+        header = dumps((is_list, [(array.dtype.str, array.shape) for array in arrays]), HIGHEST_PROTOCOL)
+
+        buffers = [_shuffle(array) if codec == SHUFFLE_ZLIB else array.tobytes() for array in arrays]
+        return EncodedBlock("".join([PREFIX.pack(codec_id, ARRAYS), HEADER_LENGTH.pack(len(header)), header,
+                                     _compress(codec, "".join(buffers))]))
+
+    if isinstance(block, str):
+        return EncodedBlock(PREFIX.pack(codec_id, RAW) + _compress(codec, block))
+
+    return EncodedBlock(PREFIX.pack(codec_id, PICKLED) + _compress(codec, dumps(block, HIGHEST_PROTOCOL)))
+
+
+def decode(payload):
+    """
+    Decompresses the payload of an :class:`.EncodedBlock` to the original block.
+    """
+
+    codec_id, kind = PREFIX.unpack_from(payload)
+    codec = CODECS[codec_id]
+    position = PREFIX.size
+
+    if kind == RAW:
+        return _decompress(codec, payload[position:])
+
+    if kind == PICKLED:
+        return loads(_decompress(codec, payload[position:]))
+
+    header_length = HEADER_LENGTH.unpack_from(payload, position)[0]
+    position += HEADER_LENGTH.size
+    is_list, descriptions = loads(payload[position:position + header_length])
+    data = _decompress(codec, payload[position + header_length:])
+
+    arrays = []
+    offset = 0
+    for dtype, shape in descriptions:
+        dtype = np_dtype(dtype)
+        nbytes = dtype.itemsize
+        for dimension in shape:
+            nbytes *= dimension
+
+        buf = data[offset:offset + nbytes]
+        if codec == SHUFFLE_ZLIB:
+            buf = _unshuffle(buf, dtype)
+        arrays.append(frombuffer(buf, dtype=dtype).reshape(shape))
+        offset += nbytes
+
+    return arrays if is_list else arrays[0]
@@ -0,0 +1,40 @@
+from shelve import open
+from threading import Lock
+
+
+class MetaStore(object):
+    """
+    Storage of the json encoded meta data of the datasets in one replica, kept apart from the blocks
+    such that reading or updating meta data never touches block data.
+    """
+
+    def __init__(self, filename):
+        self.__lock = Lock()
+        self.__data = open(filename)
+
+    def get(self, identifier):
+        with self.__lock:
+            return self.__data.get(identifier)
+
+    def put(self, identifier, meta_data):
+        with self.__lock:
+            self.__data[identifier] = meta_data
+            self.__data.sync()
+
+    def delete(self, identifier):
+        with self.__lock:
+            if identifier in self.__data:
+                del self.__data[identifier]
+                self.__data.sync()
+
+    def contains(self, identifier):
+        with self.__lock:
+            return identifier in self.__data
+
+    def identifiers(self):
+        with self.__lock:
+            return self.__data.keys()
+
+    def close(self):
+        with self.__lock:
+            self.__data.close()
@@ -0,0 +1,187 @@
+"""
+Native on disk format for blocks of numpy arrays. A payload is a header followed by the raw array buffers,
+each aligned to ARRAY_ALIGNMENT bytes in the file, such that the arrays can be memory-mapped directly:
+
+    [header length][is list][number of arrays]([data offset][dtype length][ndim][dtype][shape...])*[buffers]
+"""
+
+from mmap import mmap
+from struct import Struct
+
+from numpy import ndarray, memmap, zeros, dtype as np_dtype, ascontiguousarray, uint8, prod
+
+ARRAY_ALIGNMENT = 64
+NATIVE_KINDS = 'biufc'
+
+PREFIX = Struct("<Q")
+BLOCK = Struct("<BI")
+ARRAY = Struct("<QHB")
+DIMENSION = Struct("<Q")
+
+
+def _is_native_array(array):
+    return isinstance(array, ndarray) and array.dtype.kind in NATIVE_KINDS and not array.dtype.fields
+
+
+def is_native_block(block):
+    if isinstance(block, list):
+        return len(block) > 0 and all(_is_native_array(array) for array in block)
+    return _is_native_array(block)
+
+
+def _align(offset):
+    return offset + (-offset % ARRAY_ALIGNMENT)
+
+
+def encode(block, payload_offset):
+    """
+    Returns the pieces (strings and buffers) of the payload, to be written at the absolute file offset
+    payload_offset, with the arrays aligned within the file.
+    """
+
+    is_list = isinstance(block, list)
+    arrays = [ascontiguousarray(array) for array in (block if is_list else [block])]
+
+    descriptions = [(array.dtype.str, array.shape) for array in arrays]
+    header_length = BLOCK.size + sum(ARRAY.size + len(dtype) + DIMENSION.size * len(shape)
+                                     for dtype, shape in descriptions)
+
+    # Data offsets are relative to the start of the payload
+    data_offset = _align(payload_offset + PREFIX.size + header_length) - payload_offset
+    header = [BLOCK.pack(is_list, len(arrays))]
+    pieces = []
+    for array, (dtype, shape) in zip(arrays, descriptions):
+        header.append(ARRAY.pack(data_offset, len(dtype), len(shape)))
+        header.append(dtype)
+        header.extend(DIMENSION.pack(dimension) for dimension in shape)
+
+        pieces.append(buffer(array))
+        padding = _align(payload_offset + data_offset + array.nbytes) - payload_offset - data_offset - array.nbytes
+        pieces.append("\0" * padding)
+        data_offset += array.nbytes + padding
+
+    header = "".join(header)
+    padding = _align(payload_offset + PREFIX.size + header_length) - payload_offset - PREFIX.size - header_length
+    return [PREFIX.pack(header_length), header, "\0" * padding] + pieces
+
+
+def read_header(f):
+    """
+    Reads the header at the current position of f and returns whether the block is a list, and a list
+    of tuples with data offset (relative to the payload), dtype and shape of each array.
+    """
+
+    header = f.read(PREFIX.unpack(f.read(PREFIX.size))[0])
+
+    is_list, count = BLOCK.unpack_from(header)
+    position = BLOCK.size
+    arrays = []
+    for _ in xrange(count):
+        data_offset, dtype_length, ndim = ARRAY.unpack_from(header, position)
+        position += ARRAY.size
+        dtype = header[position:position + dtype_length]
+        position += dtype_length
+        shape = tuple(DIMENSION.unpack_from(header, position + DIMENSION.size * i)[0] for i in xrange(ndim))
+        position += DIMENSION.size * ndim
+        arrays.append((data_offset, dtype, shape))
+
+    return bool(is_list), arrays
+
+
+def _view(mapping, offset, dtype, shape):
+    if not all(shape):
+        # Zero sized arrays can't be memory-mapped
+        view = zeros(shape, dtype=np_dtype(dtype))
+        view.flags.writeable = False
+        return view
+
+    return ndarray(shape, dtype=np_dtype(dtype), buffer=mapping, offset=offset)
+
+
+def _map(filename, offset, arrays):
+    # Maps the bytes spanned by the arrays, given by their offsets relative to offset, once
+    length = max(data_offset + np_dtype(dtype).itemsize * int(prod(shape)) for data_offset, dtype, shape in arrays)
+    if not length:
+        return [_view(None, 0, dtype, shape) for _, dtype, shape in arrays]
+
+    mapping = memmap(filename, dtype=uint8, mode='r', offset=offset, shape=(length,))
+    return [_view(mapping, data_offset, dtype, shape) for data_offset, dtype, shape in arrays]
+
+
+def open_views(filename, payload_offset, is_list, arrays):
+    """
+    Memory-maps the arrays of a block read-only, without copying or decoding the data. The payload is mapped
+    once and every array is a view of it.
+    """
+
+    start = min(data_offset for data_offset, _, _ in arrays)
+    views = _map(filename, payload_offset + start, [(data_offset - start, dtype, shape)
+                                                    for data_offset, dtype, shape in arrays])
+    return views if is_list else views[0]
+
+
+def _find_mapping(array):
+    # The memory map of a file, which array is a view of
+    base = array
+    while isinstance(base, ndarray):
+        if isinstance(base, memmap) and isinstance(base.base, mmap) and base.filename:
+            return base
+        base = base.base
+    return None
+
+
+class MappedBlock(object):
+    """
+    Reference to the arrays of a block memory-mapped from a file, such that it can be sent to another process
+    on the same machine, which maps the file itself instead of receiving a copy of the data.
+    """
+
+    def __init__(self, filename, offset, is_list, arrays):
+        self.filename = filename
+        self.offset = offset
+        self.is_list = is_list
+        self.arrays = arrays
+
+    def open(self):
+        views = _map(self.filename, self.offset, self.arrays)
+        return views if self.is_list else views[0]
+
+
+def share_block(block):
+    """
+    Replaces a block of arrays memory-mapped from the same file by a reference to the file.
+    """
+
+    if not is_native_block(block):
+        return block
+
+    is_list = isinstance(block, list)
+    arrays = []
+    filename = None
+    for array in (block if is_list else [block]):
+        if not array.size:
+            arrays.append((None, array.dtype.str, array.shape))
+            continue
+
+        mapping = _find_mapping(array)
+        if mapping is None or not array.flags.c_contiguous or filename not in (None, mapping.filename):
+            return block
+
+        filename = mapping.filename
+        offset = mapping.offset + array.ctypes.data - mapping.ctypes.data
+        arrays.append((offset, array.dtype.str, array.shape))
+
+    if filename is None:
+        return block
+
+    start = min(offset for offset, _, _ in arrays if offset is not None)
+    return MappedBlock(filename, start, is_list, [(0 if offset is None else offset - start, dtype, shape)
+                                                 for offset, dtype, shape in arrays])
+
+
+def open_shared_block(block):
+    """
+    Memory-maps the arrays of a block referenced by share_block.
+    """
+
+    return block.open() if isinstance(block, MappedBlock) else block
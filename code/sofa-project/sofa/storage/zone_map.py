@@ -0,0 +1,109 @@
+"""
+Zone maps are summaries of the entries in a block, computed by the gateway when appending, which lets storage
+nodes skip blocks a query can't match without reading them. A summary is a dict with 'count' and:
+
+    * 'min' and 'max' of the values, if all entries are numbers or numeric arrays. Both are None if all
+      values are NaN, such that the block may match any filter
+    * 'min-length' and 'max-length' of the entries, if all entries are strings, e.g. lines of text
+"""
+
+from math import isnan
+from numbers import Number
+from warnings import catch_warnings, simplefilter
+
+from numpy import ndarray, nanmin, nanmax
+
+COUNT = 'count'
+MIN = 'min'
+MAX = 'max'
+MIN_LENGTH = 'min-length'
+MAX_LENGTH = 'max-length'
+
+NUMERIC_KINDS = 'biuf'
+
+
+def _is_numeric(entry):
+    if isinstance(entry, ndarray):
+        return entry.size > 0 and entry.dtype.kind in NUMERIC_KINDS
+    return isinstance(entry, Number) and not isinstance(entry, complex)
+
+
+def _to_python(value):
+    # The summaries are stored and sent, hence no numpy scalars
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _range(entry):
+    if not isinstance(entry, ndarray):
+        return entry, entry
+
+    with catch_warnings():
+        # All-NaN arrays warn and give NaN, which is handled by the caller
+        simplefilter('ignore', RuntimeWarning)
+        return nanmin(entry), nanmax(entry)
+
+
+def _bounds(ranges):
+    ranges = [(low, high) for low, high in ranges if not isnan(low) and not isnan(high)]
+    if not ranges:
+        return None, None
+
+    return _to_python(min(low for low, _ in ranges)), _to_python(max(high for _, high in ranges))
+
+
+def has_bounds(summary):
+    """
+    Returns False if the summary has numeric bounds which are unknown, i.e. the block may match any filter.
+    """
+
+    return summary.get(MIN, 0) is not None and summary.get(MAX, 0) is not None
+
+
+def summarize(block):
+    """
+    Returns the zone map of a block, i.e. a list of entries.
+    """
+
+    if isinstance(block, ndarray) and block.ndim > 0:
+        # A block of rows sliced from an array
+        summary = {COUNT: len(block)}
+        if _is_numeric(block):
+            summary[MIN], summary[MAX] = _bounds([_range(block)])
+        return summary
+
+    if isinstance(block, ndarray):
+        block = [block]
+
+    summary = {COUNT: len(block)}
+    if not block:
+        return summary
+
+    if all(_is_numeric(entry) for entry in block):
+        summary[MIN], summary[MAX] = _bounds([_range(entry) for entry in block])
+    elif all(isinstance(entry, basestring) for entry in block):
+        lengths = [len(entry) for entry in block]
+        summary[MIN_LENGTH] = min(lengths)
+        summary[MAX_LENGTH] = max(lengths)
+
+    return summary
+
+
+def merge(summary, other):
+    """
+    Returns the zone map of a block extended with a chunk summarized by other.
+    """
+
+    if summary is None or other is None:
+        return None
+
+    if not summary[COUNT] or not other[COUNT]:
+        return other if not summary[COUNT] else summary
+
+    merged = {COUNT: summary[COUNT] + other[COUNT]}
+    for key, reduce_fun in [(MIN, min), (MAX, max), (MIN_LENGTH, min), (MAX_LENGTH, max)]:
+        if key in summary and key in other:
+            # Unknown bounds stay unknown
+            is_known = summary[key] is not None and other[key] is not None
+            merged[key] = reduce_fun(summary[key], other[key]) if is_known else None
+
+    return merged
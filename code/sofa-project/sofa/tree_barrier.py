@@ -1,8 +1,6 @@
 # Created by Steffen Karlsson on 02-23-2016
 # Copyright (c) 2016 The Niels Bohr Institute at University of Copenhagen. All rights reserved.
 
-from math import log
-
 
 class TreeBarrier:
     def __init__(self, current, nodes, root):
@@ -10,7 +8,8 @@ class TreeBarrier:
         self.__id = (self.__nodes.index(current) - self.__nodes.index(root)) % len(self.__nodes)
         self.__offset = 0 - self.__nodes.index(root)
         self.__sending_itr = 0
-        self.__max_itr = int(log(len(self.__nodes), 2))
+        # Rounded up, such that the results of every node reaches the root, when not a power of two
+        self.__max_itr = (len(self.__nodes) - 1).bit_length()
         self.__step = lambda itr: pow(2, itr + 1)
         self.__start = lambda itr: pow(2, itr)
         self.has_send = False
@@ -33,5 +32,12 @@ class TreeBarrier:
 
         return False
 
+    def should_receive(self, itr):
+        # Whether a node sends its result to this node in iteration itr
+        return self.__id % self.__step(itr) == 0 and self.__id + self.__start(itr) < len(self.__nodes)
+
     def get_receiver_idx(self):
-        return self.__id - self.__start(self.__sending_itr) - self.__offset
+        return (self.__id - self.__start(self.__sending_itr) - self.__offset) % len(self.__nodes)
+
+    def get_receiver(self):
+        return self.__nodes[self.get_receiver_idx()]
@@ -0,0 +1,121 @@
+from cPickle import loads
+from threading import Lock
+from time import sleep
+from unittest import TestCase, main
+
+from sofa.delegation import FunctionDelegation
+from sofa.error import STATUS_SUCCESS
+from sofa.handler.gateway import _BlockSender
+from sofatest.cluster import LocalCluster
+from sofatest.datasets import FAILING_LINE, BROKEN_LINE
+
+TEXT = "\n".join("x" * (i % 17 + 1) for i in range(200))
+
+
+class AppendTest(TestCase):
+    options = {}
+
+    def setUp(self):
+        self.cluster = LocalCluster(2, block_size=0.0005, **self.options)
+        self.gateway = self.cluster.gateway
+        self.gateway.create('lines', 'sofatest.datasets.FailingLineDataset')
+
+    def tearDown(self):
+        self.cluster.shutdown()
+
+    def __stored_lines(self, node):
+        replica_blocks = node._StorageHandler__DISK[0]
+        return [line for identifier in replica_blocks.identifiers()
+                for block in replica_blocks.get_blocks(identifier) for line in loads(block)]
+
+    def __stored_chars(self):
+        chars = 0
+        for node in self.cluster.storage_nodes:
+            replica_blocks = node._StorageHandler__DISK[0]
+            for identifier in replica_blocks.identifiers():
+                chars += sum(len(line) for block in replica_blocks.get_blocks(identifier) for line in loads(block))
+        return chars
+
+    def __chars(self):
+        return self.cluster.result('lines', 'chars')[1][0]
+
+    def test_append(self):
+        self.gateway.append('lines', TEXT, False)
+        self.assertEqual(self.__chars(), len(TEXT) - TEXT.count("\n"))
+
+    def test_append_in_order(self):
+        # Many batches to every storage node, which are in flight at the same time
+        text = "\n".join(str(i) for i in range(20000))
+        self.gateway.append('lines', text, False)
+
+        for node in self.cluster.storage_nodes:
+            lines = [int(line) for line in self.__stored_lines(node)]
+            self.assertGreater(len(lines), 0)
+            self.assertEqual(lines, sorted(lines))
+
+    def test_failed_append_records_written_blocks(self):
+        self.assertRaises(Exception, self.gateway.append, 'lines', FAILING_LINE + "\n" + TEXT, False)
+
+        stored_chars = self.__stored_chars()
+        self.assertGreater(stored_chars, 0)
+        self.assertEqual(self.__chars(), stored_chars)
+
+        self.gateway.append('lines', TEXT, False)
+        self.assertEqual(self.__chars(), stored_chars + len(TEXT) - TEXT.count("\n"))
+
+    def test_failed_preparation_records_written_blocks(self):
+        # Sent in several batches to every storage node, before the last block fails
+        self.assertRaises(ValueError, self.gateway.append, 'lines', TEXT * 4 + "\n" + BROKEN_LINE, False)
+
+        stored_chars = self.__stored_chars()
+        self.assertGreater(stored_chars, 0)
+        self.assertEqual(self.__chars(), stored_chars)
+
+
+class _SlowStorageNode(object):
+    def __init__(self):
+        # Shared by the copies of the sender
+        self.lock = Lock()
+        self.calls = {'in-flight': 0, 'max-in-flight': 0, 'positions': []}
+
+    def get_uri(self):
+        return "slow"
+
+    def append_many(self, function_delegation, identifier, blocks):
+        with self.lock:
+            self.calls['in-flight'] += 1
+            self.calls['max-in-flight'] = max(self.calls['max-in-flight'], self.calls['in-flight'])
+            self.calls['positions'].append(function_delegation['sequence'][1])
+        sleep(0.02)
+        with self.lock:
+            self.calls['in-flight'] -= 1
+        return STATUS_SUCCESS
+
+
+class BlockSenderTest(TestCase):
+    def test_batches_in_flight(self):
+        node = _SlowStorageNode()
+        sender = _BlockSender(FunctionDelegation("lines").as_required_queue_delegation(None, 1), "lines",
+                              max_batches=4)
+        for i in range(16):
+            sender.send(node, [(str(i), True, None)])
+
+        self.assertEqual(sender.join(), STATUS_SUCCESS)
+        self.assertEqual(node.calls['max-in-flight'], 4)
+        self.assertEqual(sorted(node.calls['positions']), range(16))
+        self.assertEqual(sender.get_written(), ({"slow": 16}, set()))
+
+
+class IngestPoolAppendTest(AppendTest):
+    options = {'ingest_processes': 2}
+
+    def test_shutdown_stops_processes(self):
+        processes = self.cluster.gateway_node._GatewayHandler__ingest_pool._pool
+        self.gateway.append('lines', TEXT, False)
+        self.cluster.shutdown()
+
+        self.assertFalse(any(process.is_alive() for process in processes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+from os import listdir, readlink
+from os.path import exists, join
+from random import Random
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main, skipUnless
+
+from numpy import arange
+
+from sofa.storage.block_log import BlockLog
+
+SEGMENT_SIZE = 4000
+
+
+def _open_segments(directory):
+    # Segment files of directory opened by this process, including removed files which are still open
+    fds = "/proc/self/fd"
+    targets = []
+    for fd in listdir(fds):
+        try:
+            targets.append(readlink(join(fds, fd)))
+        except OSError:
+            pass
+    return [target for target in targets if target.startswith(directory)]
+
+
+class BlockLogTest(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.log = BlockLog(self.directory, segment_size=SEGMENT_SIZE)
+
+    def tearDown(self):
+        self.log.close()
+        rmtree(self.directory)
+
+    def reopen(self):
+        self.log.close()
+        self.log = BlockLog(self.directory, segment_size=SEGMENT_SIZE)
+
+    def test_append_and_get(self):
+        self.log.append("a", ["x", "y"])
+        self.log.append("a", "raw")
+        self.log.extend("a", "data")
+
+        self.assertEqual(self.log.num_blocks("a"), 2)
+        self.assertEqual(self.log.get("a", 0), ["x", "y"])
+        self.assertEqual(self.log.get("a", 1), "rawdata")
+
+    def test_native_blocks_are_views(self):
+        self.log.append("a", arange(10.))
+        self.log.extend("a", arange(5.))
+
+        self.assertTrue(self.log.is_native("a", 0))
+        self.assertEqual(self.log.get("a", 0).tolist(), range(10) + range(5))
+
+    def test_recovery(self):
+        self.log.append("a", ["x"], summary={'count': 1})
+        self.log.append("b", ["y"])
+        self.log.replace("a", 0, ["z"], summary={'count': 2})
+        self.log.drop("b")
+        self.reopen()
+
+        self.assertEqual(self.log.identifiers(), ["a"])
+        self.assertEqual(self.log.get("a", 0), ["z"])
+        self.assertEqual(self.log.get_summaries("a"), [{'count': 2}])
+
+    def test_rewrite(self):
+        for i in xrange(5):
+            self.log.append("a", [i])
+        self.log.rewrite("a", [([0, 1, 2], None), ([3, 4], None)])
+        self.reopen()
+
+        self.assertEqual(self.log.get_blocks("a"), [[0, 1, 2], [3, 4]])
+
+    def test_stage_and_swap(self):
+        self.log.append("a", [0])
+        self.log.stage("a", [([1], None), ([2], None)])
+        self.assertEqual(self.log.get_blocks("a"), [[0]])
+        self.assertEqual(self.log.identifiers(), ["a"])
+
+        self.log.swap("a")
+        self.reopen()
+        self.assertEqual(self.log.get_blocks("a"), [[1], [2]])
+
+    def test_discard(self):
+        self.log.append("a", [0])
+        self.log.stage("a", [([1], None)])
+        self.log.discard("a")
+        self.reopen()
+
+        self.assertEqual(self.log.get_blocks("a"), [[0]])
+        self.assertEqual(self.log.identifiers(), ["a"])
+
+    def test_collect_garbage(self):
+        for i in xrange(20):
+            self.log.append("a", "a" * 500)
+        self.log.append("b", "b" * 500)
+        self.log.get_blocks("a")
+        self.log.rewrite("a", [("a" * 500, None)])
+
+        reclaimed = 0
+        while True:
+            collected = self.log.collect_garbage()
+            if not collected:
+                break
+            reclaimed += collected
+
+        self.assertTrue(reclaimed > 0)
+        self.assertEqual(self.log.get_blocks("a"), ["a" * 500])
+        self.assertEqual(self.log.get_blocks("b"), ["b" * 500])
+
+        self.reopen()
+        self.assertEqual(self.log.get_blocks("a"), ["a" * 500])
+        self.assertEqual(self.log.get_blocks("b"), ["b" * 500])
+
+    def test_collect_garbage_after_rewrite_drop_rewrite(self):
+        self.log.close()
+        self.log = BlockLog(self.directory, segment_size=60)
+
+        # The staged block stays in the first segment, which is kept by the live block of c
+        self.log.stage("b", [("old", None)])
+        self.log.append("c", "c" * 200)
+        self.log.swap("b")
+        self.log.drop("b")
+        self.log.stage("b", [("new", None), ("newer", None)])
+        self.log.swap("b")
+        self.log.append("c", "c" * 200)
+        self.log.append("c", "c")
+
+        # Collects the segment with the SWAP and DROP of b and the DROP of the staged blocks of the second rewrite
+        self.assertGreater(self.log.collect_garbage(), 0)
+        self.log.close()
+        self.log = BlockLog(self.directory, segment_size=60)
+
+        self.assertEqual(self.log.get_blocks("b"), ["new", "newer"])
+
+    def test_collect_garbage_matches_model(self):
+        for seed in xrange(100):
+            self.log.close()
+            rmtree(self.directory)
+            self.log = BlockLog(self.directory, segment_size=300)
+            random = Random(seed)
+            model = {}
+
+            for step in xrange(60):
+                identifier = random.choice("ab")
+                block = ["x%d" % random.randint(0, 99) for _ in xrange(random.randint(1, 3))]
+                operation = random.random()
+                if operation < 0.4:
+                    self.log.append(identifier, block)
+                    model.setdefault(identifier, []).append(block)
+                elif operation < 0.55:
+                    blocks = [["x%d" % random.randint(0, 99)] for _ in xrange(random.randint(1, 3))]
+                    self.log.rewrite(identifier, [(rewritten, None) for rewritten in blocks])
+                    model[identifier] = blocks
+                elif operation < 0.65:
+                    self.log.drop(identifier)
+                    model.pop(identifier, None)
+                elif operation < 0.9:
+                    self.log.collect_garbage(min_dead_ratio=random.choice([0, 0.5]))
+                else:
+                    self.reopen()
+
+                for identifier, blocks in model.items():
+                    self.assertEqual(self.log.get_blocks(identifier), blocks, "seed %d" % seed)
+
+            self.reopen()
+            self.assertEqual(sorted(self.log.identifiers()), sorted(model))
+            for identifier, blocks in model.items():
+                self.assertEqual(self.log.get_blocks(identifier), blocks, "seed %d" % seed)
+
+    @skipUnless(exists("/proc/self/fd"), "requires /proc")
+    def test_collect_garbage_closes_readers(self):
+        for i in xrange(20):
+            self.log.append("a", "a" * 500)
+        self.log.get_blocks("a")
+        self.log.drop("a")
+        self.log.append("b", "b")
+
+        while self.log.collect_garbage():
+            pass
+
+        # Only the active segment, and no reader of a removed segment, is still open
+        removed = [target for target in _open_segments(self.directory) if target.endswith("(deleted)")]
+        self.assertEqual(removed, [])
+        self.assertEqual(len(listdir(self.directory)), len(set(_open_segments(self.directory))))
+
+    def test_bounded_readers(self):
+        self.log.close()
+        self.log = BlockLog(self.directory, segment_size=SEGMENT_SIZE, max_readers=2)
+        blocks = ["%d" % i * 1000 for i in xrange(12)]
+        for block in blocks:
+            self.log.append("a", block)
+
+        self.assertEqual(self.log.get_blocks("a"), blocks)
+        self.assertEqual(self.log.get_blocks("a", [11, 0, 5]), [blocks[11], blocks[0], blocks[5]])
+        # The writer and at most two readers
+        self.assertLessEqual(len(_open_segments(self.directory)), 3)
+
+
+class StripedBlockLogTest(TestCase):
+    def setUp(self):
+        self.directories = [mkdtemp() for _ in xrange(3)]
+        self.log = BlockLog(self.directories, segment_size=SEGMENT_SIZE, stripe_size=1000)
+
+    def tearDown(self):
+        self.log.close()
+        for directory in self.directories:
+            rmtree(directory)
+
+    def test_small_dataset_is_striped(self):
+        # Much less than a segment, but spread over every directory
+        blocks = ["%d" % i * 600 for i in xrange(6)]
+        for block in blocks:
+            self.log.append("a", block)
+
+        self.assertTrue(all(listdir(directory) for directory in self.directories))
+        self.assertEqual(self.log.get_blocks("a"), blocks)
+
+        self.log.close()
+        self.log = BlockLog(self.directories, segment_size=SEGMENT_SIZE, stripe_size=1000)
+        self.assertEqual(self.log.get_blocks("a"), blocks)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+from collections import defaultdict
+from time import sleep
+from unittest import TestCase, main
+
+from sofa.cache import CacheSystem, LFU
+from sofa.storage.block_cache import BlockCache
+
+
+class CacheSystemTest(TestCase):
+    def test_unbounded(self):
+        cache = CacheSystem(dict)
+        for key in range(100):
+            cache.put(key, key)
+
+        self.assertEqual(len(cache.keys()), 100)
+        self.assertEqual(cache.get(0), 0)
+        self.assertRaises(KeyError, cache.get, 100)
+        self.assertEqual(cache.get_statistics()['bytes'], None)
+
+    def test_creates_missing_values(self):
+        cache = CacheSystem(defaultdict, args=dict)
+        cache.get('a')['b'] = 1
+
+        self.assertEqual(cache.get('a'), {'b': 1})
+        self.assertEqual(cache.get_statistics()['misses'], 1)
+        self.assertEqual(cache.get_statistics()['hits'], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = CacheSystem(dict, max_size=3, size_fun=lambda value: 1)
+        for key in 'abc':
+            cache.put(key, key)
+        cache.get('a')
+        cache.put('d', 'd')
+
+        self.assertEqual(sorted(cache.keys()), ['a', 'c', 'd'])
+        self.assertEqual(cache.get_statistics()['evictions'], 1)
+
+    def test_evicts_least_frequently_used(self):
+        cache = CacheSystem(dict, max_size=3, policy=LFU, size_fun=lambda value: 1)
+        for key in 'abc':
+            cache.put(key, key)
+        for key in 'abab':
+            cache.get(key)
+        cache.get('c')
+        cache.put('d', 'd')
+
+        self.assertEqual(sorted(cache.keys()), ['a', 'b', 'd'])
+
+    def test_keeps_unevictable(self):
+        cache = CacheSystem(dict, max_size=2, size_fun=lambda value: 1, evictable=lambda value: value != 'keep')
+        cache.put('a', 'keep')
+        cache.put('b', 'b')
+        cache.put('c', 'c')
+
+        self.assertEqual(sorted(cache.keys()), ['a', 'c'])
+
+    def test_expires(self):
+        cache = CacheSystem(dict, ttl=0.01)
+        cache.put('a', 'a')
+        sleep(0.02)
+
+        self.assertFalse(cache.contains('a'))
+        self.assertEqual(cache.get_statistics()['expirations'], 1)
+
+    def test_resize(self):
+        cache = CacheSystem(dict, max_size=10, size_fun=lambda value: 1)
+        for key in range(10):
+            cache.put(key, key)
+        cache.resize(4)
+
+        self.assertEqual(sorted(cache.keys()), [6, 7, 8, 9])
+        self.assertEqual(cache.get_size(), 4)
+
+    def test_given_size(self):
+        cache = CacheSystem(dict, max_size=10, size_fun=lambda value: 1)
+        cache.put('a', 'a', size=8)
+        cache.put('b', 'b', size=8)
+
+        self.assertEqual(cache.keys(), ['b'])
+        self.assertEqual(cache.get_size(), 8)
+
+
+class BlockCacheTest(TestCase):
+    def setUp(self):
+        self.cache = BlockCache(10, len)
+
+    def test_evicts_least_recently_used(self):
+        for index in range(4):
+            self.cache.put(('a', 0, index), "x" * 3)
+
+        self.assertFalse(self.cache.contains(('a', 0, 0)))
+        self.assertEqual(self.cache.get(('a', 0, 3)), "xxx")
+        self.assertIsNone(self.cache.get(('a', 0, 0)))
+
+    def test_skips_too_large_blocks(self):
+        self.cache.put(('a', 0, 0), "x" * 3)
+        self.cache.put(('a', 0, 1), "x" * 11)
+
+        self.assertTrue(self.cache.contains(('a', 0, 0)))
+        self.assertFalse(self.cache.contains(('a', 0, 1)))
+
+    def test_pinned_blocks_stay(self):
+        self.cache.pin('a')
+        self.cache.put(('a', 0, 0), "x" * 4)
+        for index in range(4):
+            self.cache.put(('b', 0, index), "y" * 3)
+
+        self.assertTrue(self.cache.contains(('a', 0, 0)))
+        self.assertEqual(self.cache.get_size(), 10)
+        self.assertEqual(self.cache.get_statistics()['pinned-bytes'], 4)
+
+    def test_promotes_blocks_when_pinned(self):
+        self.cache.put(('a', 0, 0), "xxx")
+        self.cache.pin('a')
+        self.cache.get(('a', 0, 0))
+
+        self.assertEqual(self.cache.get_statistics()['pinned-entries'], 1)
+
+    def test_unpin_demotes(self):
+        self.cache.pin('a')
+        self.cache.put(('a', 0, 0), "xxx")
+        self.cache.unpin('a')
+
+        self.assertFalse(self.cache.is_pinned('a'))
+        self.assertTrue(self.cache.contains(('a', 0, 0)))
+        self.assertEqual(self.cache.get_statistics()['pinned-bytes'], 0)
+
+    def test_invalidate(self):
+        self.cache.pin('a')
+        for index in range(2):
+            self.cache.put(('a', 0, index), "x")
+            self.cache.put(('b', 0, index), "y")
+
+        self.cache.invalidate('a', 1)
+        self.cache.invalidate('b')
+        self.assertTrue(self.cache.contains(('a', 0, 0)))
+        self.assertFalse(self.cache.contains(('a', 0, 1)))
+        self.assertFalse(self.cache.contains(('b', 0, 0)))
+        self.assertEqual(self.cache.get_size(), 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+from gc import collect
+from os import makedirs
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from time import sleep, time
+
+from Pyro4 import Daemon, config as pyro_config
+from Pyro4.naming import startNS
+
+from sofa.config.parser import Configuration
+from sofa.error import is_processing, STATUS_NOT_FOUND
+from sofa.handler.api import GatewayApi
+from sofa.handler.gateway import GatewayHandler
+from sofa.handler.storage import StorageHandler
+
+pyro_config.SERVERTYPE = 'thread'
+pyro_config.SERIALIZER = 'pickle'
+pyro_config.SERIALIZERS_ACCEPTED.add('pickle')
+
+RESULT_TIMEOUT = 20
+
+
+class LocalCluster(object):
+    """
+    A gateway and storage nodes served in this process, with a name server of their own.
+    """
+
+    def __init__(self, num_storage_nodes=1, **options):
+        self.directory = mkdtemp()
+        self.__daemons = []
+
+        uri, ns_daemon, _ = startNS(host='localhost', port=0, enableBroadcast=False)
+        pyro_config.NS_HOST, pyro_config.NS_PORT = uri.host, uri.port
+        self.__serve(ns_daemon)
+
+        name_server = ns_daemon.nameserver
+        self.storage = [('sofa:test:storage:%d' % index, None) for index in range(num_storage_nodes)]
+        self.storage_nodes = []
+        for index, (node, _) in enumerate(self.storage):
+            handler = StorageHandler(self.__configuration(node, index, options), {'storage': self.storage})
+            name_server.register(node, self.__serve(Daemon(host='localhost', port=0)).register(handler))
+            self.storage_nodes.append(handler)
+
+        self.gateway_node = GatewayHandler(self.__configuration('sofa:test:gateway:0', 0, options),
+                                           {'storage': self.storage})
+        name_server.register('sofa:test:gateway:0',
+                             self.__serve(Daemon(host='localhost', port=0)).register(self.gateway_node))
+        self.gateway = GatewayApi('sofa:test:gateway:0')
+
+    def __configuration(self, node, index, options):
+        config = Configuration()
+        config.instance_name = 'test'
+        config.node = node
+        config.node_idx = index
+        config.mount_point = '%s/%s/' % (self.directory, node.replace(':', '-'))
+        makedirs(config.mount_point)
+        config.others = {'storage': self.storage}
+        for option, value in options.items():
+            setattr(config, option, value)
+        return config
+
+    def __serve(self, daemon):
+        thread = Thread(target=daemon.requestLoop)
+        thread.daemon = True
+        thread.start()
+        self.__daemons.append((daemon, thread))
+        return daemon
+
+    def result(self, name, function, query=None):
+        self.gateway.submit_job(name, function, query)
+
+        started = time()
+        while time() - started < RESULT_TIMEOUT:
+            # Not found until the submitted job is registered
+            res = self.gateway.poll_for_result(name, function, query)
+            if res[0] != STATUS_NOT_FOUND and not is_processing(res):
+                return res
+            sleep(0.05)
+
+        raise AssertionError("No result of %s on %s" % (function, name))
+
+    def shutdown(self):
+        if self.gateway is None:
+            # Already shut down
+            return
+
+        # Connections left open keep the workers of the daemons waiting
+        self.gateway._api._pyroRelease()
+        for daemon, thread in reversed(self.__daemons):
+            daemon.shutdown()
+            thread.join()
+            daemon.close()
+        for handler in [self.gateway_node] + self.storage_nodes:
+            handler.shutdown()
+
+        # The proxies of the nodes to each other are closed when collected
+        self.__daemons = []
+        self.gateway = self.gateway_node = self.storage_nodes = None
+        collect()
+        rmtree(self.directory, ignore_errors=True)
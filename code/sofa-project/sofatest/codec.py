@@ -0,0 +1,56 @@
+from unittest import TestCase, main
+
+from numpy import arange, array, float32, int16, zeros
+
+from sofa.storage.codec import encode, decode, is_valid_codec, lzma, CODECS, ZLIB, BZ2, SHUFFLE_ZLIB
+
+AVAILABLE_CODECS = [codec for codec in CODECS if codec != 'lzma' or lzma is not None]
+
+
+class CodecTest(TestCase):
+    def assertArraysEqual(self, first, second):
+        self.assertEqual(first.dtype, second.dtype)
+        self.assertEqual(first.shape, second.shape)
+        self.assertEqual(first.tolist(), second.tolist())
+
+    def test_raw(self):
+        for codec in AVAILABLE_CODECS:
+            block = "line\n" * 100
+            self.assertEqual(decode(encode(block, codec).payload), block)
+
+    def test_pickled(self):
+        for codec in AVAILABLE_CODECS:
+            block = [u"line", 1, {'key': (2.5, None)}]
+            self.assertEqual(decode(encode(block, codec).payload), block)
+
+    def test_array(self):
+        for codec in AVAILABLE_CODECS:
+            for block in [arange(100.).reshape(20, 5), arange(7, dtype=int16), zeros((0, 3), dtype=float32)]:
+                self.assertArraysEqual(decode(encode(block, codec).payload), block)
+
+    def test_list_of_arrays(self):
+        block = [arange(10.), array([[1, 2], [3, 4]], dtype=int16), zeros(0)]
+        for codec in AVAILABLE_CODECS:
+            decoded = decode(encode(block, codec).payload)
+            self.assertIsInstance(decoded, list)
+            self.assertEqual(len(decoded), len(block))
+            for decoded_array, array_block in zip(decoded, block):
+                self.assertArraysEqual(decoded_array, array_block)
+
+    def test_shuffle_compresses_numbers(self):
+        block = arange(10000, dtype=float32)
+        self.assertLess(len(encode(block, SHUFFLE_ZLIB)), len(encode(block, ZLIB)))
+
+    def test_payload_names_codec(self):
+        # Decoded by the codec of the payload, whichever codec the dataset has now
+        self.assertEqual(decode(encode("data", BZ2).payload), "data")
+        self.assertNotEqual(encode("data", BZ2).payload, encode("data", ZLIB).payload)
+
+    def test_valid_codecs(self):
+        self.assertTrue(is_valid_codec(None))
+        self.assertTrue(all(is_valid_codec(codec) for codec in CODECS))
+        self.assertFalse(is_valid_codec('gzip'))
+
+
+if __name__ == '__main__':
+    main()
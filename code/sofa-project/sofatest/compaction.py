@@ -0,0 +1,86 @@
+from unittest import TestCase, main
+
+from sofatest.cluster import LocalCluster
+
+TEXT = "\n".join("x" * (i % 17 + 1) for i in range(200))
+
+
+class CompactionTest(TestCase):
+    def setUp(self):
+        self.cluster = LocalCluster(block_size=0.0005, compaction_interval=0, reclamation_interval=0)
+        self.gateway = self.cluster.gateway
+        self.node = self.cluster.storage_nodes[0]
+
+    def tearDown(self):
+        self.cluster.shutdown()
+
+    def __compact(self):
+        self.node._StorageHandler__scheduler_compaction()
+        return self.node.get_cache_statistics(True)[0]['compaction']['compacted-datasets']
+
+    def __num_blocks(self):
+        replica_blocks = self.node._StorageHandler__DISK[0]
+        return sum(replica_blocks.num_blocks(identifier) for identifier in replica_blocks.identifiers())
+
+    def __chars(self, name):
+        return self.cluster.result(name, 'chars')[1][0]
+
+    def test_compacts_appends(self):
+        self.gateway.create('lines', 'sofatest.datasets.LineDataset')
+        for _ in range(4):
+            self.gateway.append('lines', TEXT, False)
+        num_blocks = self.__num_blocks()
+        chars = self.__chars('lines')
+
+        self.assertEqual(self.__compact(), 1)
+        self.assertLess(self.__num_blocks(), num_blocks)
+        self.assertEqual(self.__chars('lines'), chars)
+
+        # Nothing changed since
+        self.assertEqual(self.__compact(), 1)
+
+    def test_pin_during_compaction(self):
+        self.gateway.create('lines', 'sofatest.datasets.LineDataset')
+        for _ in range(4):
+            self.gateway.append('lines', TEXT, False)
+        chars = 4 * (len(TEXT) - TEXT.count("\n"))
+
+        replica_blocks = self.node._StorageHandler__DISK[0]
+        get_blocks = replica_blocks.get_blocks
+
+        def get_blocks_and_compact(identifier, indices=None):
+            # Compacted while pin reads the blocks
+            del replica_blocks.get_blocks
+            blocks = get_blocks(identifier, indices)
+            self.node._StorageHandler__compact(0, replica_blocks, identifier)
+            return blocks
+
+        replica_blocks.get_blocks = get_blocks_and_compact
+        self.gateway.pin('lines', True)
+        self.assertNotIn('get_blocks', replica_blocks.__dict__)
+
+        # Not swapped under the pinned blocks
+        self.assertEqual(self.node.get_cache_statistics(True)[0]['compaction']['compacted-datasets'], 0)
+        self.assertEqual(self.__chars('lines'), chars)
+
+    def test_keeps_split_blocks(self):
+        # Blocks of a single append are already split as they would be compacted
+        self.gateway.create('lines', 'sofatest.datasets.LineDataset')
+        self.gateway.append('lines', TEXT * 4, False)
+        num_blocks = self.__num_blocks()
+
+        self.assertEqual(self.__compact(), 0)
+        self.assertEqual(self.__num_blocks(), num_blocks)
+
+    def test_keeps_tiles(self):
+        self.gateway.create('tiles', 'sofatest.datasets.TiledLineDataset')
+        for _ in range(4):
+            self.gateway.append('tiles', TEXT, False)
+        num_blocks = self.__num_blocks()
+
+        self.assertEqual(self.__compact(), 0)
+        self.assertEqual(self.__num_blocks(), num_blocks)
+
+
+if __name__ == '__main__':
+    main()
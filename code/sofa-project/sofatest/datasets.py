@@ -0,0 +1,175 @@
+"""
+Datasets of the tests, which are loaded by the storage nodes from the source of this module.
+"""
+
+from cPickle import dumps, loads
+from functools import partial
+from os import getpid
+from threading import current_thread
+
+from sofa.foundation.base import SofaBaseObject
+from sofa.foundation.operation import OperationContext, ExpectedReturnType, ExecutionMode
+from sofa.foundation.strategy import Tiles
+
+FAILING_LINE = 'fail'
+BROKEN_LINE = 'broken'
+
+
+def lengths(blocks):
+    # Map functions are generators, as wrapped by the import utils of the templates
+    for block in blocks:
+        yield sum(len(line) for line in block)
+
+
+def total(blocks):
+    return sum(blocks)
+
+
+def maxes(blocks):
+    return max(blocks)
+
+
+def explode(blocks):
+    raise ValueError("Blocks can't be reduced")
+
+
+def chunk_ids(blocks):
+    # The chunk of each block, if it's evaluated by the thread which called the map function on the chunk
+    caller = current_thread()
+    return (id(blocks) if current_thread() is caller else None for _ in blocks)
+
+
+def count_chunks(blocks):
+    return None if None in blocks else len(set(blocks))
+
+
+def same(blocks):
+    return blocks
+
+
+def flatten(blocks):
+    # The lines of every block with its ghosts, which are lists of lines or None at the ends
+    return [sum([lines or [] for lines in block], []) if isinstance(block, tuple) else block for block in blocks]
+
+
+def line_counts(blocks):
+    return [len(block) for block in blocks]
+
+
+def pids(blocks):
+    for _ in blocks:
+        yield getpid()
+
+
+def distinct(blocks):
+    return sorted(set(blocks))
+
+
+class LineDataset(SofaBaseObject):
+    def preprocess(self, data_ref):
+        return data_ref
+
+    def next_entry(self, data):
+        return data.splitlines()
+
+    def get_functions(self):
+        return [lengths, total, maxes, explode]
+
+    def verify_function(self, function_name):
+        functions = {function.func_name: function for function in self.get_functions()}
+        if function_name in functions:
+            return functions[function_name]
+
+        return SofaBaseObject.verify_function(self, function_name)
+
+    def get_operations(self):
+        return [OperationContext.by(self, "chars", "[lengths, total]")
+                .with_expected_return_type(ExpectedReturnType.Number),
+                OperationContext.by(self, "explode", "[lengths, explode]")
+                .with_expected_return_type(ExpectedReturnType.Number)]
+
+
+class MemoizedLineDataset(LineDataset):
+    def get_operations(self):
+        return [OperationContext.by(self, "chars", "[lengths, total]").with_memoized_map()
+                .with_expected_return_type(ExpectedReturnType.Number),
+                OperationContext.by(self, "longest", "[lengths, maxes]").with_memoized_map()
+                .with_expected_return_type(ExpectedReturnType.Number)]
+
+
+class SerializedLineDataset(LineDataset):
+    def serialize(self, data):
+        return dumps(data, 2)
+
+    def deserialize(self, data):
+        return loads(data)
+
+    def is_serialized(self):
+        return True
+
+
+class FailingLineDataset(SerializedLineDataset):
+    def serialize(self, data):
+        if isinstance(data, list) and FAILING_LINE in data:
+            # Not stored by the storage nodes, which only stores ascii blocks
+            return u'\xe9'
+        return SerializedLineDataset.serialize(self, data)
+
+    def get_block_summary(self, block):
+        if BROKEN_LINE in block:
+            raise ValueError("Block can't be summarized")
+        return SerializedLineDataset.get_block_summary(self, block)
+
+
+class TiledLineDataset(LineDataset):
+    def get_distribution_strategy(self):
+        return Tiles(2)
+
+
+class ReplicatedLineDataset(LineDataset):
+    def get_replication_factor(self):
+        return 3
+
+
+class ThreadedLineDataset(LineDataset):
+    def get_functions(self):
+        return LineDataset.get_functions(self) + [chunk_ids, count_chunks]
+
+    def get_operations(self):
+        return [OperationContext.by(self, "chars", "[lengths, total]")
+                .with_execution_mode(ExecutionMode.Threads)
+                .with_expected_return_type(ExpectedReturnType.Number),
+                OperationContext.by(self, "chunks", "[chunk_ids, count_chunks]")
+                .with_execution_mode(ExecutionMode.Threads)
+                .with_expected_return_type(ExpectedReturnType.Number)]
+
+
+class ProcessesLineDataset(LineDataset):
+    def get_functions(self):
+        return LineDataset.get_functions(self) + [pids, distinct]
+
+    def verify_function(self, function_name):
+        if function_name == 'bound_pids':
+            # Not found by its name, hence can't be sent to the map processes
+            return partial(pids)
+        return LineDataset.verify_function(self, function_name)
+
+    def get_operations(self):
+        return [OperationContext.by(self, "chars", "[lengths, total]")
+                .with_execution_mode(ExecutionMode.Processes)
+                .with_expected_return_type(ExpectedReturnType.Number),
+                OperationContext.by(self, "pids", "[pids, distinct]")
+                .with_execution_mode(ExecutionMode.Processes)
+                .with_expected_return_type(ExpectedReturnType.Number),
+                OperationContext.by(self, "bound-pids", "[bound_pids, distinct]")
+                .with_execution_mode(ExecutionMode.Processes)
+                .with_expected_return_type(ExpectedReturnType.Number)]
+
+
+class NeighborLineDataset(LineDataset):
+    def get_functions(self):
+        return LineDataset.get_functions(self) + [same, line_counts]
+
+    def get_operations(self):
+        return [OperationContext.by(self, "lines", "[same, neighborhood:1:1, modify:flatten, line_counts, total]")
+                .with_expected_return_type(ExpectedReturnType.Number)]
@@ -0,0 +1,47 @@
+from threading import Event, Thread, current_thread
+from unittest import TestCase, main
+
+from sofa.foundation.executor import BoundedExecutor
+
+
+class BoundedExecutorTest(TestCase):
+    def setUp(self):
+        self.executor = BoundedExecutor(2, queue_size=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_map_in_order(self):
+        self.assertEqual(self.executor.map(lambda value: value * 2, range(20)), range(0, 40, 2))
+
+    def test_map_by_worker(self):
+        # Executed by the worker itself, which would otherwise wait for the other worker of the pool
+        def nested(value):
+            caller = current_thread()
+            return self.executor.map(lambda _: current_thread() is caller, range(4))
+
+        self.assertEqual(self.executor.map(nested, range(2)), [[True] * 4] * 2)
+
+    def test_submit_waits_when_full(self):
+        release = Event()
+        self.executor.map_async(lambda _: release.wait(), range(2))
+
+        submitter = Thread(target=self.executor.map_async, args=(lambda _: None, range(1)))
+        submitter.start()
+        submitter.join(0.1)
+        self.assertTrue(submitter.is_alive())
+
+        release.set()
+        submitter.join()
+        self.assertFalse(submitter.is_alive())
+
+    def test_shutdown_executes_queued(self):
+        executed = []
+        self.executor.map_async(executed.append, range(4))
+        self.executor.shutdown()
+
+        self.assertEqual(sorted(executed), range(4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+from unittest import TestCase, main
+
+from sofa.error import is_error, STATUS_SUCCESS
+from sofatest.cluster import LocalCluster
+
+TEXT = "\n".join("x" * (i % 17 + 1) for i in range(200))
+
+
+class FailingJobTest(TestCase):
+    num_storage_nodes = 1
+
+    def setUp(self):
+        self.cluster = LocalCluster(self.num_storage_nodes, block_size=0.0005)
+        self.gateway = self.cluster.gateway
+        self.gateway.create('lines', 'sofatest.datasets.SerializedLineDataset')
+        self.gateway.append('lines', TEXT, False)
+
+    def tearDown(self):
+        self.cluster.shutdown()
+
+    def __jobs(self):
+        return [node._StorageHandler__jobs for node in self.cluster.storage_nodes]
+
+    def test_reports_failure(self):
+        status, _ = self.cluster.result('lines', 'explode')
+        self.assertTrue(is_error(status))
+        self.assertEqual(self.__jobs(), [{}] * self.num_storage_nodes)
+
+        # Executed again, rather than processing forever
+        status, _ = self.cluster.result('lines', 'explode')
+        self.assertTrue(is_error(status))
+
+    def test_other_jobs_after_failure(self):
+        self.cluster.result('lines', 'explode')
+
+        status, (res, _) = self.cluster.result('lines', 'chars')
+        self.assertEqual(status, STATUS_SUCCESS)
+        self.assertEqual(res, len(TEXT) - TEXT.count("\n"))
+        self.assertEqual(self.__jobs(), [{}] * self.num_storage_nodes)
+
+
+class DistributedFailingJobTest(FailingJobTest):
+    num_storage_nodes = 3
+
+
+if __name__ == '__main__':
+    main()
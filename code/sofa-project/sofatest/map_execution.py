@@ -0,0 +1,67 @@
+from os import getpid
+from unittest import TestCase, main
+
+from sofa.error import STATUS_SUCCESS
+from sofatest.cluster import LocalCluster
+
+TEXT = "\n".join("x" * (i % 17 + 1) for i in range(400))
+
+
+class MapTest(TestCase):
+    dataset = 'sofatest.datasets.ThreadedLineDataset'
+    options = {}
+
+    def setUp(self):
+        self.cluster = LocalCluster(block_size=0.0005, **self.options)
+        self.gateway = self.cluster.gateway
+        self.gateway.create('lines', self.dataset)
+        self.gateway.append('lines', TEXT, False)
+
+    def tearDown(self):
+        self.cluster.shutdown()
+
+    def result(self, function):
+        status, (res, _) = self.cluster.result('lines', function)
+        self.assertEqual(status, STATUS_SUCCESS)
+        return res
+
+
+class ThreadsMapTest(MapTest):
+    def test_chunks(self):
+        self.assertEqual(self.result('chars'), len(TEXT) - TEXT.count("\n"))
+
+    def test_chunks_are_evaluated_by_workers(self):
+        # Computed on every block at once, until it's known to return an output per block
+        self.assertEqual(self.result('chunks'), 1)
+
+        self.gateway.append('lines', TEXT, False)
+        self.assertGreater(self.result('chunks'), 1)
+
+
+class ProcessesMapTest(MapTest):
+    dataset = 'sofatest.datasets.ProcessesLineDataset'
+    options = {'map_processes': 2}
+
+    def test_chunks(self):
+        self.assertEqual(self.result('chars'), len(TEXT) - TEXT.count("\n"))
+        self.gateway.append('lines', TEXT, False)
+        self.assertEqual(self.result('chars'), 2 * (len(TEXT) - TEXT.count("\n")))
+
+    def test_generators_are_consumed_by_processes(self):
+        # Computed on every block at once, until it's known to return an output per block
+        self.assertEqual(self.result('pids'), [getpid()])
+
+        self.gateway.append('lines', TEXT, False)
+        pids = self.result('pids')
+        self.assertGreater(len(pids), 0)
+        self.assertNotIn(getpid(), pids)
+
+    def test_unsendable_function_is_computed_by_node(self):
+        self.assertEqual(self.result('bound-pids'), [getpid()])
+
+        self.gateway.append('lines', TEXT, False)
+        self.assertEqual(self.result('bound-pids'), [getpid()])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+from unittest import TestCase, main
+
+from sofa.error import STATUS_SUCCESS
+from sofatest.cluster import LocalCluster
+
+TEXT = "\n".join("x" * (i % 17 + 1) for i in range(200))
+
+
+class MemoizedMapTest(TestCase):
+    def setUp(self):
+        self.cluster = LocalCluster(block_size=0.0005)
+        self.gateway = self.cluster.gateway
+        self.gateway.create('memo', 'sofatest.datasets.MemoizedLineDataset')
+        self.gateway.append('memo', TEXT, False)
+
+    def tearDown(self):
+        self.cluster.shutdown()
+
+    def __result(self, function):
+        status, (res, _) = self.cluster.result('memo', function)
+        self.assertEqual(status, STATUS_SUCCESS)
+        return res
+
+    def __map_outputs(self):
+        return self.gateway.get_cache_statistics()['storage'][0]['map-outputs']
+
+    def test_reuses_outputs(self):
+        self.assertEqual(self.__result('chars'), len(TEXT) - TEXT.count("\n"))
+        outputs = self.__map_outputs()
+        self.assertGreater(outputs['entries'], 1)
+        self.assertEqual(outputs['hits'], 0)
+
+        # By another operation with the same map function
+        self.assertGreater(self.__result('longest'), 0)
+        self.assertEqual(self.__map_outputs()['hits'], outputs['entries'])
+        self.assertEqual(self.__map_outputs()['entries'], outputs['entries'])
+
+    def test_append_invalidates(self):
+        self.__result('chars')
+        self.gateway.append('memo', "\n" + "y" * 30, False)
+        self.assertEqual(self.__result('chars'), len(TEXT) - TEXT.count("\n") + 30)
+
+    def test_delete_invalidates(self):
+        self.__result('chars')
+        self.gateway.delete('memo')
+
+        # The blocks of the deleted dataset are purged in the background, but their outputs are never used
+        self.gateway.create('memo', 'sofatest.datasets.MemoizedLineDataset')
+        self.gateway.append('memo', "y" * 30, False)
+        self.assertEqual(self.__result('chars'), 30)
+        self.assertEqual(self.__map_outputs()['entries'], 1)
+
+
+if __name__ == '__main__':
+    main()
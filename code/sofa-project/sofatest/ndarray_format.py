@@ -0,0 +1,64 @@
+from cPickle import dumps, loads
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from numpy import arange, zeros, ndarray
+
+from sofa.storage.block_log import BlockLog
+from sofa.storage.ndarray_format import share_block, open_shared_block, MappedBlock
+
+
+class NdarrayFormatTest(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.log = BlockLog(self.directory)
+
+    def tearDown(self):
+        self.log.close()
+        rmtree(self.directory)
+
+    def test_array_block(self):
+        self.log.append("a", arange(12.).reshape(3, 4))
+        block = self.log.get("a", 0)
+
+        self.assertEqual(block.shape, (3, 4))
+        self.assertEqual(block.sum(), 66.)
+        self.assertFalse(block.flags.writeable)
+
+    def test_list_block_is_mapped_once(self):
+        rows = [arange(i, i + 3, dtype='i4') for i in xrange(20000)] + [zeros((0,))]
+        self.log.append("a", rows)
+        block = self.log.get("a", 0)
+
+        self.assertEqual(len(block), len(rows))
+        self.assertEqual(block[19999].tolist(), [19999, 20000, 20001])
+        self.assertEqual(block[-1].shape, (0,))
+        # Every array is a view of the same mapping of the payload
+        self.assertEqual(len(set(id(array.base) for array in block[:-1])), 1)
+
+    def test_share_block(self):
+        rows = [arange(i, i + 3.) for i in xrange(100)]
+        self.log.append("a", rows)
+        shared = share_block(self.log.get("a", 0))
+
+        self.assertTrue(isinstance(shared, MappedBlock))
+        block = open_shared_block(loads(dumps(shared, 2)))
+        self.assertEqual([row.tolist() for row in block], [row.tolist() for row in rows])
+
+    def test_share_array_slice(self):
+        self.log.append("a", arange(100.).reshape(10, 10))
+        shared = share_block(self.log.get("a", 0)[2:4])
+
+        self.assertTrue(isinstance(shared, MappedBlock))
+        self.assertEqual(open_shared_block(shared).tolist(), arange(20., 40.).reshape(2, 10).tolist())
+
+    def test_share_unmapped_block(self):
+        block = [arange(3.), arange(4.)]
+        self.assertTrue(share_block(block) is block)
+        self.assertTrue(share_block(["a", "b"]) == ["a", "b"])
+        self.assertTrue(isinstance(open_shared_block(arange(3.)), ndarray))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+from threading import Thread
+from unittest import TestCase, main
+
+from sofa.error import STATUS_SUCCESS
+from sofatest.cluster import LocalCluster
+
+TEXT = "\n".join("x" * (i % 5 + 1) for i in range(100))
+
+
+class NeighborhoodTest(TestCase):
+    def setUp(self):
+        self.cluster = LocalCluster(block_size=0.0005)
+        self.gateway = self.cluster.gateway
+
+    def tearDown(self):
+        self.cluster.shutdown()
+
+    def create(self, name):
+        self.gateway.create(name, 'sofatest.datasets.NeighborLineDataset')
+        self.gateway.append(name, TEXT, False)
+
+    def expected(self):
+        # Every block has the last line of the block before it and the first line of the block after it
+        replica_blocks = self.cluster.storage_nodes[0]._StorageHandler__DISK[0]
+        num_blocks = replica_blocks.num_blocks(replica_blocks.identifiers()[0])
+        return TEXT.count("\n") + 1 + 2 * (num_blocks - 1)
+
+    def lines(self, name):
+        status, (res, _) = self.cluster.result(name, 'lines')
+        self.assertEqual(status, STATUS_SUCCESS)
+        return res
+
+    def test_neighborhood(self):
+        self.create('lines')
+        self.assertEqual(self.lines('lines'), self.expected())
+
+    def test_neighborhood_twice(self):
+        # The datasets share the operation of their class, where the first job sets its ghosts
+        self.create('first')
+        self.create('second')
+        self.assertEqual(self.lines('first'), self.expected())
+        self.assertEqual(self.lines('second'), self.expected())
+
+    def test_neighborhood_by_threads(self):
+        names = ['first', 'second', 'third', 'fourth']
+        for name in names:
+            self.create(name)
+
+        results = {}
+
+        def run(name):
+            results[name] = self.cluster.result(name, 'lines')
+
+        threads = [Thread(target=run, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {name: (STATUS_SUCCESS, (self.expected(), False)) for name in names})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+from unittest import TestCase, main
+
+from sofatest.cluster import LocalCluster
+
+TEXT = "\n".join("x" * (i % 17 + 1) for i in range(200))
+CHARS = len(TEXT) - TEXT.count("\n")
+
+
+class PinTest(TestCase):
+    def setUp(self):
+        self.cluster = LocalCluster(block_size=0.0005)
+        self.gateway = self.cluster.gateway
+
+    def tearDown(self):
+        self.cluster.shutdown()
+
+    def __blocks(self):
+        return self.gateway.get_cache_statistics()['storage'][0]['blocks']
+
+    def __pin(self, package):
+        self.gateway.create('pinned', package)
+        self.gateway.append('pinned', TEXT, False)
+        self.gateway.pin('pinned', True)
+
+        pinned = self.__blocks()
+        self.assertGreater(pinned['pinned-entries'], 1)
+        self.assertEqual(self.cluster.result('pinned', 'chars')[1][0], CHARS)
+        # Read from the pinned blocks only
+        self.assertEqual(self.__blocks()['misses'], pinned['misses'])
+
+    def test_pin(self):
+        self.__pin('sofatest.datasets.LineDataset')
+
+    def test_pin_serialized(self):
+        self.__pin('sofatest.datasets.SerializedLineDataset')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+from inspect import getsourcefile
+from threading import Event, Thread
+from unittest import TestCase, main
+
+from sofa.error import STATUS_NOT_FOUND
+from sofa.handler import storage
+from sofa.handler.storage import MAX_PLANS, _get_plan, _get_contexts, _get_function, _forget_plans
+from sofa.secure import secure
+from sofatest import datasets
+
+
+def _meta_data(class_name, num_blocks=1, variant=None):
+    with open(getsourcefile(datasets), "r") as f:
+        source = f.read()
+    if variant is not None:
+        # Another source with the same classes
+        source += "\n# %d\n" % variant
+    digest, source = secure(source)
+    return {'digest': digest, 'source': source, 'class-name': class_name, 'num-blocks': num_blocks}
+
+
+class PlanCacheTest(TestCase):
+    def test_compiled_once(self):
+        plan = _get_plan(_meta_data('LineDataset'))
+        self.assertIs(_get_plan(_meta_data('LineDataset')), plan)
+        self.assertEqual(sorted(plan.operations.keys()), ['chars', 'explode'])
+
+    def test_by_class(self):
+        # Several classes can share the source
+        self.assertIsNot(_get_plan(_meta_data('LineDataset')), _get_plan(_meta_data('MemoizedLineDataset')))
+
+    def test_contexts(self):
+        operation_context, class_context = _get_contexts('chars', _meta_data('LineDataset'))
+        self.assertEqual(operation_context.fun_name, 'chars')
+        self.assertIs(class_context, _get_plan(_meta_data('LineDataset')).class_context)
+
+        self.assertEqual(_get_contexts('missing', _meta_data('LineDataset')), STATUS_NOT_FOUND)
+        self.assertEqual(_get_contexts('chars', _meta_data('LineDataset', num_blocks=0)), STATUS_NOT_FOUND)
+
+    def test_functions_resolved_once(self):
+        function = _get_function(_meta_data('NeighborLineDataset'), 'flatten')
+        self.assertEqual(function([(["a"], ["b"], None)]), [["a", "b"]])
+        self.assertIs(_get_function(_meta_data('NeighborLineDataset'), 'flatten'), function)
+
+    def test_bounded(self):
+        first = _get_plan(_meta_data('LineDataset', variant=0))
+        for variant in xrange(1, MAX_PLANS + 1):
+            _get_plan(_meta_data('LineDataset', variant=variant))
+
+        # The least recently used is compiled again
+        self.assertIsNot(_get_plan(_meta_data('LineDataset', variant=0)), first)
+        self.assertLessEqual(len(storage._plans.keys()), MAX_PLANS)
+
+    def test_forget(self):
+        meta_data = _meta_data('LineDataset', variant=-1)
+        plan = _get_plan(meta_data)
+        _forget_plans(meta_data['digest'])
+        self.assertIsNot(_get_plan(meta_data), plan)
+
+    def test_compiled_without_lock(self):
+        slow = _meta_data('LineDataset', variant=-2)
+        loading = Event()
+        release = Event()
+        secure_load = storage.secure_load
+
+        def slow_secure_load(digest, source):
+            if digest == slow['digest']:
+                loading.set()
+                release.wait()
+            return secure_load(digest, source)
+
+        storage.secure_load = slow_secure_load
+        try:
+            plans = []
+            thread = Thread(target=lambda: plans.append(_get_plan(slow)))
+            thread.start()
+            loading.wait()
+
+            # Other datasets are compiled while the slow one is
+            other = Thread(target=lambda: _get_plan(_meta_data('LineDataset', variant=-3)))
+            other.start()
+            other.join(5)
+            self.assertFalse(other.is_alive())
+        finally:
+            release.set()
+            thread.join()
+            storage.secure_load = secure_load
+
+        self.assertIs(_get_plan(slow), plans[0])
+
+
+if __name__ == '__main__':
+    main()
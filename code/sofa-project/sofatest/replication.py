@@ -0,0 +1,183 @@
+from random import random
+from threading import Lock, Thread
+from time import sleep
+from unittest import TestCase, main
+
+from sofa.delegation import DelegationHandler, ForwardQueue, FunctionDelegation
+from sofa.delegation.queue import with_required_queue
+from sofa.error import STATUS_SUCCESS, is_error
+from sofatest.cluster import LocalCluster
+
+TEXT = "\n".join("x" * (i % 17 + 1) for i in range(100))
+NUM_STORAGE_NODES = 3
+
+
+class ForwardQueueTest(TestCase):
+    def test_forwards_in_order(self):
+        queue = ForwardQueue()
+        forwarded = []
+
+        def forward(i):
+            sleep(random() * 0.005)
+            forwarded.append(i)
+
+        for i in range(50):
+            queue.put(lambda i=i: forward(i))
+        queue.join()
+        self.assertEqual(forwarded, range(50))
+
+        # Started again by forwards after the queue ran empty
+        queue.put(lambda: forward(50))
+        queue.join()
+        self.assertEqual(forwarded, range(51))
+
+
+class _ChainNode(DelegationHandler):
+    def __init__(self, my_idx, chain, writes):
+        DelegationHandler.__init__(self, my_idx, len(chain))
+        self.__chain = chain
+        self.__writes = writes
+
+    def get_responsible(self, index):
+        return self.__chain[index]
+
+    def get_num_storage_nodes(self, including_self=False):
+        return len(self.__chain) if including_self else len(self.__chain) - 1
+
+    def get_replication_factor(self, identifier):
+        return len(self.__chain)
+
+    def get_replication_ack(self):
+        return 'all'
+
+    @with_required_queue
+    def append(self, function_delegation, identifier, block):
+        if block is None:
+            raise ValueError("No block")
+        self.__writes.start(self.me(), block)
+        sleep(0.05)
+        self.__writes.end(self.me(), block)
+        return STATUS_SUCCESS
+
+
+class _Writes(object):
+    def __init__(self):
+        self.__lock = Lock()
+        self.__writing = set()
+        self.max_overlap = 0
+        self.order = {}
+
+    def start(self, node_idx, block):
+        with self.__lock:
+            self.__writing.add(node_idx)
+            self.max_overlap = max(self.max_overlap, len(self.__writing))
+            self.order.setdefault(node_idx, []).append(block)
+
+    def end(self, node_idx, block):
+        with self.__lock:
+            self.__writing.discard(node_idx)
+
+
+class ChainReplicationTest(TestCase):
+    def test_replicas_write_concurrently_in_order(self):
+        writes = _Writes()
+        chain = []
+        chain.extend(_ChainNode(idx, chain, writes) for idx in range(NUM_STORAGE_NODES))
+
+        for block in range(5):
+            fd = FunctionDelegation("dataset").as_required_queue_delegation(None, NUM_STORAGE_NODES)
+            self.assertEqual(chain[0].append(fd, "dataset", block), STATUS_SUCCESS)
+
+        # Every replica writes while the rest of the chain does, not after it
+        self.assertEqual(writes.max_overlap, NUM_STORAGE_NODES)
+        for node in chain:
+            node.wait_for_forwards()
+        self.assertEqual(writes.order, {idx: range(5) for idx in range(NUM_STORAGE_NODES)})
+
+    def __append_sequence(self, blocks):
+        writes = _Writes()
+        chain = []
+        chain.extend(_ChainNode(idx, chain, writes) for idx in range(NUM_STORAGE_NODES))
+
+        statuses = {}
+
+        def append(position, block):
+            fd = FunctionDelegation("dataset").as_required_queue_delegation(None, NUM_STORAGE_NODES)
+            fd['sequence'] = "stream", position
+            try:
+                statuses[position] = chain[0].append(fd, "dataset", block)
+            except ValueError:
+                statuses[position] = None
+
+        # Arriving in the reverse order
+        threads = [Thread(target=append, args=(position, blocks[position]))
+                   for position in reversed(range(len(blocks)))]
+        for thread in threads:
+            thread.start()
+            sleep(0.01)
+        for thread in threads:
+            thread.join()
+        for node in chain:
+            node.wait_for_forwards()
+        return writes, statuses
+
+    def test_sequence_in_order(self):
+        writes, statuses = self.__append_sequence(range(5))
+        self.assertEqual(statuses, {position: STATUS_SUCCESS for position in range(5)})
+        self.assertEqual(writes.order, {idx: range(5) for idx in range(NUM_STORAGE_NODES)})
+
+    def test_sequence_after_failed_write(self):
+        writes, statuses = self.__append_sequence([0, 1, None, 3, 4])
+        self.assertIsNone(statuses[2])
+        self.assertTrue(is_error(statuses[3]) and is_error(statuses[4]))
+        self.assertEqual(writes.order, {idx: [0, 1] for idx in range(NUM_STORAGE_NODES)})
+
+
+class QuorumReplicationTest(TestCase):
+    def setUp(self):
+        self.cluster = LocalCluster(NUM_STORAGE_NODES, block_size=0.0005, replication_ack='quorum')
+        self.gateway = self.cluster.gateway
+
+    def tearDown(self):
+        self.cluster.shutdown()
+
+    def __blocks(self, node_idx, replica_index):
+        replica_blocks = self.cluster.storage_nodes[node_idx]._StorageHandler__DISK.get(replica_index)
+        if replica_blocks is None:
+            return []
+        return [block for identifier in replica_blocks.identifiers() for block in replica_blocks.get_blocks(identifier)]
+
+    def __assert_replicated(self):
+        # The tail of the chain isn't waited for by the appends
+        for node in self.cluster.storage_nodes:
+            node.wait_for_forwards()
+
+        for node_idx in range(NUM_STORAGE_NODES):
+            primary = self.__blocks(node_idx, 0)
+            for replica_index in range(1, NUM_STORAGE_NODES):
+                replica_idx = (node_idx + replica_index) % NUM_STORAGE_NODES
+                self.assertEqual(self.__blocks(replica_idx, replica_index), primary)
+        self.assertGreater(sum(len(self.__blocks(node_idx, 0)) for node_idx in range(NUM_STORAGE_NODES)), 0)
+
+    def test_appends_reach_every_replica(self):
+        self.gateway.create('lines', 'sofatest.datasets.ReplicatedLineDataset')
+        for i in range(5):
+            self.gateway.append('lines', TEXT + "\n" + "y" * i, i % 2 == 0)
+
+        self.__assert_replicated()
+
+    def test_create_is_forwarded_before_appends(self):
+        # A create reaching a replica after the appends would drop their blocks
+        for i in range(3):
+            self.gateway.create('lines', 'sofatest.datasets.ReplicatedLineDataset')
+            self.gateway.append('lines', TEXT, False)
+            self.__assert_replicated()
+            self.gateway.delete('lines')
+            for node in self.cluster.storage_nodes:
+                for replica_blocks in node._StorageHandler__DISK.values():
+                    for identifier in replica_blocks.identifiers():
+                        node.purge(identifier)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+from threading import Event
+from unittest import TestCase, main
+
+from sofa.foundation.scheduler import BackgroundDaemonScheduler
+
+
+class SchedulerTest(TestCase):
+    def test_shutdown(self):
+        executed = Event()
+        scheduler = BackgroundDaemonScheduler()
+        scheduler.add_job(executed.set, 'interval', seconds=0.01)
+        scheduler.start()
+
+        self.assertTrue(executed.wait(5))
+        scheduler.shutdown()
+        self.assertFalse(scheduler.running)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+from unittest import TestCase, main
+
+from sofa.tree_barrier import TreeBarrier
+
+
+def _reduce(nodes, root):
+    # Reduces the set of every node along the barriers, as the storage nodes do, and returns the root and its set
+    barriers = {node: TreeBarrier(node, nodes, root) for node in nodes}
+    results = {node: {node} for node in nodes}
+    received = {node: {} for node in nodes}
+    iterations = {node: 0 for node in nodes}
+    finished = {}
+
+    while len(finished) < len(nodes):
+        progressed = False
+        for node in nodes:
+            if node in finished:
+                continue
+
+            barrier = barriers[node]
+            try:
+                while not barrier.should_send(iterations[node]):
+                    if barrier.should_receive(iterations[node]):
+                        if iterations[node] not in received[node]:
+                            break
+                        results[node] |= received[node].pop(iterations[node])
+                    iterations[node] += 1
+                else:
+                    receiver = barrier.get_receiver()
+                    assert iterations[node] not in received[receiver]
+                    received[receiver][iterations[node]] = results[node]
+                    finished[node] = False
+                    progressed = True
+            except StopIteration:
+                finished[node] = True
+                progressed = True
+
+        assert progressed, "Reduction is stuck"
+
+    roots = [node for node, is_root in finished.items() if is_root]
+    return roots, results[roots[0]]
+
+
+class TreeBarrierTest(TestCase):
+    def test_reaches_root(self):
+        for num_nodes in range(1, 10):
+            nodes = ['node:%d' % index for index in range(num_nodes)]
+            for root in nodes:
+                roots, result = _reduce(nodes, root)
+                self.assertEqual(roots, [root])
+                self.assertEqual(result, set(nodes))
+
+    def test_sends_once(self):
+        nodes = ['node:%d' % index for index in range(5)]
+        barrier = TreeBarrier('node:1', nodes, 'node:0')
+        self.assertTrue(barrier.should_send(0))
+        self.assertEqual(barrier.get_receiver(), 'node:0')
+        self.assertFalse(barrier.should_send(1))
+
+
+if __name__ == '__main__':
+    main()
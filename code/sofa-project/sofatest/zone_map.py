@@ -0,0 +1,42 @@
+from unittest import TestCase, main
+
+from numpy import arange, array, nan, full
+
+from sofa.storage.zone_map import summarize, merge, has_bounds, COUNT, MIN, MAX, MIN_LENGTH, MAX_LENGTH
+
+
+class ZoneMapTest(TestCase):
+    def test_summarize_rows(self):
+        summary = summarize(arange(20.).reshape(4, 5))
+        self.assertEqual(summary, {COUNT: 4, MIN: 0., MAX: 19.})
+        self.assertTrue(has_bounds(summary))
+
+    def test_summarize_entries(self):
+        self.assertEqual(summarize([3, 1.5, arange(4)]), {COUNT: 3, MIN: 0, MAX: 3})
+        self.assertEqual(summarize(['a', 'abc']), {COUNT: 2, MIN_LENGTH: 1, MAX_LENGTH: 3})
+        self.assertEqual(summarize([]), {COUNT: 0})
+
+    def test_summarize_ignores_nan(self):
+        self.assertEqual(summarize(array([[nan, 2.], [1., nan]])), {COUNT: 2, MIN: 1., MAX: 2.})
+        self.assertEqual(summarize([full(3, nan), arange(3.)]), {COUNT: 2, MIN: 0., MAX: 2.})
+
+    def test_summarize_only_nan(self):
+        for block in [full((3, 2), nan), [full(3, nan), nan]]:
+            summary = summarize(block)
+            self.assertEqual(summary, {COUNT: len(block), MIN: None, MAX: None})
+            self.assertFalse(has_bounds(summary))
+
+    def test_merge(self):
+        merged = merge(summarize(arange(5.)), summarize(arange(3., 9.)))
+        self.assertEqual(merged, {COUNT: 11, MIN: 0., MAX: 8.})
+        self.assertEqual(merge(summarize([]), summarize(['ab'])), {COUNT: 1, MIN_LENGTH: 2, MAX_LENGTH: 2})
+        self.assertIsNone(merge(None, summarize(arange(5.))))
+
+    def test_merge_only_nan(self):
+        merged = merge(summarize(arange(5.)), summarize(full(2, nan)))
+        self.assertEqual(merged, {COUNT: 7, MIN: None, MAX: None})
+        self.assertFalse(has_bounds(merged))
+
+
+if __name__ == '__main__':
+    main()